@@ -0,0 +1,31 @@
+""" step time and transient memory of Age_SIRVD's copying and in-place stepping; run from the repository root with `python -m benchmarks.bench_age_sirvd` """
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+
+from epimargin.models import Age_SIRVD
+
+def bench(inplace: bool, sims: int, days: int, bins: int = 7):
+    N = np.random.default_rng(0).integers(10000, 100000, bins).astype(float)
+    model = Age_SIRVD("unit", N.sum(), dT0 = np.full(sims, 100.0), Rt0 = 1.3, S0 = np.tile(N * 0.9, (sims, 1)), I0 = np.tile(N * 0.05, (sims, 1)),
+        R0 = np.tile(N * 0.05, (sims, 1)), D0 = np.zeros((sims, bins)), num_age_bins = bins, random_seed = 1, inplace = inplace)
+    model.reserve(days)
+    dV = np.tile(np.arange(bins) * 10.0, (sims, 1))
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(days):
+        model.parallel_forward_epi_step(dV, num_sims = sims)
+    elapsed = time.perf_counter() - start
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{'in-place' if inplace else 'copying':<9} {sims:>6} sims: {1e3 * elapsed/days:7.2f} ms/step, transient peak {(peak - current)/1e6:6.1f} MB")
+
+if __name__ == "__main__":
+    warnings.simplefilter("ignore")
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    for sims in (2000, 10000):
+        for inplace in (False, True):
+            bench(inplace, sims, days)
@@ -0,0 +1,40 @@
+""" 
+get_time_series against the per-group lambda and apply it replaced (the reference implementation the tests check 
+against), on a synthetic line list; run from the repository root with `python -m benchmarks.bench_get_time_series [rows]`
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from epimargin.etl.covid19india import get_time_series
+from tests.test_covid19india import reference_time_series
+
+def line_list(rows: int, states: int = 36, districts: int = 40, days: int = 220, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    state    = rng.integers(states, size = rows)
+    district = state * districts + rng.integers(districts, size = rows)
+    counts   = rng.integers(1, 20, size = rows).astype(float)
+    counts[rng.random(rows) < 0.01] *= -1 # corrections
+    return pd.DataFrame({
+        "detected_state":     pd.Series([f"State {i}" for i in range(states)]).values[state],
+        "detected_district":  pd.Series([f"District {i}" for i in range(states * districts)]).values[district],
+        "status_change_date": pd.Timestamp("2020-03-01") + pd.to_timedelta(rng.integers(days, size = rows), unit = "D"),
+        "current_status":     np.array(["Hospitalized", "Recovered", "Deceased"])[rng.choice(3, size = rows, p = [0.5, 0.45, 0.05])],
+        "num_cases":          counts
+    })
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 3_000_000
+    df = line_list(rows)
+    print(f"{rows} rows")
+    for group_col in (None, "detected_state", ["detected_state", "detected_district"]):
+        start = time.perf_counter()
+        expected = reference_time_series(df, group_col)
+        before = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = get_time_series(df, group_col)
+        after = time.perf_counter() - start
+        pd.testing.assert_frame_equal(actual, expected)
+        print(f"group by {group_col}: {before:.2f}s -> {after:.2f}s, outputs equal")
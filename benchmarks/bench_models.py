@@ -0,0 +1,45 @@
+""" step and draw throughput of the stochastic models; run from the repository root with `python -m benchmarks.bench_models` """
+import time
+
+import numpy as np
+from scipy.stats import binom, poisson
+
+from epimargin.models import SIR, NetworkedSIR
+from epimargin.trajectory import Trajectory
+
+def timed(label: str, fn, repeats: int):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    elapsed = (time.perf_counter() - start)/repeats
+    print(f"{label:<45} {elapsed * 1e6:10.1f} us")
+    return elapsed
+
+def draws(sims: int = 10000):
+    """ one step's worth of case, death and recovery draws: scipy frozen distributions vs a single Generator call """
+    rng   = np.random.default_rng(0)
+    rates = rng.uniform(10, 100, size = (3, sims))
+    timed(f"scipy rvs, 3 calls x {sims} lanes",  lambda: [poisson.rvs(rate) for rate in rates], 50)
+    timed(f"Generator.poisson, 1 call x {sims} lanes", lambda: rng.poisson(rates), 50)
+    timed("scipy rvs, scalar",       lambda: (poisson.rvs(50), binom.rvs(1000, 0.1)), 2000)
+    timed("Generator.poisson, scalar", lambda: (rng.poisson(50), rng.binomial(1000, 0.1)), 2000)
+
+def appends(sims: int = 10000):
+    """ cost of recording one day on a trajectory, for scalar and per-lane rows """
+    for (label, value) in [("scalar", 1.0), (f"{sims} lanes", np.ones(sims))]:
+        trajectory = Trajectory([value]).reserve(20001)
+        timed(f"Trajectory.append, {label}", lambda: trajectory.append(value), 20000)
+
+def steps(sims: int = 10000, units: int = 50):
+    sir = SIR("unit", 1e7, I0 = np.full(sims, 1000), dT0 = np.full(sims, 200), Rt0 = np.full(sims, 1.5), S0 = np.full(sims, 1e7 - 1000), random_seed = 0)
+    timed(f"SIR.parallel_forward_epi_step, {sims} lanes", lambda: sir.parallel_forward_epi_step(num_sims = sims), 100)
+    scalar = SIR("unit", 1e9, I0 = 10000, dT0 = 1000, Rt0 = 1.1, random_seed = 0)
+    timed("SIR.forward_epi_step, scalar", scalar.forward_epi_step, 100)
+    network = NetworkedSIR([SIR(f"unit{i}", 1e9, I0 = 10000, dT0 = 1000, Rt0 = 1.1, mobility = 0.01) for i in range(units)], random_seed = 0)
+    migrations = np.full((units, units), 1/units)
+    timed(f"NetworkedSIR.tick, {units} units", lambda: network.tick(migrations), 100)
+
+if __name__ == "__main__":
+    draws()
+    appends()
+    steps()
@@ -1,5 +1,6 @@
 import logging
-from typing import Callable, Optional, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Sequence
 
 import arviz as az
 import numpy as np
@@ -41,6 +42,78 @@ def rollingOLS(
 
     return growthrates
 
+# smallest block of days over which the MPVS recursion is evaluated at once
+MPVS_MIN_WINDOW = 16
+
+# smallest block of variance shifts evaluated at once when widening an anomaly, and the factor by which blocks grow
+WIDENING_MIN_BLOCK = 16
+GROWTH_FACTOR = 2
+
+def positive(x):
+    """ elementwise max(0, x), mapping NaNs to 0 """
+    return np.where(x > 0, x, 0)
+
+def log_zero_counts(new_cases, old_new_cases, start: int, end: int):
+    if logger.isEnabledFor(logging.DEBUG):
+        for t in range(start, end):
+            if new_cases[t] == 0:
+                logger.debug("new_cases at time %s: 0", t + 2)
+            if old_new_cases[t] == 0:
+                logger.debug("old_new_cases at time %s: 0", t + 2)
+
+def anomaly_widening(
+        new_cases, r, p, 
+        CI: float = 0.95, 
+        variance_shift: float = 0.99, 
+        max_iterations: int = 10000
+    ):
+    """ 
+    apply the smallest number of mean-preserving variance increases to NB(r, p) for which its CI encloses new_cases; vectorized over arrays of anomalies 
+
+    Each shift scales p by variance_shift and r by variance_shift * (1 - p)/(1 - variance_shift * p). The shifted 
+    parameters for a block of consecutive shift counts are generated with the same floating point operations as 
+    applying the shifts one at a time, and the CIs for the whole block are evaluated in one call.
+    (A bisection over the shift count is not safe: once the variance is large enough for mass to pile up at 0, the 
+    upper quantile falls again, so the set of shift counts whose CI encloses an anomaly need not be contiguous.)
+    """
+    new_cases, r, p = (np.array(_, dtype = float) for _ in np.broadcast_arrays(new_cases, r, p))
+    shape = new_cases.shape
+    new_cases, r, p = new_cases.reshape(-1), r.reshape(-1), p.reshape(-1)
+    m, K = len(new_cases), max_iterations - 1
+
+    def shifted(_nr, _np, count):
+        """ parameters after each of the next count shifts: _np_k = variance_shift * _np_{k-1}, _nr_k = (variance_shift * _nr_{k-1}) * ratio_{k-1} """
+        _nps = np.multiply.accumulate(np.vstack([_np, np.full((count, len(_np)), variance_shift)]))
+        factors = np.empty((2*count + 1, len(_nr)))
+        factors[0], factors[1::2], factors[2::2] = _nr, variance_shift, (1 - _nps[:-1])/(1 - variance_shift * _nps[:-1])
+        return (np.multiply.accumulate(factors)[2::2], _nps[1:])
+
+    def enclosed(_nr, _np, new_cases):
+        T_upper = nbinom.ppf(CI,   _nr, _np)
+        T_lower = nbinom.ppf(1-CI, _nr, _np)
+        T_lower, T_upper = np.minimum(T_lower, T_upper), np.maximum(T_lower, T_upper)
+        collapsed = (T_lower == 0) & (T_upper == 0)
+        if collapsed.any():
+            T_upper[collapsed] = 1
+            logger.debug("CI collapse, setting T_upper -> 1")
+        return (T_lower < new_cases) & (new_cases < T_upper)
+
+    # scan shift counts in order, over blocks of geometrically increasing size 
+    pending = np.arange(m)
+    start, size = 1, WIDENING_MIN_BLOCK
+    while pending.size:
+        if start > K:
+            raise ValueError("Number of iterations exceeded")
+        _nrs, _nps = shifted(r[pending], p[pending], min(size, K + 1 - start))
+        found = enclosed(_nrs, _nps, new_cases[pending])
+        hit, first = found.any(axis = 0), np.argmax(found, axis = 0)
+        last = np.where(hit, first, -1)
+        r[pending], p[pending] = _nrs[last, np.arange(len(pending))], _nps[last, np.arange(len(pending))]
+        pending = pending[~hit]
+        start, size = start + size, GROWTH_FACTOR * size
+
+    return (r.reshape(shape), p.reshape(shape))
+
 def analytical_MPVS(
         timeseries: pd.DataFrame,          # timeseries of (cumulative | daily) (cases | deaths), indexed by date or by integer index
         smoothing: Callable,               # smoothing function
@@ -59,99 +132,283 @@ def analytical_MPVS(
         daily_cases = timeseries 
     total_cases = np.cumsum(smoothing(np.squeeze(daily_cases)))
 
-    v_alpha, v_beta = [], []
+    series = np.asarray(total_cases, dtype = float)
+    deltas = series[1:] - series[:-1]
+    new_cases     = positive(deltas[1:])  # new cases at each time i >= 2
+    old_new_cases = positive(deltas[:-1]) # new cases at each time i - 1
+    n = len(new_cases)
 
-    Rt_pred, Rt_CI_upper, Rt_CI_lower = [], [], []
+    Rt_pred, Rt_CI_upper, Rt_CI_lower = np.zeros(n), np.zeros(n), np.zeros(n)
 
-    T_pred, T_CI_upper, T_CI_lower = [], [], []
+    T_pred, T_CI_upper, T_CI_lower = np.zeros(n), np.full(n, 10.0), np.zeros(n)
 
-    new_cases_ts = []
+    new_cases_ts = np.zeros(n)
 
     anomalies     = []
     anomaly_dates = []
 
-    for i in range(2, len(total_cases)):
-        new_cases     = max(0, total_cases[i]   - total_cases[i-1])
-        old_new_cases = max(0, total_cases[i-1] - total_cases[i-2])
-
-        alpha += new_cases
-        beta  += old_new_cases
-        v_alpha.append(alpha)
-        v_beta.append(beta)
-
-        Rt_est   = max(0, 1 + infectious_period*np.log(Gamma.mean(     a = alpha, scale = 1/beta)))
-        Rt_upper = max(0, 1 + infectious_period*np.log(Gamma.ppf(CI,   a = alpha, scale = 1/beta)))
-        Rt_lower = max(0, 1 + infectious_period*np.log(Gamma.ppf(1-CI, a = alpha, scale = 1/beta)))
-        Rt_pred.append(Rt_est)
-        Rt_CI_upper.append(Rt_upper)
-        Rt_CI_lower.append(Rt_lower)
-
-        if (new_cases == 0 or old_new_cases == 0):
-            if new_cases == 0:
-                logger.debug("new_cases at time %s: 0", i)
-            if old_new_cases == 0:
-                logger.debug("old_new_cases at time %s: 0", i)
-            T_pred.append(0)
-            T_CI_upper.append(10)
-            T_CI_lower.append(0)
-            new_cases_ts.append(0)
-
-        if (new_cases > 0 and old_new_cases > 0):
-            new_cases_ts.append(new_cases)
-
-            r, p = alpha, beta/(old_new_cases + beta)
-            T_pred.append(nbinom.mean(r, p))
-            T_upper = nbinom.ppf(CI,   r, p)
-            T_lower = nbinom.ppf(1-CI, r, p)
-            T_CI_upper.append(T_upper)
-            T_CI_lower.append(T_lower)
-
-            _np = p
-            _nr = r 
-            anomaly_noted = False
-            counter = 0
-            while not (T_lower < new_cases < T_upper):
-                if not anomaly_noted:
-                    anomalies.append(new_cases)
-                    anomaly_dates.append(dates[i])
-                
-                _nr = variance_shift * _nr * ((1-_np)/(1-variance_shift*_np) )
-                _np = variance_shift * _np 
-                T_upper = nbinom.ppf(CI,   _nr, _np)
-                T_lower = nbinom.ppf(1-CI, _nr, _np)
-                T_lower, T_upper = sorted((T_lower, T_upper))
-                if T_lower == T_upper == 0:
-                    T_upper = 1
-                    logger.debug("CI collapse, setting T_upper -> 1")
-                anomaly_noted = True
-
-                counter += 1
-                if counter >= 10000:
-                    raise ValueError("Number of iterations exceeded")
-            else:
-                if anomaly_noted:
-                    alpha = _nr # update distribution on R with new parameters that enclose the anomaly 
-                    beta = _np/(1-_np) * old_new_cases
-
-                    T_pred[-1] = nbinom.mean(_nr, _np)
-                    T_CI_lower[-1] = nbinom.ppf(CI,   _nr, _np)
-                    T_CI_upper[-1] = nbinom.ppf(1-CI, _nr, _np)
-
-                    # annealing leaves the RR mean unchanged, but we need to adjust its widened CI
-                    Rt_upper = max(0, 1 + infectious_period * np.log(Gamma.ppf(CI    , a = alpha, scale = 1/beta)))
-                    Rt_lower = max(0, 1 + infectious_period * np.log(Gamma.ppf(1 - CI, a = alpha, scale = 1/beta)))
-
-                    # replace latest CI time series entries with adjusted CI 
-                    Rt_CI_upper[-1] = Rt_upper
-                    Rt_CI_lower[-1] = Rt_lower
+    # evaluate the no-anomaly recursion over blocks of the series at once, and only fall back to a 
+    # sequential correction (which changes the prior for all subsequent days) on anomalous days
+    i, window = 0, MPVS_MIN_WINDOW
+    while i < n:
+        j = min(n, i + window)
+        alphas = np.cumsum(np.r_[alpha, new_cases[i:j]])[1:]
+        betas  = np.cumsum(np.r_[beta,  old_new_cases[i:j]])[1:]
+
+        Rt_pred    [i:j] = positive(1 + infectious_period*np.log(Gamma.mean(     a = alphas, scale = 1/betas)))
+        Rt_CI_upper[i:j] = positive(1 + infectious_period*np.log(Gamma.ppf(CI,   a = alphas, scale = 1/betas)))
+        Rt_CI_lower[i:j] = positive(1 + infectious_period*np.log(Gamma.ppf(1-CI, a = alphas, scale = 1/betas)))
+
+        valid = (new_cases[i:j] > 0) & (old_new_cases[i:j] > 0)
+        idx = np.flatnonzero(valid) + i
+        r, p = alphas[idx - i], betas[idx - i]/(old_new_cases[idx] + betas[idx - i])
+        new_cases_ts[idx] = new_cases[idx]
+        T_pred      [idx] = nbinom.mean(r, p)
+        T_CI_upper  [idx] = nbinom.ppf(CI,   r, p)
+        T_CI_lower  [idx] = nbinom.ppf(1-CI, r, p)
+
+        enclosed = (T_CI_lower[idx] < new_cases[idx]) & (new_cases[idx] < T_CI_upper[idx])
+        if enclosed.all():
+            log_zero_counts(new_cases, old_new_cases, i, j)
+            alpha, beta = alphas[-1], betas[-1]
+            i, window = j, 2 * window
+            continue
+
+        # accept the block up to the first anomaly, and widen the predictive distribution there
+        k = np.argmin(enclosed)
+        t = idx[k]
+        log_zero_counts(new_cases, old_new_cases, i, t + 1)
+        anomalies.append(new_cases[t])
+        anomaly_dates.append(dates[t + 2])
+
+        _nr, _np = anomaly_widening(new_cases[t], r[k], p[k], CI, variance_shift)
+        alpha = _nr # update distribution on R with new parameters that enclose the anomaly 
+        beta  = _np/(1-_np) * old_new_cases[t]
+
+        T_pred[t]     = nbinom.mean(_nr, _np)
+        T_CI_lower[t] = nbinom.ppf(CI,   _nr, _np)
+        T_CI_upper[t] = nbinom.ppf(1-CI, _nr, _np)
+
+        # annealing leaves the RR mean unchanged, but we need to adjust its widened CI
+        Rt_CI_upper[t] = positive(1 + infectious_period * np.log(Gamma.ppf(CI    , a = alpha, scale = 1/beta)))
+        Rt_CI_lower[t] = positive(1 + infectious_period * np.log(Gamma.ppf(1 - CI, a = alpha, scale = 1/beta)))
+
+        i, window = t + 1, max(MPVS_MIN_WINDOW, 2 * (t + 1 - i))
+
     return (
         dates[2:], 
-        Rt_pred, Rt_CI_upper, Rt_CI_lower, 
-        T_pred, T_CI_upper, T_CI_lower, 
-        total_cases, new_cases_ts, 
+        Rt_pred.tolist(), Rt_CI_upper.tolist(), Rt_CI_lower.tolist(), 
+        T_pred.tolist(), T_CI_upper.tolist(), T_CI_lower.tolist(), 
+        total_cases, new_cases_ts.tolist(), 
         anomalies, anomaly_dates
     )
 
+# columns of the tidy frame returned by analytical_MPVS_panel, in order
+MPVS_PANEL_COLUMNS = ("Rt_pred", "Rt_CI_upper", "Rt_CI_lower", "T_pred", "T_CI_upper", "T_CI_lower", "total_cases", "new_cases_ts", "anomaly")
+
+def MPVS_step(
+        alpha: np.ndarray,                 # (units,) posterior shape after the previous day
+        beta:  np.ndarray,                 # (units,) posterior rate after the previous day
+        new_cases: np.ndarray,             # (units,) new cases today
+        old_new_cases: np.ndarray,         # (units,) new cases the day before
+        CI:    float = 0.95,
+        variance_shift: float = 0.99
+    ):
+    """ advance the MPVS posterior by one day for a vector of units, widening the predictive distribution for anomalous units """
+    alpha = alpha + new_cases
+    beta  = beta  + old_new_cases
+    T_pred, T_CI_upper, T_CI_lower = np.zeros(alpha.shape), np.full(alpha.shape, 10.0), np.zeros(alpha.shape)
+    new_cases_ts = np.zeros(alpha.shape)
+    anomaly      = np.zeros(alpha.shape, dtype = bool)
+
+    idx = np.flatnonzero((new_cases > 0) & (old_new_cases > 0))
+    r, p = alpha[idx], beta[idx]/(old_new_cases[idx] + beta[idx])
+    new_cases_ts[idx] = new_cases[idx]
+    T_pred      [idx] = nbinom.mean(r, p)
+    T_CI_upper  [idx] = nbinom.ppf(CI,   r, p)
+    T_CI_lower  [idx] = nbinom.ppf(1-CI, r, p)
+
+    # the posterior carried forward differs from today's only for anomalous units
+    _alpha, _beta = alpha, beta
+    enclosed = (T_CI_lower[idx] < new_cases[idx]) & (new_cases[idx] < T_CI_upper[idx])
+    if not enclosed.all():
+        k = idx[~enclosed]
+        anomaly[k] = True
+        _nr, _np = anomaly_widening(new_cases[k], r[~enclosed], p[~enclosed], CI, variance_shift)
+        _alpha, _beta = alpha.copy(), beta.copy()
+        _alpha[k] = _nr
+        _beta[k]  = _np/(1-_np) * old_new_cases[k]
+
+        T_pred    [k] = nbinom.mean(_nr, _np)
+        T_CI_lower[k] = nbinom.ppf(CI,   _nr, _np)
+        T_CI_upper[k] = nbinom.ppf(1-CI, _nr, _np)
+
+    return (alpha, beta, _alpha, _beta, T_pred, T_CI_upper, T_CI_lower, new_cases_ts, anomaly)
+
+def MPVS_Rt(alpha, beta, alpha_CI, beta_CI, CI: float = 0.95, infectious_period: int = 5*days):
+    """ map Gamma posteriors on the growth factor to Rt and its CI """
+    return (
+        positive(1 + infectious_period*np.log(Gamma.mean(     a = alpha,    scale = 1/beta))),
+        positive(1 + infectious_period*np.log(Gamma.ppf(CI,   a = alpha_CI, scale = 1/beta_CI))),
+        positive(1 + infectious_period*np.log(Gamma.ppf(1-CI, a = alpha_CI, scale = 1/beta_CI)))
+    )
+
+def MPVS_panel_recursion(
+        new_cases: np.ndarray,             # (days, units) new cases at each time i >= 2
+        old_new_cases: np.ndarray,         # (days, units) new cases at each time i - 1
+        alpha: float = 3.0,
+        beta:  float = 2.0,
+        CI:    float = 0.95,
+        infectious_period: int = 5*days,
+        variance_shift: float = 0.99
+    ):
+    """ run the MPVS recursion forward in time for all units at once, returning a dict of (days, units) arrays """
+    n, U = new_cases.shape
+    alpha, beta = np.full(U, alpha, dtype = float), np.full(U, beta, dtype = float)
+
+    # posterior parameters before (for the Rt mean) and after (for the Rt CIs) any anomaly correction
+    alphas, betas, alphas_CI, betas_CI, T_pred, T_CI_upper, T_CI_lower, new_cases_ts, anomaly = (
+        np.zeros((n, U), dtype = bool if col == 8 else float) for col in range(9)
+    )
+    for t in range(n):
+        (alphas[t], betas[t], alpha, beta, T_pred[t], T_CI_upper[t], T_CI_lower[t], new_cases_ts[t], anomaly[t]) =\
+            MPVS_step(alpha, beta, new_cases[t], old_new_cases[t], CI, variance_shift)
+        alphas_CI[t], betas_CI[t] = alpha, beta
+
+    Rt_pred, Rt_CI_upper, Rt_CI_lower = MPVS_Rt(alphas, betas, alphas_CI, betas_CI, CI, infectious_period)
+    return {
+        "Rt_pred":      Rt_pred,
+        "Rt_CI_upper":  Rt_CI_upper,
+        "Rt_CI_lower":  Rt_CI_lower,
+        "T_pred":       T_pred,
+        "T_CI_upper":   T_CI_upper,
+        "T_CI_lower":   T_CI_lower,
+        "new_cases_ts": new_cases_ts,
+        "anomaly":      anomaly
+    }
+
+def analytical_MPVS_panel(
+        panel: pd.DataFrame,               # (dates x units) panel of (cumulative | daily) (cases | deaths), or equivalent 2-D array
+        smoothing: Callable,               # smoothing function, applied to each unit's series
+        alpha: float = 3.0,                # shape 
+        beta:  float = 2.0,                # rate
+        CI:    float = 0.95,               # confidence interval 
+        infectious_period: int = 5*days,   # inf period = 1/gamma,
+        variance_shift: float = 0.99,      # how much to scale variance parameters by when anomaly detected 
+        totals: bool = True,               # are these totals or daily new counts?
+        processes: Optional[int] = None    # number of worker processes to split units across
+    ) -> pd.DataFrame:
+    """ panel version of analytical_MPVS: estimates Rt for every column at once and returns a tidy frame indexed by (unit, date) """
+    if not isinstance(panel, pd.DataFrame):
+        panel = pd.DataFrame(np.asarray(panel))
+    dates, units = panel.index, panel.columns
+    if totals:
+        daily_cases = panel.clip(lower = 0).diff().clip(lower = 0).iloc[1:]
+    else: 
+        daily_cases = panel
+    total_cases = np.column_stack([np.cumsum(np.asarray(smoothing(daily_cases[unit]), dtype = float)) for unit in units])
+
+    deltas = total_cases[1:] - total_cases[:-1]
+    new_cases     = positive(deltas[1:])
+    old_new_cases = positive(deltas[:-1])
+    n = len(new_cases)
+
+    params = (alpha, beta, CI, infectious_period, variance_shift)
+    if processes and processes > 1 and len(units) > 1:
+        chunks = np.array_split(np.arange(len(units)), min(processes, len(units)))
+        with ProcessPoolExecutor(max_workers = len(chunks)) as pool:
+            results = list(pool.map(MPVS_panel_recursion, *zip(*((new_cases[:, c], old_new_cases[:, c]) + params for c in chunks))))
+        estimates = {col: np.concatenate([result[col] for result in results], axis = 1) for col in results[0]}
+    else:
+        estimates = MPVS_panel_recursion(new_cases, old_new_cases, *params)
+    estimates["total_cases"] = total_cases[2:]
+
+    index = pd.MultiIndex.from_product([units, dates[2:][:n]], names = [units.name or "unit", dates.name or "date"])
+    return pd.DataFrame({col: estimates[col].ravel(order = "F") for col in MPVS_PANEL_COLUMNS}, index = index)
+
+class StreamingMPVS:
+    """
+    incremental version of analytical_MPVS for daily updates: holds the running posterior for one or more units 
+    and advances it in O(1) per day instead of replaying the full history
+
+    Inputs are (already smoothed) daily new case counts; the estimates emitted for the k-th update match those
+    of analytical_MPVS(..., totals = False) on day k for a smoother that leaves past values unchanged. The state
+    can be saved with state_dict() and restored with from_state() to resume the recursion in a later job.
+    """
+    def __init__(self,
+        alpha: float = 3.0,                # shape 
+        beta:  float = 2.0,                # rate
+        CI:    float = 0.95,               # confidence interval 
+        infectious_period: int = 5*days,   # inf period = 1/gamma,
+        variance_shift: float = 0.99       # how much to scale variance parameters by when anomaly detected 
+    ):
+        self.alpha0, self.beta0 = alpha, beta
+        self.CI = CI
+        self.infectious_period = infectious_period
+        self.variance_shift = variance_shift
+        self.days_seen = 0
+        self.alpha: Optional[np.ndarray] = None
+        self.beta:  Optional[np.ndarray] = None
+        self.totals: List[np.ndarray] = [] # running totals on the last two days seen
+
+    def update(self, daily_cases) -> Optional[dict]:
+        """ add one day of new cases (a scalar, or one count per unit) and return that day's estimates, or None during the first two days """
+        daily_cases = np.asarray(daily_cases, dtype = float)
+        shape, counts = daily_cases.shape, daily_cases.reshape(-1)
+        total = counts if not self.totals else self.totals[-1] + counts
+        if self.days_seen < 2:
+            self.totals = self.totals + [total]
+            self.days_seen += 1
+            return None
+
+        (prev, last) = self.totals
+        alpha = np.full(counts.shape, self.alpha0, dtype = float) if self.alpha is None else self.alpha
+        beta  = np.full(counts.shape, self.beta0,  dtype = float) if self.beta  is None else self.beta
+        (alpha, beta, _alpha, _beta, T_pred, T_CI_upper, T_CI_lower, new_cases_ts, anomaly) =\
+            MPVS_step(alpha, beta, positive(total - last), positive(last - prev), self.CI, self.variance_shift)
+        Rt_pred, Rt_CI_upper, Rt_CI_lower = MPVS_Rt(alpha, beta, _alpha, _beta, self.CI, self.infectious_period)
+
+        self.alpha, self.beta = _alpha, _beta
+        self.totals = [last, total]
+        self.days_seen += 1
+
+        estimates = {
+            "Rt_pred":      Rt_pred,
+            "Rt_CI_upper":  Rt_CI_upper,
+            "Rt_CI_lower":  Rt_CI_lower,
+            "T_pred":       T_pred,
+            "T_CI_upper":   T_CI_upper,
+            "T_CI_lower":   T_CI_lower,
+            "total_cases":  total,
+            "new_cases_ts": new_cases_ts,
+            "anomaly":      anomaly
+        }
+        return {col: estimates[col].reshape(shape)[()] for col in MPVS_PANEL_COLUMNS}
+
+    def state_dict(self) -> dict:
+        """ JSON-serializable snapshot of the estimator's parameters and running posterior """
+        return {
+            "alpha0":            self.alpha0,
+            "beta0":             self.beta0,
+            "CI":                self.CI,
+            "infectious_period": self.infectious_period,
+            "variance_shift":    self.variance_shift,
+            "days_seen":         self.days_seen,
+            "alpha":             None if self.alpha is None else self.alpha.tolist(),
+            "beta":              None if self.beta  is None else self.beta.tolist(),
+            "totals":            [total.tolist() for total in self.totals]
+        }
+
+    @classmethod
+    def from_state(cls, state: dict):
+        """ restore an estimator from the output of state_dict() """
+        estimator = cls(state["alpha0"], state["beta0"], state["CI"], state["infectious_period"], state["variance_shift"])
+        estimator.days_seen = state["days_seen"]
+        estimator.alpha  = None if state["alpha"] is None else np.array(state["alpha"], dtype = float)
+        estimator.beta   = None if state["beta"]  is None else np.array(state["beta"],  dtype = float)
+        estimator.totals = [np.array(total, dtype = float) for total in state["totals"]]
+        return estimator
+
 def parametric_scheme_mcmc(
     daily_cases, # daily case counts
     CI = 0.95,   # confidence interval
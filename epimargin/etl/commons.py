@@ -1,10 +1,128 @@
+import hashlib
+import json
+import logging
+import time
+import uuid
 from pathlib import Path
+from typing import Callable, Optional
+
+import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ..utils import file_digest
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses treated as transient: rate limiting and server-side errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# size of the blocks responses are streamed to disk in
+CHUNK_SIZE = 1 << 20
+
+def http_session(retries: int = 3, backoff: float = 0.5, pool_size: int = 10) -> requests.Session:
+    """ requests session with a connection pool of the given size that retries transient failures with exponential backoff """
+    retry = Retry(total = retries, backoff_factor = backoff, status_forcelist = RETRY_STATUSES, allowed_methods = ["HEAD", "GET"])
+    adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size, max_retries = retry)
+    session = requests.Session()
+    session.mount("http://",  adapter)
+    session.mount("https://", adapter)
+    return session
+
+def metadata_path(data_path: Path, filename: str) -> Path:
+    """ location of the sidecar file holding the ETag and Last-Modified validators of a downloaded file """
+    return Path(data_path)/f".{filename}.http.json"
+
+def temporary_path(dst: Path) -> Path:
+    """ hidden, uniquely named sibling of dst to write to before renaming into place, so concurrent writers never share one """
+    return dst.with_name(f".{dst.name}.{uuid.uuid4().hex}.part")
+
+def stream_to_temporary(response: requests.Response, dst: Path) -> Path:
+    """ write a streamed response body to a temporary sibling of dst, removing it if the transfer fails """
+    tmp = temporary_path(dst)
+    try:
+        with tmp.open("wb") as f:
+            for chunk in response.iter_content(chunk_size = CHUNK_SIZE):
+                f.write(chunk)
+    except BaseException:
+        if tmp.exists():
+            tmp.unlink()
+        raise
+    return tmp
+
+def download_data(
+    data_path: Path, 
+    filename: str, 
+    base_url: str = 'https://api.covid19india.org/csv/latest/', 
+    session: Optional[requests.Session] = None, 
+    timeout: float = 60, 
+    retries: int = 3, 
+    backoff: float = 0.5, 
+    conditional: bool = True) -> bool:
+    """ 
+    download a file with filename from the base_url to the directory at data_path, streaming it to a temporary file 
+    that is renamed into place once complete; the server's ETag/Last-Modified validators are stored alongside the file 
+    so that (if conditional) an unchanged file is not downloaded again; returns whether the file was (re)written. 
+    Without a session, one is opened for this download and closed afterwards; pass a session to reuse its connections 
+    across downloads
+    """
+    if session is None:
+        with http_session(retries, backoff) as session:
+            return download_data(data_path, filename, base_url, session, timeout, retries, backoff, conditional)
+    url  = base_url + filename
+    dst  = Path(data_path)/filename
+    meta = metadata_path(data_path, filename)
+
+    headers = {}
+    if conditional and dst.exists() and meta.exists():
+        validators = json.loads(meta.read_text())
+        if validators.get("url") == url:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+    # the session retries failed requests, so only interruptions while streaming the body are retried here
+    for attempt in range(retries + 1):
+        with session.get(url, headers = headers, stream = True, timeout = timeout) as response:
+            if response.status_code == 304:
+                logger.debug("%s not modified", url)
+                return False
+            response.raise_for_status()
+            validators = {"url": url, "etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+            try:
+                tmp = stream_to_temporary(response, dst)
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                if attempt == retries:
+                    raise
+        time.sleep(backoff * 2 ** attempt)
+    tmp.replace(dst)
 
+    meta_tmp = temporary_path(meta)
+    meta_tmp.write_text(json.dumps(validators))
+    meta_tmp.replace(meta)
+    return True
 
-def download_data(data_path: Path, filename: str, base_url: str = 'https://api.covid19india.org/csv/latest/'):
-    """ download a file with filename from the base_url to the directory at data_path  """
-    url = base_url + filename
-    response = requests.get(url)
-    with (data_path/filename).open('wb') as dst:
-        dst.write(response.content)
+def parquet_cached(path: Path, parse: Callable[[Path], pd.DataFrame], cache: Path, *params) -> pd.DataFrame:
+    """ 
+    parse a file, or read it back from a Parquet copy in the cache directory keyed by the file's contents, the parser 
+    and any extra parameters; entries for earlier versions of the same file under the same parser are evicted when it 
+    is parsed again 
+    """
+    path   = Path(path)
+    # files with the same name in different directories, or read by different parsers, get separate entries
+    source = hashlib.sha256(str(path.resolve().parent).encode()).hexdigest()[:8]
+    prefix = f"{path.stem}-{parse.__name__}-{source}"
+    cached = Path(cache)/f"{prefix}-{file_digest([path], parse.__name__, *params)}.parquet"
+    if cached.exists():
+        return pd.read_parquet(cached)
+    df = parse(path)
+    cached.parent.mkdir(parents = True, exist_ok = True)
+    for stale in cached.parent.glob(f"{prefix}-*.parquet"):
+        stale.unlink()
+    tmp = cached.with_suffix(".tmp")
+    df.to_parquet(tmp)
+    tmp.replace(cached)
+    return df
@@ -1,10 +1,12 @@
 from pathlib import Path
-from typing import Optional, Sequence
+from typing import Callable, Optional, Sequence
 
 import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 
 from ..utils import assume_missing_0
+from .commons import parquet_cached
 
 """ tools to extract time series for COVID19India.org data """
 
@@ -267,6 +269,9 @@ state_name_lookup = {
 }
 
 
+# columns stored as categoricals in the cached ingest
+categorical_columns = ["detected_state", "detected_district"]
+
 def data_path(i: int):
     return f"raw_data{i}.csv"
 
@@ -303,24 +308,114 @@ def get_time_series(df: pd.DataFrame, group_col: Optional[Sequence[str]] = None,
         group_cols = ["status_change_date", "current_status"]
     if drop_negatives:
         df = df[df["num_cases"] >= 0]
-    totals = df.groupby(group_cols)["num_cases"].agg(lambda counts: np.sum(np.abs(counts)))
+    totals = df["num_cases"].abs().groupby([df[col] for col in group_cols], observed = True).sum()
     if len(totals) == 0:
         return pd.DataFrame()
     totals = totals.unstack().fillna(0)[['Deceased','Hospitalized','Recovered']]
     totals["date"] = totals.index.get_level_values("status_change_date")
-    totals = totals.groupby(level=0).apply(add_time_col) if group_col else add_time_col(totals)
+    # days since the first date in each top-level group (or overall, if ungrouped)
+    start = totals["date"].groupby(level = 0, observed = True).transform("min") if group_col else totals["date"].min()
+    totals["time"] = (totals["date"] - start).dt.days
     totals["delta"] = assume_missing_0(totals, "Hospitalized") - assume_missing_0(totals, "Recovered") - assume_missing_0(totals, "Deceased")
     totals["logdelta"] = np.ma.log(totals["delta"].values).filled(0)
     return totals
 
-def load_all_data(v3_paths: Sequence[Path], v4_paths: Sequence[Path]) -> pd.DataFrame:
-    cases_v3 = [load_data_v3(path) for path in v3_paths]
-    cases_v4 = [load_data_v4(path) for path in v4_paths]
-    all_cases = pd.concat(cases_v3 + cases_v4)
-    all_cases["status_change_date"] = all_cases["status_change_date"].fillna(all_cases["date_announced"])
-    all_cases["detected_state"]     = all_cases["detected_state"].str.strip().str.title()
-    all_cases["detected_district"]  = all_cases["detected_district"].str.strip().str.title()  
-    return all_cases.dropna(subset  = ["detected_state"])
+def normalize_cases(cases: pd.DataFrame) -> pd.DataFrame:
+    """ fill in missing status change dates, clean up state and district names, and drop rows without a state """
+    cases["status_change_date"] = cases["status_change_date"].fillna(cases["date_announced"])
+    cases["detected_state"]     = cases["detected_state"].str.strip().str.title()
+    cases["detected_district"]  = cases["detected_district"].str.strip().str.title()  
+    return cases.dropna(subset  = ["detected_state"])
+
+def load_cached(path: Path, loader: Callable[[Path], pd.DataFrame], cache: Path) -> pd.DataFrame:
+    """ parse and normalize a raw data file, or read it back from a Parquet cache keyed by the file's contents """
+    def parse(path: Path) -> pd.DataFrame:
+        cases = normalize_cases(loader(path))
+        for col in categorical_columns:
+            cases[col] = cases[col].astype("category")
+        return cases
+    parse.__name__ = loader.__name__
+    return parquet_cached(path, parse, cache)
+
+def load_all_data(v3_paths: Sequence[Path], v4_paths: Sequence[Path], cache: Optional[Path] = None) -> pd.DataFrame:
+    """ 
+    load and normalize all raw data files; if a cache directory is given, each parsed file is stored there as Parquet 
+    (with categorical state and district columns) and only files whose contents changed are parsed again 
+    """
+    if cache is None:
+        cases_v3 = [load_data_v3(path) for path in v3_paths]
+        cases_v4 = [load_data_v4(path) for path in v4_paths]
+        return normalize_cases(pd.concat(cases_v3 + cases_v4))
+    cases = [load_cached(path, load_data_v3, cache) for path in v3_paths] + [load_cached(path, load_data_v4, cache) for path in v4_paths]
+    # align categories across files so that concatenation keeps the categorical dtypes
+    for col in categorical_columns:
+        categories = union_categoricals([df[col] for df in cases]).categories
+        cases = [df.assign(**{col: df[col].cat.set_categories(categories)}) for df in cases]
+    return pd.concat(cases)
+
+# columns kept by the streaming ingest, and the keys line-list rows are aggregated over
+count_columns = ["date announced", "status change date", "detected state", "detected district", "current status", "num cases"]
+count_keys    = ["detected_state", "detected_district", "status_change_date", "current_status"]
+
+# date format used by the source data; dates that do not match it fall back to day-first inference
+date_format = "%d/%m/%Y"
+
+def parse_dates(values: pd.Series) -> pd.Series:
+    """ parse a categorical column of date strings, converting each distinct string only once """
+    categories = pd.Index(values.cat.categories.astype(str))
+    parsed = pd.to_datetime(categories, format = date_format, errors = "coerce")
+    unparsed = parsed.isna()
+    if unparsed.any():
+        parsed = parsed.to_numpy(copy = True)
+        parsed[unparsed] = [pd.to_datetime(_, dayfirst = True, errors = "coerce").to_datetime64() for _ in categories[unparsed]]
+        parsed = pd.DatetimeIndex(parsed)
+    return pd.Series(parsed.take(values.cat.codes.to_numpy(), allow_fill = True, fill_value = pd.NaT), index = values.index)
+
+def aggregate_chunk(chunk: pd.DataFrame) -> pd.Series:
+    """ normalize a chunk of line-list rows and sum its case counts by key, keeping negative corrections separate """
+    standardize_column_headers(chunk)
+    if "num_cases" not in chunk:
+        chunk["num_cases"] = 1.0 # v1 and v2 files have one row per patient
+    chunk["status_change_date"] = parse_dates(chunk["status_change_date"]).fillna(parse_dates(chunk["date_announced"]))
+    for col in ("detected_state", "detected_district"):
+        chunk[col] = chunk[col].map(lambda name: name.strip().title(), na_action = "ignore").astype(object)
+    chunk = chunk.dropna(subset = ["detected_state", "num_cases"])
+    chunk["negative"] = chunk["num_cases"] < 0
+    return chunk.groupby(count_keys + ["negative"], observed = True, dropna = False)["num_cases"].sum()
+
+def sum_partials(partials: Sequence[pd.Series]) -> pd.Series:
+    """ combine partial case counts that share the same keys """
+    return pd.concat(partials).groupby(level = list(range(partials[0].index.nlevels)), observed = True, dropna = False).sum()
+
+def load_case_counts(paths: Sequence[Path], chunksize: int = 100000, schema: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """ 
+    stream line-list files (v3/v4, or v1/v2 exports read with a fixed schema as in load_data) in chunks and aggregate 
+    them into case counts per state, district, date and status, so memory is bounded by the chunk size and the number 
+    of distinct keys rather than the number of rows; negative corrections are summed in separate rows so that 
+    get_time_series treats them as it does on the full line list
+    """
+    partials = []
+    for path in paths:
+        # headerless exports get the fixed schema in place of their first row, as in load_data
+        names  = list(schema) if schema else list(pd.read_csv(path, nrows = 0).columns)
+        chunks = pd.read_csv(path, 
+            header    = 0,
+            names     = names,
+            usecols   = [name for name in names if name.lower() in count_columns],
+            dtype     = {name: "float64" if name.lower() == "num cases" else "category" for name in names},
+            chunksize = chunksize)
+        for chunk in chunks:
+            partials.append(aggregate_chunk(chunk))
+            # fold chunk sums into the running total once they outgrow it, which amortizes the merges while keeping
+            # memory within a constant factor of the number of distinct keys
+            if sum(map(len, partials[1:])) > max(len(partials[0]), chunksize):
+                partials = [sum_partials(partials)]
+    if not partials:
+        return pd.DataFrame(columns = count_keys + ["num_cases"])
+    counts = sum_partials(partials).reset_index().drop(columns = "negative")
+    for col in categorical_columns:
+        counts[col] = counts[col].astype("category")
+    return counts
 
 # assuming analysis for data structure from COVID19-India saved as resaved, properly-quoted file (v1 and v2)
 def load_data(datapath: Path, reduced: bool = False, schema: Optional[Sequence[str]] = None) -> pd.DataFrame: 
@@ -1,26 +1,172 @@
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Optional, Sequence
 
 import pandas as pd
+import pyarrow.parquet as pq
+import requests
 
-from .commons import download_data
+from .commons import download_data, http_session
 
 """ tools to download and load data from JHU's CSSE Covid tracker """
 
 CSSE_REPO_BASE_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_daily_reports/"
 DATE_FMT = "%m-%d-%Y"
 
+logger = logging.getLogger(__name__)
+
 DROP_SCHEMA_V1 = ["FIPS", "Admin2", "Last_Update", "Lat", "Long_", "Combined_Key", "Incidence_Rate", "Case-Fatality_Ratio", "Country_Region"]
 DROP_SCHEMA_V2 = ["FIPS", "Admin2", "Last_Update", "Lat", "Long_", "Combined_Key", "Incident_Rate",  "Case_Fatality_Ratio", "Country_Region"]
 
-def fetch(dst: Path, date: pd.Timestamp, overwrite: bool = False) -> None:
+# columns kept in the consolidated panel store, and the index panels are returned with
+PANEL_LABELS = ["Country_Region", "Province_State", "Admin2"]
+PANEL_COUNTS = ["Confirmed", "Deaths", "Recovered", "Active"]
+PANEL_INDEX  = ["Country_Region", "Province_State", "date"]
+# column recording which version of its daily report each stored row was parsed from
+PANEL_VERSION = "report_version"
+
+def fetch(dst: Path, date: pd.Timestamp, overwrite: bool = False, session: Optional[requests.Session] = None, base_url: str = CSSE_REPO_BASE_URL) -> bool:
+    """ download the daily report for a date unless it is already present (or, with overwrite, unchanged), returning whether it was written """
     filename = date.strftime(DATE_FMT) + ".csv"
     if (not (dst/filename).exists()) or overwrite:
-        download_data(dst, filename, CSSE_REPO_BASE_URL)
+        return download_data(dst, filename, base_url, session)
+    return False
+
+def fetch_range(dst: Path, start: str, end: str, overwrite: bool = False, workers: int = 8, session: Optional[requests.Session] = None, base_url: str = CSSE_REPO_BASE_URL) -> Dict[str, Any]:
+    """ 
+    download the daily reports for a date range concurrently over a shared, retrying connection pool, skipping 
+    reports already present; returns (and logs) a summary of what was fetched, including failed dates and throughput;
+    a session opened here is closed once the range is fetched 
+    """
+    if session is None:
+        with http_session(pool_size = workers) as session:
+            return fetch_range(dst, start, end, overwrite, workers, session, base_url)
+    dst = Path(dst)
+    dates = pd.date_range(pd.Timestamp(start), pd.Timestamp(end))
+    downloaded, failed = [], []
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        futures = {pool.submit(fetch, dst, date, overwrite, session, base_url): date for date in dates}
+        for future in as_completed(futures):
+            date = futures[future]
+            try:
+                if future.result():
+                    downloaded.append(date)
+            except requests.RequestException as error:
+                logger.warning("failed to fetch CSSE report for %s: %s", date.date(), error)
+                failed.append(date)
+    elapsed = time.perf_counter() - t0
+    nbytes = sum((dst/(date.strftime(DATE_FMT) + ".csv")).stat().st_size for date in downloaded)
+    summary = {
+        "requested"  : len(dates),
+        "downloaded" : len(downloaded),
+        "skipped"    : len(dates) - len(downloaded) - len(failed),
+        "failed"     : sorted(failed),
+        "bytes"      : nbytes,
+        "seconds"    : elapsed,
+        "files_per_second" : len(downloaded)/elapsed if elapsed else 0.0,
+        "bytes_per_second" : nbytes/elapsed if elapsed else 0.0,
+    }
+    logger.info("fetched %d/%d CSSE reports (%d skipped, %d failed) in %.1fs: %.1f files/s, %.0f KB/s", 
+        summary["downloaded"], summary["requested"], summary["skipped"], len(failed), elapsed, summary["files_per_second"], summary["bytes_per_second"]/1e3)
+    return summary
+
+def parse_report(path: Path, date: pd.Timestamp) -> pd.DataFrame:
+    """ read a daily report into the panel schema, harmonizing the column names used by older reports (e.g. Country/Region) """
+    report = pd.read_csv(path)
+    report.columns = report.columns.str.strip().str.replace("/", "_").str.replace(" ", "_")
+    report = report.reindex(columns = PANEL_LABELS + PANEL_COUNTS)
+    for col in PANEL_LABELS:
+        report[col] = report[col].astype("string").str.strip()
+    for col in PANEL_COUNTS:
+        report[col] = pd.to_numeric(report[col], errors = "coerce").astype(float)
+    return report.assign(date = date)
+
+def report_version(path: Path) -> str:
+    """ identify the contents of a downloaded report by its modification time and size, which change whenever it is rewritten """
+    stat = path.stat()
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+def stored_versions(store: Path) -> pd.Series:
+    """ version of the report each date in a panel store was parsed from (missing for parts written before versions were recorded) """
+    versions = []
+    for part in sorted(Path(store).glob("*.parquet")):
+        stored = pd.read_parquet(part, columns = [col for col in ["date", PANEL_VERSION] if col in pq.read_schema(part).names])
+        versions.append(stored.drop_duplicates("date").reindex(columns = ["date", PANEL_VERSION]))
+    if not versions:
+        return pd.Series([], index = pd.DatetimeIndex([], name = "date"), name = PANEL_VERSION, dtype = object)
+    return pd.concat(versions).drop_duplicates("date").set_index("date")[PANEL_VERSION]
+
+def stored_dates(store: Path) -> pd.DatetimeIndex:
+    """ dates already present in a panel store """
+    return pd.DatetimeIndex(stored_versions(store).index)
+
+def drop_dates(store: Path, dates: Sequence[pd.Timestamp], keep: Sequence[Path] = ()):
+    """ remove the rows for the given dates from the parts of a panel store, other than those in keep """
+    for part in sorted(Path(store).glob("*.parquet")):
+        if part in keep:
+            continue
+        panel = pd.read_parquet(part)
+        stale = panel["date"].isin(dates)
+        if not stale.any():
+            continue
+        if stale.all():
+            part.unlink()
+            continue
+        tmp = store/("." + part.name)
+        panel[~stale].to_parquet(tmp, index = False)
+        tmp.replace(part)
+
+def update_panel(dst: Path, start: str, end: str, store: Optional[Path] = None, workers: int = 8) -> Path:
+    """ 
+    parse the downloaded daily reports in dst for dates in the range that are not yet in the panel store (by default 
+    dst/panel), or whose report has been rewritten since it was stored, on a thread pool, and append them to the store
+    as a new Parquet part, replacing the rows stored for revised reports; returns the store path 
+    """
+    dst   = Path(dst)
+    store = Path(store) if store else dst/"panel"
+    stored  = stored_versions(store)
+    reports = {date: dst/(date.strftime(DATE_FMT) + ".csv") for date in pd.date_range(pd.Timestamp(start), pd.Timestamp(end))}
+    current = {date: report_version(path) for (date, path) in reports.items() if path.exists()}
+    dates   = [date for (date, version) in current.items() if stored.get(date) != version]
+    if not dates:
+        return store
+    revised = [date for date in dates if date in stored.index]
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        parsed = list(pool.map(lambda date: parse_report(reports[date], date).assign(**{PANEL_VERSION: current[date]}), dates))
+    # labels are stored as plain strings: categorical parts each get a dictionary index sized to their own labels, 
+    # and parts with few labels cannot then be read together with parts with many
+    panel = pd.concat(parsed, ignore_index = True)
+    # write under a hidden name first so that readers never see a partial part
+    store.mkdir(parents = True, exist_ok = True)
+    part = store/f"part-{dates[0]:%Y%m%d}-{dates[-1]:%Y%m%d}-{uuid.uuid4().hex[:8]}.parquet"
+    tmp  = store/("." + part.name)
+    panel.to_parquet(tmp, index = False)
+    tmp.replace(part)
+    if revised:
+        drop_dates(store, revised, keep = [part])
+        logger.info("re-ingested %d revised CSSE reports", len(revised))
+    logger.info("appended %d CSSE reports (%d rows) to %s", len(dates), len(panel), part)
+    return store
 
-def fetch_range(dst: Path, start: str, end: str):
-    for date in pd.date_range(pd.Timestamp(start), pd.Timestamp(end)):
-        fetch(dst, date)
+def load_panel(store: Path, country: Optional[str] = None, province: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None) -> pd.DataFrame:
+    """ read the panel store, filtering by country, province and date range while reading, indexed by (Country_Region, Province_State, date), with categorical labels """
+    filters = []
+    if country is not None:
+        filters.append(("Country_Region", "==", country))
+    if province is not None:
+        filters.append(("Province_State", "==", province))
+    if start is not None:
+        filters.append(("date", ">=", pd.Timestamp(start)))
+    if end is not None:
+        filters.append(("date", "<=", pd.Timestamp(end)))
+    panel = pd.read_parquet(store, filters = filters or None)
+    for col in PANEL_LABELS:
+        panel[col] = panel[col].astype("category")
+    return panel.drop(columns = PANEL_VERSION, errors = "ignore").set_index(PANEL_INDEX).sort_index()
 
 def load(dst: Path, start: str, end: str, selector: Optional[str] = None) -> pd.DataFrame:
     return pd.concat([
@@ -35,7 +181,7 @@ def load_country(dst: Path, start: str, end: str, country: str, schema_version:
 def assemble_timeseries(df: pd.DataFrame, province: Optional[str] = None):
     totals = (
         df[df.Province_State == province].set_index("date") if province else 
-        df.set_index(["date", "Province_State"]).stack().sum(level = [0, 2]).unstack()
+        df.groupby("date")[["Deaths", "Recovered", "Confirmed"]].sum(min_count = 1)
     )[["Deaths", "Recovered", "Confirmed"]]\
         .rename(columns = {"Confirmed": "T", "Deaths": "D", "Recovered": "R"})
     return pd.concat([
@@ -1,8 +1,12 @@
+from itertools import islice
 from pathlib import Path
-from typing import Dict, Sequence
+from typing import Dict, Sequence, Union
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
+
+from ..utils import normalize_columns
 
 """ set up migration matrices from DDL matrix data """
 
@@ -11,7 +15,33 @@ district_2011_replacements = {
         'Mumbai Suburban' : 'Mumbai'}
  }
 
-def load_migration_matrix(matrix_path: Path, populations: np.array) -> np.matrix:
+def load_sparse_matrix(matrix_path: Path, chunksize: int = 64) -> sparse.csc_matrix:
+    """ read a headerless CSV matrix a block of rows at a time, keeping only the nonzero entries """
+    (rows, cols, vals), offset, width = ([], [], []), 0, 0
+    with open(matrix_path) as lines:
+        while True:
+            chunk = list(islice(lines, chunksize))
+            if not chunk:
+                break
+            block  = np.loadtxt(chunk, delimiter=',', ndmin = 2)
+            (r, c) = np.nonzero(block)
+            rows.append(r + offset)
+            cols.append(c)
+            vals.append(block[r, c])
+            offset += block.shape[0]
+            width   = block.shape[1]
+    return sparse.coo_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape = (offset, width)).tocsc()
+
+def load_migration_matrix(matrix_path: Path, populations: np.array, as_sparse: bool = False) -> Union[np.matrix, sparse.csc_matrix]:
+    """ 
+    population-weighted, column-normalized migration matrix; the two paths differ for units with no inflow: the 
+    dense matrix has NaN in their columns (0/0), while the sparse one leaves them empty, i.e. 0 (as 
+    district_migration_matrices does for both) 
+    """
+    if as_sparse:
+        M = load_sparse_matrix(matrix_path)       # read in nonzero entries only
+        M = sparse.diags(populations) @ M         # weight by population
+        return normalize_columns(M)               # normalize
     M  = np.loadtxt(matrix_path, delimiter=',') # read in raw data
     M *= populations[:,  None]                  # weight by population
     M /= M.sum(axis = 0)                        # normalize
@@ -19,7 +49,8 @@ def load_migration_matrix(matrix_path: Path, populations: np.array) -> np.matrix
 
 def district_migration_matrices(
     matrix_path: Path, 
-    states: Sequence[str]) -> Dict[str, np.matrix]:
+    states: Sequence[str],
+    as_sparse: bool = False) -> Dict[str, Union[np.matrix, sparse.csc_matrix]]:
     mm = pd.read_csv(matrix_path)
     aggregations = dict()
     for col in  ['D_StateCensus2011', 'D_DistrictCensus2011', 'O_StateCensus2011', 'O_DistrictCensus2011']:
@@ -31,12 +62,22 @@ def district_migration_matrices(
             mm_state.replace(district_2011_replacements[state], inplace=True)
         # group to combine multiple districts with same name based on above
         grouped_mm_state = mm_state.groupby(['D_DistrictCensus2011', 'O_DistrictCensus2011'])[['O_Population_2011','NSS_STMigrants']].sum().reset_index()
-        pivot = grouped_mm_state.pivot(index = "D_DistrictCensus2011", columns = "O_DistrictCensus2011", values = "NSS_STMigrants").fillna(0)
-        M  = np.matrix(pivot)
-        Mn = M/M.sum(axis = 0)
-        Mn[np.isnan(Mn)] = 0
+        if as_sparse:
+            # build the destination x origin matrix straight from the edge list instead of pivoting to a dense frame
+            destinations = pd.Categorical(grouped_mm_state.D_DistrictCensus2011)
+            origins      = pd.Categorical(grouped_mm_state.O_DistrictCensus2011)
+            M  = sparse.coo_matrix(
+                (grouped_mm_state.NSS_STMigrants.fillna(0).values, (destinations.codes, origins.codes)), 
+                shape = (len(destinations.categories), len(origins.categories)))
+            index, Mn = pd.Index(destinations.categories, name = "D_DistrictCensus2011"), normalize_columns(M)
+        else:
+            pivot = grouped_mm_state.pivot(index = "D_DistrictCensus2011", columns = "O_DistrictCensus2011", values = "NSS_STMigrants").fillna(0)
+            M  = np.matrix(pivot)
+            Mn = M/M.sum(axis = 0)
+            Mn[np.isnan(Mn)] = 0
+            index = pivot.index
         aggregations[state] = (
-            pivot.index, 
+            index, 
             grouped_mm_state.groupby("O_DistrictCensus2011")["O_Population_2011"].agg(lambda x: list(x)[0]).values, 
             Mn
         )
@@ -1,9 +1,56 @@
-from .commons import download_data
+from pathlib import Path
+from typing import Optional, Sequence
 
-""" download the latest policy stringency data from the Oxford tracker """
+import pandas as pd
+
+from .commons import download_data, parquet_cached
+
+""" download and load the latest policy stringency data from the Oxford tracker """
 
 URL      = "https://raw.githubusercontent.com/OxCGRT/covid-policy-tracker/master/data/"
 filename = "OxCGRT_latest.csv"
 
-def download_latest_stringency(dest):
-    download_data(dest, filename, base_url = URL)
\ No newline at end of file
+# identifying and free-text columns in the tracker data, always read as text
+TEXT_COLUMNS = ["CountryName", "CountryCode", "RegionName", "RegionCode", "Jurisdiction", "M1_Wildcard"]
+# free-text columns, kept as plain strings rather than categories: they are mostly empty, and a categorical with 
+# no categories does not come back from the Parquet cache with the dtype it was stored with
+FREE_TEXT_COLUMNS = ["M1_Wildcard"]
+DATE_FORMAT  = "%Y%m%d"
+
+def download_latest_stringency(dest) -> bool:
+    """ download the latest stringency data, skipping the download if it is unchanged since the last one """
+    return download_data(dest, filename, base_url = URL)
+
+def parse_stringency(path: Path) -> pd.DataFrame:
+    """ read the tracker CSV with consistent dtypes, keyed by region (RegionCode for subnational rows, CountryCode otherwise) and date """
+    columns = pd.read_csv(path, nrows = 0).columns
+    df = pd.read_csv(path, dtype = {col: str for col in columns if col in TEXT_COLUMNS or col == "Date"}, low_memory = False)
+    df["Date"]   = pd.to_datetime(df["Date"], format = DATE_FORMAT)
+    df["region"] = df["RegionCode"].fillna(df["CountryCode"])
+    # indicators, flags and indices are stored as floats; every other column, including text columns that vary across
+    # releases (e.g. the V2B/V2C age ranges), is categorical apart from free text
+    numeric = [col for col in df.columns if col != "Date" and pd.api.types.is_numeric_dtype(df[col])]
+    labels  = [col for col in df.columns if col != "Date" and col not in numeric and col not in FREE_TEXT_COLUMNS]
+    df[numeric] = df[numeric].astype("float64")
+    df[labels]  = df[labels].astype("category")
+    return df.set_index(["region", "Date"]).sort_index()
+
+def load_stringency(path: Path, cache: Optional[Path] = None) -> pd.DataFrame:
+    """
+    load the tracker data indexed by (region, Date), where region is the RegionCode of subnational rows (e.g. US_CA) and
+    the ISO country code of national ones; if a cache directory is given, the parsed frame is stored there as Parquet
+    and reused until the file changes
+    """
+    if cache is None:
+        return parse_stringency(path)
+    return parquet_cached(path, parse_stringency, cache)
+
+def stringency(df: pd.DataFrame, regions: Sequence[str], start: Optional[str] = None, end: Optional[str] = None, column: str = "StringencyIndex") -> pd.DataFrame:
+    """
+    look up an indicator for a list of regions over a date range from a frame returned by load_stringency, as a date x
+    region frame; regions absent from the data come back as all-NaN columns
+    """
+    known  = [region for region in regions if region in df.index.levels[0]]
+    dates  = slice(pd.Timestamp(start) if start else None, pd.Timestamp(end) if end else None)
+    values = df[column].loc[(known, dates)]
+    return values.unstack("region").reindex(columns = list(regions))
@@ -1,12 +1,24 @@
+import tempfile
 from pathlib import Path
 from typing import Dict, Iterator, Optional, Sequence, Tuple, Union, List
 
 import geopandas as gpd
 import numpy as np
 import pandas as pd
-from scipy.spatial import distance_matrix
+from scipy import sparse
+from scipy.spatial import cKDTree, distance_matrix
 from scipy.stats import poisson, binom
-from .utils import normalize, fillna
+from .trajectory import QuantileTrajectory, Trajectory, broadcast_trailing, pad_trailing, recorder, reserve, set_dtype_policy
+from .utils import file_digest, normalize, normalize_columns, fillna, fillna_
+
+def stack(values: Sequence) -> np.ndarray:
+    """ stack scalars and arrays of broadcast-compatible shapes along a new leading axis """
+    return np.stack(np.broadcast_arrays(*values))
+
+def align(*arrays) -> List[np.ndarray]:
+    """ broadcast per-unit arrays with and without trailing simulation axes against each other """
+    ndim = max(map(np.ndim, arrays))
+    return np.broadcast_arrays(*(pad_trailing(np.asarray(array), ndim) for array in arrays))
 
 def _max(*args):
     try: 
@@ -36,7 +48,9 @@ class SIR():
         upper_CI:            float = 0.0,   # initial upper confidence interval for new case counts
         lower_CI:            float = 0.0,   # initial lower confidence interval for new case counts
         CI:                  float = 0.95,  # confidence interval
-        random_seed:         int   = 0      # random seed 
+        random_seed:Optional[int]  = None,  # random seed, None -> fresh entropy 
+        recording:           str   = "full",   # "full" keeps every simulation lane, "summary" only per-day statistics across lanes
+        dtype:               str   = "default" # "compact" stores integer counts as int32 and real values as float32
         ):
         
         # save params 
@@ -49,30 +63,32 @@ class SIR():
         self.Rt0   = Rt0
         self.CI    = CI 
 
+        self.rng   = np.random.default_rng(random_seed)
+
         # state and delta vectors 
         if dT0 is None:
-            dT0 = np.random.poisson(self.ll) # initial number of new cases 
-        self.dT = [dT0] # case change rate, initialized with the first introduction, if any
-        self.Rt = [Rt0]
-        self.b  = [np.exp(self.gamma * (Rt0 - 1.0))]
-        self.S  = [S0 if S0 is not None else population - R0 - D0 - I0]
-        self.I  = [I0] 
-        self.R  = [R0]
-        self.D  = [D0]
-        self.dR = [0]
-        self.dD = [0]
-        self.N  = [population - D0] # total population = S + I + R 
-        self.beta = [Rt0 * self.gamma] # initial contact rate 
-        self.total_cases = [I0] # total cases 
-        self.upper_CI = [upper_CI]
-        self.lower_CI = [lower_CI]
-
-        np.random.seed(random_seed)
+            dT0 = self.rng.poisson(self.ll) # initial number of new cases 
+        (curve, quantiles) = recorder(recording)
+        self.dT = curve([dT0]) # case change rate, initialized with the first introduction, if any
+        self.Rt = curve([Rt0])
+        self.b  = curve([np.exp(self.gamma * (Rt0 - 1.0))])
+        self.S  = curve([S0 if S0 is not None else population - R0 - D0 - I0])
+        self.I  = curve([I0]) 
+        self.R  = curve([R0])
+        self.D  = curve([D0])
+        self.dR = curve([0])
+        self.dD = curve([0])
+        self.N  = curve([population - D0]) # total population = S + I + R 
+        self.beta = curve([Rt0 * self.gamma]) # initial contact rate 
+        self.total_cases = curve([I0]) # total cases 
+        self.upper_CI = quantiles([upper_CI])
+        self.lower_CI = quantiles([lower_CI])
+        set_dtype_policy(self, dtype, population)
 
     # period 1: inter-state migratory transmission
     def migration_step(self) -> int:
         # note: update state *in place* since we consider it the same time period 
-        outflux = np.random.poisson(self.mu * self.I[-1])
+        outflux = self.rng.poisson(self.mu * self.I[-1])
         new_I = self.I[-1] - outflux
         if new_I < 0: new_I = 0
         self.I[-1]  = new_I
@@ -89,19 +105,17 @@ class SIR():
         b  = np.exp(self.gamma * (Rt - 1))
 
         rate_T    = max(0, self.b[-1] * self.dT[-1] + (1 - self.b[-1] + self.gamma * self.b[-1] * self.Rt[-1])*dB)
-        num_cases = poisson.rvs(rate_T)
-        self.upper_CI.append(poisson.ppf(self.CI,     rate_T))
-        self.lower_CI.append(poisson.ppf(1 - self.CI, rate_T))
+        num_cases = self.rng.poisson(rate_T)
+        self.upper_CI.defer(poisson, self.CI,     rate_T)
+        self.lower_CI.defer(poisson, 1 - self.CI, rate_T)
 
         I += num_cases
         S -= num_cases
 
         rate_D    = self.m * self.gamma * I
-        num_dead  = poisson.rvs(rate_D)
-        D        += num_dead
-
         rate_R    = (1 - self.m) * self.gamma * I 
-        num_recov = poisson.rvs(rate_R)
+        num_dead, num_recov = self.rng.poisson((rate_D, rate_R))
+        D        += num_dead
         R        += num_recov
 
         I -= (num_dead + num_recov)
@@ -137,19 +151,17 @@ class SIR():
         b  = np.exp(self.gamma * (Rt - 1))
 
         rate_T    = (self.b[-1] * self.dT[-1]).clip(0)
-        num_cases = poisson.rvs(rate_T, size = num_sims)
-        self.upper_CI.append(poisson.ppf(self.CI,     rate_T))
-        self.lower_CI.append(poisson.ppf(1 - self.CI, rate_T))
+        num_cases = self.rng.poisson(rate_T, size = num_sims)
+        self.upper_CI.defer(poisson, self.CI,     rate_T)
+        self.lower_CI.defer(poisson, 1 - self.CI, rate_T)
 
         I += num_cases
         S -= num_cases
 
         rate_D    = self.m * self.gamma * I
-        num_dead  = poisson.rvs(rate_D, size = num_sims)
-        D        += num_dead
-
         rate_R    = (1 - self.m) * self.gamma * I 
-        num_recov = poisson.rvs(rate_R, size = num_sims)
+        num_dead, num_recov = self.rng.poisson(np.stack([rate_D, rate_R]), size = (2, num_sims))
+        D        += num_dead
         R        += num_recov
 
         I -= (num_dead + num_recov)
@@ -184,19 +196,17 @@ class SIR():
         Rt = self.Rt0 * S/N
         p = self.gamma * Rt * I/N
 
-        num_cases = binom.rvs(n = S, p = p, size = num_sims)
-        self.upper_CI.append(binom.ppf(self.CI,     n = S, p = p))
-        self.lower_CI.append(binom.ppf(1 - self.CI, n = S, p = p))
+        num_cases = self.rng.binomial(n = S, p = p, size = num_sims)
+        self.upper_CI.defer(binom, self.CI,     np.copy(S), p)
+        self.lower_CI.defer(binom, 1 - self.CI, np.copy(S), p)
 
         I += num_cases
         S -= num_cases
 
         rate_D    = self.m * self.gamma * I
-        num_dead  = poisson.rvs(rate_D, size = num_sims)
-        D        += num_dead
-
         rate_R    = (1 - self.m) * self.gamma * I 
-        num_recov = poisson.rvs(rate_R, size = num_sims)
+        num_dead, num_recov = self.rng.poisson(np.stack([rate_D, rate_R]), size = (2, num_sims))
+        D        += num_dead
         R        += num_recov
 
         I -= (num_dead + num_recov)
@@ -219,7 +229,12 @@ class SIR():
         self.dT.append(num_cases)
         self.total_cases.append(I + R + D)
 
+    def reserve(self, days: int):
+        """ preallocate state storage for the given number of additional days """
+        return reserve(self, days)
+
     def run(self, days: int):
+        self.reserve(days)
         for _ in range(days):
             self.forward_epi_step()
         return self
@@ -251,7 +266,10 @@ class Age_SIRVD():
         num_age_bins:        int   = 7,     # number of age bins
         phi:                 float = 0.25,  # proportion of population vaccinated annually 
         ve:                  float = 0.7,   # vaccine effectiveness
-        random_seed:         int   = 0      # random seed,  
+        random_seed:         int   = 0,     # random seed,  
+        inplace:             bool  = False, # step by writing into preallocated state rather than allocating new arrays
+        recording:           str   = "full",   # "full" keeps every simulation lane, "summary" only per-day statistics across lanes
+        dtype:               str   = "default" # "compact" stores integer counts as int32 and real values as float32
     ):
         self.name  = name 
         self.pop0  = population
@@ -262,66 +280,75 @@ class Age_SIRVD():
         self.Rt0   = Rt0
         self.CI    = CI 
 
+        self.rng   = np.random.default_rng(random_seed)
+
         # state and delta vectors 
         if dT0 is None:
-            dT0 = np.random.poisson(self.ll) # initial number of new cases 
-        self.dT = [dT0] # case change rate, initialized with the first introduction, if any
-        self.Rt = [Rt0]
-        self.b  = [np.exp(self.gamma * (Rt0 - 1.0))]
-        self.S  = [S0 if S0 is not None else population - R0 - D0 - I0]
-        self.I  = [I0] 
-        self.R  = [R0]
-        self.D  = [D0]
-        self.dR = [0]
-        self.dD = [0]
-        self.N  = [population - D0] # total population = S + I + R 
-        self.beta = [Rt0 * self.gamma] # initial contact rate 
-        self.total_cases = [I0] # total cases 
-        self.upper_CI = [upper_CI]
-        self.lower_CI = [lower_CI]
-
-        np.random.seed(random_seed)
-
-
-        self.N = [S0 + I0 + R0]
+            dT0 = self.rng.poisson(self.ll) # initial number of new cases 
+        (curve, quantiles) = recorder(recording)
+        self.dT = curve([dT0]) # case change rate, initialized with the first introduction, if any
+        self.Rt = curve([Rt0])
+        self.b  = curve([np.exp(self.gamma * (Rt0 - 1.0))])
+        self.S  = curve([S0 if S0 is not None else population - R0 - D0 - I0])
+        self.I  = curve([I0]) 
+        self.R  = curve([R0])
+        self.D  = curve([D0])
+        self.dR = curve([0])
+        self.dD = curve([0])
+        self.N  = curve([population - D0]) # total population = S + I + R 
+        self.beta = curve([Rt0 * self.gamma]) # initial contact rate 
+        self.total_cases = curve([I0]) # total cases 
+        self.upper_CI = quantiles([upper_CI])
+        self.lower_CI = quantiles([lower_CI])
+
+        self.N = curve([S0 + I0 + R0])
         shape = (sims, bins) = S0.shape
         
         self.num_age_bins = num_age_bins
         self.phi  = phi
         self.ve   = ve
         
-        self.S    = [S0]
+        self.S    = curve([S0])
 
-        self.S_vm = [np.zeros(shape)]
-        self.S_vn = [np.zeros(shape)]
+        self.S_vm = curve([np.zeros(shape)])
+        self.S_vn = curve([np.zeros(shape)])
         
-        self.I_vn = [np.zeros(shape)]
+        self.I_vn = curve([np.zeros(shape)])
         
-        self.R_vm = [np.zeros(shape)]
-        self.R_vn = [np.zeros(shape)]
+        self.R_vm = curve([np.zeros(shape)])
+        self.R_vn = curve([np.zeros(shape)])
         
-        self.D_vn = [np.zeros(shape)]
+        self.D_vn = curve([np.zeros(shape)])
 
-        self.N_vn = [np.zeros(shape)] # number vaccinated, ineffective 
-        self.N_vm = [np.zeros(shape)] # number vaccinated, immune 
+        self.N_vn = curve([np.zeros(shape)]) # number vaccinated, ineffective 
+        self.N_vm = curve([np.zeros(shape)]) # number vaccinated, immune 
 
-        self.N_v  = [np.zeros(shape)] # total vaccinated
-        self.N_nv = [np.zeros(shape)] # total unvaccinated
-        self.pi   = [np.zeros(shape)]
-        self.q1   = [np.zeros(shape)]
-        self.q0   = [np.zeros(shape)]
+        self.N_v  = curve([np.zeros(shape)]) # total vaccinated
+        self.N_nv = curve([np.zeros(shape)]) # total unvaccinated
+        self.pi   = curve([np.zeros(shape)])
+        self.q1   = curve([np.zeros(shape)])
+        self.q0   = curve([np.zeros(shape)])
 
-        self.dT_total = [np.zeros(sims)]
-        self.dD_total = [np.zeros(sims)]
-        self.dV: List[np.array] = []
+        self.dT_total = curve([np.zeros(sims)])
+        self.dD_total = curve([np.zeros(sims)])
+        self.dV = curve()
 
-        self.rng = np.random.default_rng(random_seed)
+        self.inplace = inplace
+        self.scratch_buffers: Dict[str, np.ndarray] = {}
+        set_dtype_policy(self, dtype, population)
+
+    def reserve(self, days: int):
+        """ preallocate state storage for the given number of additional days """
+        return reserve(self, days)
 
     def parallel_forward_epi_step(self, dV: Optional[np.array], num_sims = 10000): 
         """
             in the SIR and NetworkedSIR, the dB is the reservoir introductions; 
             here, dV is a (self.age_bins, num_sims)-sized array of vaccination doses (administered)
         """
+        if self.inplace:
+            return self.inplace_forward_epi_step(dV, num_sims)
+
         # get previous state 
         S, S_vm, S_vn, I, I_vn, R, R_vm, R_vn, D, D_vn, N, N_vn, N_vm = (_[-1].copy() for _ in 
             (self.S, self.S_vm, self.S_vn, self.I, self.I_vn, self.R, self.R_vm, self.R_vn, self.D, self.D_vn, self.N, self.N_vn, self.N_vm))
@@ -351,8 +378,8 @@ class Age_SIRVD():
 
         lambda_T = (self.b[-1] * self.dT[-1])
         dT = np.clip(self.rng.poisson(lambda_T), 0, np.sum(S, axis = 1))
-        self.upper_CI.append(poisson.ppf(    self.CI, lambda_T))
-        self.lower_CI.append(poisson.ppf(1 - self.CI, lambda_T))
+        self.upper_CI.defer(poisson,     self.CI, lambda_T)
+        self.lower_CI.defer(poisson, 1 - self.CI, lambda_T)
 
         dS    = fillna(S   /(S+S_vn)) * (S_ratios * dT[:, None])
         dS_vn = fillna(S_vn/(S+S_vn)) * (S_ratios * dT[:, None])
@@ -423,22 +450,149 @@ class Age_SIRVD():
 
         self.dV.append(dV)
 
+    def scratch(self, key: str, shape: tuple) -> np.ndarray:
+        """ reusable float buffer for intermediate values in the in-place step """
+        buffer = self.scratch_buffers.get(key)
+        if buffer is None or buffer.shape != shape:
+            buffer = self.scratch_buffers[key] = np.empty(shape)
+        return buffer
+
+    def inplace_forward_epi_step(self, dV: Optional[np.array], num_sims = 10000):
+        """
+            same update as parallel_forward_epi_step, evaluated with out= ufuncs into reusable scratch buffers 
+            and written directly into newly allocated trajectory rows; results are bit-identical
+        """
+        shape = self.S[-1].shape
+
+        # allocate today's rows before taking views of yesterday's, since allocation may move the buffers
+        S, S_vm, S_vn, I, I_vn, R, R_vm, R_vn, D, D_vn, N, N_vn, N_vm, N_v, N_nv, pi, q1, q0, total_cases = (_.allocate(shape) for _ in 
+            (self.S, self.S_vm, self.S_vn, self.I, self.I_vn, self.R, self.R_vm, self.R_vn, self.D, self.D_vn, self.N, self.N_vn, self.N_vm, 
+             self.N_v, self.N_nv, self.pi, self.q1, self.q0, self.total_cases))
+        S_prev, S_vm_prev, S_vn_prev, I_prev, I_vn_prev, R_prev, R_vm_prev, R_vn_prev, D_prev, D_vn_prev, N_prev = (_.view(-2) for _ in 
+            (self.S, self.S_vm, self.S_vn, self.I, self.I_vn, self.R, self.R_vm, self.R_vn, self.D, self.D_vn, self.N))
+
+        # intermediate states after vaccination (I_vn is kept in today's row until the epi update)
+        S_, S_vn_, I_, R_ = (self.scratch(key, shape) for key in ("S", "S_vn", "I", "R"))
+        dS_vm, dS_vn, dI_vn, dR_vm, S_ratios, tmp = (self.scratch(key, shape) for key in ("dS_vm", "dS_vn", "dI_vn", "dR_vm", "S_ratios", "tmp"))
+
+        # vaccination occurs here
+        fillna_(np.divide(S_prev, N_prev, out = tmp))
+        np.multiply(np.multiply(tmp,      self.ve,  out = dS_vm), dV, out = dS_vm)
+        np.multiply(np.multiply(tmp, (1 - self.ve), out = dS_vn), dV, out = dS_vn)
+        np.multiply(fillna_(np.divide(I_prev, N_prev, out = dI_vn)), dV, out = dI_vn)
+        np.multiply(fillna_(np.divide(R_prev, N_prev, out = dR_vm)), dV, out = dR_vm)
+
+        np.add(S_vm_prev, dS_vm, out = S_vm).clip(0, out = S_vm)
+        np.add(S_vn_prev, dS_vn, out = S_vn_).clip(0, out = S_vn_)
+        np.subtract(S_prev, np.add(dS_vn, dS_vm, out = tmp), out = S_).clip(0, out = S_)
+
+        np.add(I_vn_prev, dI_vn, out = I_vn).clip(0, out = I_vn)
+        np.subtract(I_prev, dI_vn, out = I_).clip(0, out = I_)
+
+        np.add(R_vm_prev, dR_vm, out = R_vm).clip(0, out = R_vm)
+        np.subtract(R_prev, dR_vm, out = R_).clip(0, out = R_)
+
+        susceptible = np.add(S_, S_vn_, out = tmp)
+        fillna_(np.divide(susceptible, susceptible.sum(axis = 1)[:, None], out = S_ratios))
+
+        # core epi update with additional bins (infection, death, recovery)
+        total = np.add(N_prev, S_vn_, out = dS_vm)
+        for compartment in (S_vm, I_vn, R_vn_prev, R_vm):
+            np.add(total, compartment, out = total)
+        Rt = self.Rt0 * susceptible.sum(axis = 1)/total.sum(axis = 1)
+        b  = np.exp(self.gamma * (Rt - 1))
+
+        lambda_T = (self.b[-1] * self.dT[-1])
+        dT = np.clip(self.rng.poisson(lambda_T), 0, np.sum(S_, axis = 1))
+        self.upper_CI.defer(poisson,     self.CI, lambda_T)
+        self.lower_CI.defer(poisson, 1 - self.CI, lambda_T)
+
+        np.multiply(S_ratios, dT[:, None], out = S_ratios)
+        dS = np.multiply(fillna_(np.divide(S_,    susceptible, out = dI_vn)), S_ratios, out = dI_vn)
+        dS_vn = np.multiply(fillna_(np.divide(S_vn_, susceptible, out = dS_vn)), S_ratios, out = dS_vn)
+
+        np.subtract(S_,    dS,    out = S   ).clip(0, out = S)
+        np.subtract(S_vn_, dS_vn, out = S_vn).clip(0, out = S_vn)
+
+        dD    = self.rng.poisson(np.multiply(   self.m  * self.gamma, I_  , out = tmp), size = (num_sims, self.num_age_bins))
+        dD_vn = self.rng.poisson(np.multiply(   self.m  * self.gamma, I_vn, out = tmp), size = (num_sims, self.num_age_bins))
+        dR    = self.rng.poisson(np.multiply((1-self.m) * self.gamma, I_  , out = tmp), size = (num_sims, self.num_age_bins))
+        dR_vn = self.rng.poisson(np.multiply((1-self.m) * self.gamma, I_vn, out = tmp), size = (num_sims, self.num_age_bins))
+
+        dI    = np.subtract(dS,    np.add(dD,    dR,    out = tmp), out = dS)
+        dI_vn = np.subtract(dS_vn, np.add(dD_vn, dR_vn, out = tmp), out = dS_vn)
+
+        np.add(D_prev,    dD,    out = D   ).clip(0, out = D)
+        np.add(D_vn_prev, dD_vn, out = D_vn).clip(0, out = D_vn)
+
+        np.add(R_,        dR,    out = R   ).clip(0, out = R)
+        np.add(R_vn_prev, dR_vn, out = R_vn).clip(0, out = R_vn)
+
+        np.add(I_,        dI,    out = I   ).clip(0, out = I)
+        np.add(I_vn,      dI_vn, out = I_vn).clip(0, out = I_vn)
+
+        np.add(np.add(S,    I,    out = N),    R,    out = N)
+        np.add(np.add(S_vn, I_vn, out = N_vn), R_vn, out = N_vn)
+        np.add(S_vm, R_vm, out = N_vm)
+
+        # calculate vax policy evaluation metrics 
+        N0 = self.N.view(0)
+        np.add(S_vm, S_vn, out = N_v)
+        for compartment in (I_vn, D_vn, R_vn, R_vm):
+            np.add(N_v, compartment, out = N_v)
+        np.clip(N_v, 0, N0, out = N_v)
+        np.subtract(N0, N_v, out = N_nv)
+        np.divide(N_v, N0, out = pi)
+
+        np.subtract(1, np.divide(np.subtract(D_vn, self.D_vn.view(0), out = q1), N_v,  out = q1), out = q1)
+        np.nan_to_num(q1, copy = False, nan = 0, neginf = 1).clip(0, 1, out = q1)
+        np.subtract(1, np.divide(np.subtract(D,    self.D   .view(0), out = q0), N_nv, out = q0), out = q0)
+        np.nan_to_num(q0, copy = False, nan = 0, neginf = 1).clip(0, 1, out = q0)
+
+        np.add(np.add(I, R, out = total_cases), D, out = total_cases)
+
+        # update remaining state vectors 
+        self.Rt.append(Rt)
+        self.b.append(b)
+        self.dR.append(dR)
+        self.dD.append(dD)
+        self.dT.append(dT)
+        self.dT_total.append(dT)
+        self.dD_total.append((dD + dD_vn).sum(axis = 1))
+        self.dV.append(dV)
+
+def outflow_weights(migrations: Optional[Union[np.matrix, sparse.spmatrix]]) -> Union[np.ndarray, int]:
+    """ total share of each unit's outflux that is transmitted onward, i.e. the row sums of a dense or sparse migration matrix """
+    if migrations is None:
+        return 0
+    return np.asarray(migrations.sum(axis = 1)).reshape(-1)
+
 class NetworkedSIR():
     """ composition of SIR models implementing cross-geography interactions """
-    def __init__(self, units: Sequence[SIR], default_migrations: Optional[np.matrix] = None, random_seed : Optional[int] = None):
+    def __init__(self, units: Sequence[SIR], default_migrations: Optional[np.matrix] = None, random_seed : Optional[int] = None, dtype: Optional[str] = None):
         self.units      = units
         self.migrations = default_migrations
         self.names      = {unit.name: unit for unit in units}
+        # apply a network-wide dtype policy to the units' storage, if one is provided
+        if dtype is not None:
+            for unit in units:
+                set_dtype_policy(unit, dtype, unit.pop0)
+        # if the network is seeded, give each unit an independent stream spawned from that seed; otherwise the units
+        # keep the generators they were constructed with (independent unless the units were given the same seed)
         if random_seed is not None:
-            np.random.seed(random_seed)
+            for (unit, unit_seed) in zip(units, np.random.SeedSequence(random_seed).spawn(len(units))):
+                unit.rng = np.random.default_rng(unit_seed)
 
     def __len__(self) -> int:
         return len(self.units)
 
     def tick(self, migrations: np.matrix):
+        self.step(outflow_weights(migrations))
+
+    def step(self, weights: Union[np.ndarray, int]):
         # run migration step 
         outflux       = [unit.migration_step() for unit in self.units]
-        transmissions = [flux * migrations[i, :].sum() for (i, flux) in enumerate(outflux)]
+        transmissions = [flux * weight for (flux, weight) in zip(outflux, np.broadcast_to(weights, len(self.units)))]
         
         # now run forward epidemiological model 
         for (unit, tmx) in zip(self.units, transmissions):
@@ -447,8 +601,12 @@ class NetworkedSIR():
     def run(self, days: int, migrations: Optional[np.matrix] = None):
         if migrations is None:
             migrations = self.migrations
+        for unit in self.units:
+            unit.reserve(days)
+        # migration row sums are fixed over the run, so dense and sparse matrices are reduced once up front
+        weights = outflow_weights(migrations)
         for _ in range(days):
-            self.tick(migrations)
+            self.step(weights)
         return self 
 
     def __iter__(self) -> Iterator[SIR]:
@@ -483,6 +641,196 @@ class NetworkedSIR():
             for curve in curves
         }
 
+class NetworkedUnit():
+    """ view of a single unit within a VectorizedNetworkedSIR, exposing the same attributes as an SIR unit """
+    def __init__(self, network: "VectorizedNetworkedSIR", index: int, name: str):
+        self.__dict__.update(network = network, index = index, name = name)
+
+    def __getattr__(self, attr: str):
+        network = self.__dict__["network"]
+        if attr in network.parameters:
+            return network.__dict__[attr][self.index]
+        if attr in network.curves:
+            return UnitTrajectory(network.__dict__[attr], self.index)
+        raise AttributeError(attr)
+
+    def __setattr__(self, attr: str, val):
+        if attr in self.network.parameters:
+            self.network.assign(attr, self.index, val)
+        else:
+            self.__dict__[attr] = val
+
+    def __repr__(self) -> str:
+        return f"[{self.name}]"
+
+class UnitTrajectory(Sequence):
+    """ a single unit's slice of a network-wide (days, units, ...) trajectory """
+    def __init__(self, trajectory: Trajectory, index: int):
+        self.trajectory = trajectory
+        self.index      = index
+
+    def __len__(self) -> int:
+        return len(self.trajectory)
+
+    def __getitem__(self, idx):
+        row = self.trajectory.values[idx, self.index]
+        if isinstance(idx, (int, np.integer)) and isinstance(row, np.ndarray):
+            return row.copy()
+        return row
+
+    def __setitem__(self, idx, value):
+        self.trajectory[idx, self.index] = value
+
+    def __iter__(self):
+        return iter(self.trajectory.values[:, self.index])
+
+    def __array__(self, dtype = None, copy = None):
+        values = self.trajectory.values[:, self.index]
+        return values if dtype is None else values.astype(dtype)
+
+class VectorizedNetworkedSIR():
+    """ 
+    networked SIR model that stores the state of every unit in a single (units,) or (units, sims) array 
+    and advances the whole network with batched draws; drop-in replacement for NetworkedSIR 
+    """
+    parameters = ("Rt0", "gamma", "m", "mu", "ll", "CI", "pop0")
+    curves     = ("dT", "Rt", "b", "S", "I", "R", "D", "dR", "dD", "N", "beta", "total_cases", "upper_CI", "lower_CI")
+
+    def __init__(self, units: Sequence[SIR], default_migrations: Optional[np.matrix] = None, random_seed: Optional[int] = None, num_sims: Optional[int] = None):
+        self.migrations = default_migrations
+        self.rng        = np.random.default_rng(random_seed)
+        self.units      = [NetworkedUnit(self, i, unit.name) for (i, unit) in enumerate(units)]
+        self.names      = {unit.name: unit for unit in self.units}
+
+        # parameters and initial state are taken from the latest entry of each unit
+        for param in self.parameters:
+            setattr(self, param, stack([getattr(unit, param) for unit in units]).astype(float))
+        for curve in self.curves:
+            trajectory = QuantileTrajectory if curve in ("upper_CI", "lower_CI") else Trajectory
+            initial = stack([getattr(unit, curve)[-1] for unit in units])
+            # optionally start num_sims independent simulation lanes per unit from the same initial state
+            if num_sims is not None:
+                initial = np.broadcast_to(pad_trailing(initial, 2), initial.shape[:1] + (num_sims,))
+            setattr(self, curve, trajectory([initial]))
+
+    def __len__(self) -> int:
+        return len(self.units)
+
+    def reserve(self, days: int):
+        """ preallocate state storage for the given number of additional days """
+        return reserve(self, days)
+
+    def assign(self, param: str, idx: int, val):
+        """ set a parameter for a single unit, widening the parameter array if val varies across simulations """
+        # parameters are replaced rather than modified in place since deferred CIs may hold views of them
+        current = getattr(self, param)
+        val     = np.asarray(val, dtype = float)
+        shape   = broadcast_trailing(current.shape[1:], val.shape)
+        updated = np.broadcast_to(pad_trailing(current, len(shape) + 1), current.shape[:1] + shape).copy()
+        updated[idx] = pad_trailing(val, len(shape))
+        setattr(self, param, updated)
+
+    def tick(self, migrations: np.matrix):
+        self.step(outflow_weights(migrations))
+
+    def step(self, weights: Union[np.ndarray, int]):
+        # align per-unit parameters and state so they broadcast along any simulation axis
+        S, I, R, D, N, dT, b, Rt, Rt0, gamma, m, mu, CI, weights = align(
+            self.S[-1], self.I[-1], self.R[-1], self.D[-1], self.N[-1], self.dT[-1], self.b[-1], self.Rt[-1], 
+            self.Rt0, self.gamma, self.m, self.mu, self.CI, weights
+        )
+
+        # period 1: inter-unit migratory transmission
+        outflux = self.rng.poisson(mu * I)
+        I = (I - outflux).clip(0)
+        N = N - outflux
+        self.I[-1] = I
+        self.N[-1] = N
+        dB = outflux * weights
+
+        # period 2: intra-unit community transmission
+        rate_T = (b * dT + (1 - b + gamma * b * Rt) * dB).clip(0)
+
+        Rt = Rt0 * S/N
+        b  = np.exp(gamma * (Rt - 1))
+
+        num_cases = self.rng.poisson(rate_T)
+        self.upper_CI.defer(poisson, CI,     rate_T)
+        self.lower_CI.defer(poisson, 1 - CI, rate_T)
+
+        I = I + num_cases
+        S = S - num_cases
+
+        num_dead, num_recov = self.rng.poisson(np.stack([m * gamma * I, (1 - m) * gamma * I]))
+        D = D + num_dead
+        R = R + num_recov
+        I = I - (num_dead + num_recov)
+
+        S = S.clip(0)
+        I = I.clip(0)
+        D = D.clip(0)
+
+        N = S + I + R
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            beta = (num_cases * N)/(b * S * I)
+
+        # update state vectors 
+        self.Rt.append(Rt)
+        self.b.append(b)
+        self.S.append(S)
+        self.I.append(I)
+        self.R.append(R)
+        self.D.append(D)
+        self.dR.append(num_recov)
+        self.dD.append(num_dead)
+        self.N.append(N)
+        self.beta.append(beta)
+        self.dT.append(num_cases)
+        self.total_cases.append(I + R + D)
+
+    def run(self, days: int, migrations: Optional[np.matrix] = None, weights: Optional[np.ndarray] = None):
+        """ advance the network; precomputed (units,) or (units, sims) outflow weights take precedence over migrations """
+        if migrations is None:
+            migrations = self.migrations
+        self.reserve(days)
+        if weights is None:
+            weights = outflow_weights(migrations)
+        for _ in range(days):
+            self.step(weights)
+        return self 
+
+    def __iter__(self) -> Iterator[NetworkedUnit]:
+        return iter(self.units)
+
+    # index units
+    def __getitem__(self, idx: Union[str, int]) -> NetworkedUnit:
+        if isinstance(idx, int):
+            return self.units[idx]
+        return self.names[idx]
+
+    def set_parameters(self, **kwargs):
+        for (attr, val) in kwargs.items():
+            if callable(val):
+                if val.__code__.co_argcount == 1:
+                    values = [val(unit) for unit in self.units]
+                else: 
+                    values = [val(i, unit) for (i, unit) in enumerate(self.units)]
+            elif isinstance(val, dict):
+                values = [val[unit.name] for unit in self.units]
+            else: 
+                values = [val] * len(self.units)
+            if attr in self.parameters:
+                setattr(self, attr, stack(values).astype(float))
+            else: 
+                for (unit, value) in zip(self.units, values):
+                    unit.__setattr__(attr, value)
+        return self 
+
+    def aggregate(self, curves: Union[Sequence[str], str] = ["Rt", "b", "S", "I", "R", "D", "P", "beta"]) -> Dict[str, np.ndarray]:
+        if isinstance(curves, str):
+            curves = [curves]
+        return {curve: np.asarray(getattr(self, curve)).sum(axis = 1) for curve in curves}
+
 class SEIR():
     """ stochastic SEIR model without external introductions """
     def __init__(self, 
@@ -502,7 +850,8 @@ class SEIR():
         upper_CI:            float = 0.0,   # initial upper confidence interval for new case counts
         lower_CI:            float = 0.0,   # initial lower confidence interval for new case counts
         CI:                  float = 0.95,  # confidence interval
-        random_seed:         int   = 0      # random seed 
+        random_seed:         int   = 0,     # random seed 
+        dtype:               str   = "default" # "compact" stores integer counts as int32 and real values as float32
         ):
         
         # save params 
@@ -516,24 +865,29 @@ class SEIR():
         self.Rt0   = Rt0
         self.CI    = CI 
 
+        self.rng   = np.random.default_rng(random_seed)
+
         # state and delta vectors 
         if dT0 is None:
-            dT0 = np.random.poisson(self.ll) # initial number of new cases 
-        self.dT = [dT0] # case change rate, initialized with the first introduction, if any
-        self.Rt = [Rt0]
-        self.b  = [np.exp(self.gamma * (Rt0 - 1.0))]
-        self.S  = [population - E0 - I0 - R0 - D0]
-        self.E  = [E0]
-        self.I  = [I0] 
-        self.R  = [R0]
-        self.D  = [D0]
-        self.N  = [population - D0] # total population = S + I + R 
-        self.beta = [Rt0 * self.gamma] # initial contact rate 
-        self.total_cases = [I0] # total cases 
-        self.upper_CI = [upper_CI]
-        self.lower_CI = [lower_CI]
-
-        np.random.seed(random_seed)
+            dT0 = self.rng.poisson(self.ll) # initial number of new cases 
+        self.dT = Trajectory([dT0]) # case change rate, initialized with the first introduction, if any
+        self.Rt = Trajectory([Rt0])
+        self.b  = Trajectory([np.exp(self.gamma * (Rt0 - 1.0))])
+        self.S  = Trajectory([population - E0 - I0 - R0 - D0])
+        self.E  = Trajectory([E0])
+        self.I  = Trajectory([I0]) 
+        self.R  = Trajectory([R0])
+        self.D  = Trajectory([D0])
+        self.N  = Trajectory([population - D0]) # total population = S + I + R 
+        self.beta = Trajectory([Rt0 * self.gamma]) # initial contact rate 
+        self.total_cases = Trajectory([I0]) # total cases 
+        self.upper_CI = QuantileTrajectory([upper_CI])
+        self.lower_CI = QuantileTrajectory([lower_CI])
+        set_dtype_policy(self, dtype, population)
+
+    def reserve(self, days: int):
+        """ preallocate state storage for the given number of additional days """
+        return reserve(self, days)
     
     def forward_epi_step(self, dB: int = 0): 
         # get previous state 
@@ -544,25 +898,23 @@ class SEIR():
         b  = np.exp(self.gamma * (Rt - 1))
 
         rate_T    = max(0, self.b[-1] * self.dT[-1])
-        num_cases = poisson.rvs(rate_T)
-        self.upper_CI.append(poisson.ppf(self.CI,     rate_T))
-        self.lower_CI.append(poisson.ppf(1 - self.CI, rate_T))
+        num_cases = self.rng.poisson(rate_T)
+        self.upper_CI.defer(poisson, self.CI,     rate_T)
+        self.lower_CI.defer(poisson, 1 - self.CI, rate_T)
 
         E += num_cases
         S -= num_cases
 
         rate_I    = self.sigma * E
-        num_inf   = poisson.rvs(rate_I)
+        num_inf   = self.rng.poisson(rate_I)
 
         E -= num_inf 
         I += num_inf
 
         rate_D    = self.m * self.gamma * I
-        num_dead  = poisson.rvs(rate_D)
-        D        += num_dead
-
         rate_R    = (1 - self.m) * self.gamma * I 
-        num_recov = poisson.rvs(rate_R)
+        num_dead, num_recov = self.rng.poisson((rate_D, rate_R))
+        D        += num_dead
         R        += num_recov
 
         I -= (num_dead + num_recov)
@@ -594,8 +946,8 @@ class AR1():
     def __init__(self, phi: float = 1.01, sigma: float = 1, I0: int = 10, random_seed: int = 0):
         self.phi = phi 
         self.sigma = sigma
-        self.I = [I0]
-        np.random.seed(random_seed)
+        self.I = Trajectory([I0])
+        self.rng = np.random.default_rng(random_seed)
     
     def set_parameters(self, **kwargs):
         if "phi"   in kwargs: self.phi   = kwargs["phi"]
@@ -603,8 +955,9 @@ class AR1():
         return self 
 
     def run(self, days: int):
+        self.I.reserve(len(self.I) + days)
         for _ in range(days):
-            self.I.append(self.phi * self.I[-1] + np.random.normal(scale = self.sigma))
+            self.I.append(self.phi * self.I[-1] + self.rng.normal(scale = self.sigma))
         return self 
 
 class MigrationSpikeModel(NetworkedSIR):
@@ -615,11 +968,11 @@ class MigrationSpikeModel(NetworkedSIR):
         self.introduction_time = introduction_time
         super().__init__(units, default_migrations, random_seed)
 
-    def tick(self, migrations: np.matrix):
+    def step(self, weights: Union[np.ndarray, int]):
         self.counter += 1
         # run migration step 
         outflux       = [unit.migration_step() for unit in self.units]
-        transmissions = [flux * migrations[i, :].sum() for (i, flux) in enumerate(outflux)]
+        transmissions = [flux * weight for (flux, weight) in zip(outflux, np.broadcast_to(weights, len(self.units)))]
         
         # now run forward epidemiological model, and add spike at intro time 
         if self.counter == self.introduction_time:
@@ -629,23 +982,98 @@ class MigrationSpikeModel(NetworkedSIR):
             for (unit, tmx) in zip(self.units, transmissions):
                 unit.forward_epi_step(tmx)
 
-def gravity_matrix(gdf_path: Path, population_path: Path) -> Tuple[Sequence[str], Sequence[float], np.matrix]:
+def gravity_weights(centroids: Sequence, populations: Sequence[float], k: Optional[int] = None, cutoff: Optional[float] = None) -> Union[np.ndarray, sparse.csc_matrix]:
+    """ 
+    column-normalized population-weighted inverse distance matrix; if k or cutoff is given, only each unit's 
+    k nearest neighbours and/or the units within cutoff are kept, and a sparse matrix is returned 
+    """
+    if k is None and cutoff is None:
+        P = distance_matrix(centroids, centroids)
+        P[P != 0] = P[P != 0] ** -1.0 
+        P *= np.array(populations)[:, None]
+        P /= P.sum(axis = 0)
+        return P
+
+    centroids = np.asarray(centroids, dtype = float)
+    tree = cKDTree(centroids)
+    if k is not None:
+        # query one extra neighbour since every unit is its own nearest neighbour
+        distances, neighbours = tree.query(centroids, k = min(k + 1, len(centroids)), distance_upper_bound = np.inf if cutoff is None else cutoff)
+        distances, neighbours = np.atleast_2d(distances.T).T, np.atleast_2d(neighbours.T).T
+        rows = np.repeat(np.arange(len(centroids)), distances.shape[1])
+        keep = np.isfinite(distances.ravel())
+        D = sparse.coo_matrix((distances.ravel()[keep], (rows[keep], neighbours.ravel()[keep])), shape = (len(centroids),) * 2)
+        # keep pairs where either unit is among the other's nearest neighbours, so the matrix stays symmetric
+        D = D.maximum(D.T)
+    else:
+        D = tree.sparse_distance_matrix(tree, cutoff, output_type = "coo_matrix")
+    P = sparse.coo_matrix(D)
+    P.eliminate_zeros()
+    P.data = P.data ** -1.0 * np.asarray(populations, dtype = float)[P.row]
+    return normalize_columns(P)
+
+def gravity_inputs(gdf_path: Path, population_path: Path) -> List[Path]:
+    """ files whose contents determine a gravity matrix, including a shapefile's sidecar (.dbf, .shx, etc.) files """
+    gdf_path = Path(gdf_path)
+    if gdf_path.is_dir():
+        sources = sorted(p for p in gdf_path.rglob("*") if p.is_file())
+    elif gdf_path.suffix.lower() == ".shp":
+        sources = sorted(gdf_path.parent.glob(gdf_path.stem + ".*"))
+    else:
+        sources = [gdf_path]
+    return sources + [Path(population_path)]
+
+def save_gravity_matrix(path: Path, districts: Sequence[str], populations: Sequence[float], P: Union[np.ndarray, sparse.csc_matrix]):
+    """ write a gravity matrix to a compressed .npz, replacing any existing file atomically via a uniquely named temporary file """
+    path = Path(path)
+    if sparse.issparse(P):
+        arrays = dict(data = P.data, indices = P.indices, indptr = P.indptr, shape = np.array(P.shape))
+    else:
+        arrays = dict(dense = P)
+    path.parent.mkdir(parents = True, exist_ok = True)
+    with tempfile.NamedTemporaryFile(dir = path.parent, prefix = f".{path.stem}.", suffix = ".npz", delete = False) as tmp:
+        try:
+            np.savez_compressed(tmp, districts = np.array(districts, dtype = str), populations = np.array(populations), **arrays)
+        except BaseException:
+            tmp.close()
+            Path(tmp.name).unlink()
+            raise
+    Path(tmp.name).replace(path)
+
+def load_gravity_matrix(path: Path) -> Tuple[Sequence[str], Sequence[float], Union[np.ndarray, sparse.csc_matrix]]:
+    """ read a gravity matrix written by save_gravity_matrix """
+    with np.load(path) as npz:
+        if "dense" in npz:
+            P = npz["dense"]
+        else:
+            P = sparse.csc_matrix((npz["data"], npz["indices"], npz["indptr"]), shape = tuple(npz["shape"]))
+        return (npz["districts"].tolist(), npz["populations"].tolist(), P)
+
+def gravity_matrix(gdf_path: Path, population_path: Path, k: Optional[int] = None, cutoff: Optional[float] = None, cache: Optional[Path] = None) -> Tuple[Sequence[str], Sequence[float], Union[np.matrix, sparse.csc_matrix]]:
+    """ 
+    build a gravity model of migration between the units in a shapefile (see gravity_weights); if a cache directory 
+    is given, the result is stored there as a compressed .npz keyed by the inputs' contents and the truncation parameters 
+    """
+    if cache is not None:
+        cached = Path(cache) / f"gravity_{file_digest(gravity_inputs(gdf_path, population_path), k, cutoff)}.npz"
+        if cached.exists():
+            return load_gravity_matrix(cached)
+
     gdf = gpd.read_file(gdf_path)
     districts = [d.upper() for d in gdf.district.values]
 
     pop_df = pd.read_csv(population_path)
 
     # population count is numeric in Maharashtra data and a string in other data - converting to numeric
-    if pop_df["Population(2011 census)"].dtype == object:
+    if not pd.api.types.is_numeric_dtype(pop_df["Population(2011 census)"]):
         pop_df["Population(2011 census)"] = pop_df["Population(2011 census)"].str.replace(",","").apply(float)
 
-    population_mapping = {k.replace("-", " ").upper(): v for (k, v) in zip(pop_df["Name"], pop_df["Population(2011 census)"])}
+    population_mapping = {name.replace("-", " ").upper(): population for (name, population) in zip(pop_df["Name"], pop_df["Population(2011 census)"])}
     populations = [population_mapping[district.upper()] for district in districts]
 
     centroids = [list(pt.coords)[0] for pt in gdf.centroid]
-    P = distance_matrix(centroids, centroids)
-    P[P != 0] = P[P != 0] ** -1.0 
-    P *= np.array(populations)[:, None]
-    P /= P.sum(axis = 0)
+    P = gravity_weights(centroids, populations, k, cutoff)
 
+    if cache is not None:
+        save_gravity_matrix(cached, districts, populations, P)
     return (districts, populations, P)
@@ -14,6 +14,7 @@ from matplotlib.patheffects import Normal, Stroke
 from matplotlib.pyplot import *
 
 from .models import NetworkedSIR
+from .trajectory import SummaryTrajectory
 
 
 def normalize_dates(dates):
@@ -354,7 +355,11 @@ def gantt_chart(gantt_data, start_date: Optional[str] = None, show_cbar = True):
     return PlotDevice()
 
 def predictions(date_range, model, color, bounds = [2.5, 97.5], curve = "dT"):
-    mdn, min_, max_ = zip(*[np.percentile(_, [50] + bounds) for _ in model.__getattribute__(curve)])
+    trajectory = model.__getattribute__(curve)
+    if isinstance(trajectory, SummaryTrajectory):
+        mdn, min_, max_ = trajectory.percentile(50, *bounds)
+    else:
+        mdn, min_, max_ = zip(*[np.percentile(_, [50] + bounds) for _ in trajectory])
     range_marker   = plt.fill_between(date_range, min_, max_, color = color, alpha = 0.3)
     median_marker, = plt.plot(date_range, mdn, color = color)
     return [(range_marker, median_marker), model.name]
@@ -1,12 +1,11 @@
 from abc import abstractmethod
-from itertools import product
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
-from scipy.stats import multinomial as Multinomial
+from scipy import sparse
 from sklearn.metrics import auc
 
-from .models import SIR, NetworkedSIR, Age_SIRVD
+from .models import SIR, NetworkedSIR, Age_SIRVD, VectorizedNetworkedSIR, align
 from .utils import weeks
 
 
@@ -21,6 +20,78 @@ def simulate_lockdown(model: NetworkedSIR, lockdown_period: int, total_time: int
         .set_parameters(Rt0 = Rt0_voluntary)\
         .run(total_time - lockdown_period, migrations = migrations)
 
+# Rt thresholds separating the green, yellow, orange and red lockdown stringency buckets
+RT_BUCKETS = (1, 1.5, 2)
+
+def categorize_Rt(Rt: np.ndarray) -> np.ndarray:
+    """ assign units to stringency buckets (0: green, 1: yellow, 2: orange, 3: red) based on Rt; NaNs are assigned to red """
+    return np.digitize(Rt, RT_BUCKETS)
+
+def gradual_release(categories: np.ndarray, last_categories: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """ limit relaxations to one bucket per evaluation period, returning the enforced categories and which units changed bucket """
+    if last_categories is None:
+        return (categories, np.zeros(categories.shape, dtype = bool))
+    changed = categories != last_categories
+    return (np.where(changed & (categories < last_categories - 1), last_categories - 1, categories), changed)
+
+def phase_migrations(migrations: Union[np.matrix, sparse.spmatrix], open_units: np.ndarray) -> Union[np.matrix, sparse.spmatrix]:
+    """ copy of the migration matrix with all flows into or out of closed units removed """
+    if sparse.issparse(migrations):
+        # mask rows and columns as diag(open) @ M @ diag(open), which keeps the matrix sparse
+        mask = sparse.diags(open_units.astype(float))
+        phased_migration = mask @ migrations @ mask
+        phased_migration.eliminate_zeros()
+        return phased_migration
+    phased_migration = migrations.copy()
+    phased_migration[~np.outer(open_units, open_units)] = 0
+    return phased_migration
+
+def phased_outflow_weights(migrations: Union[np.matrix, sparse.spmatrix], open_units: np.ndarray) -> np.ndarray:
+    """ per-lane row sums of the phased migration matrix for (units, sims) open_units, without materializing a matrix per lane """
+    open_units = open_units.astype(float)
+    return open_units * np.asarray(migrations @ open_units)
+
+def run_phased(model: NetworkedSIR, days: int, migrations: np.matrix, open_units: np.ndarray):
+    """ run the model with migration only between open units, decided per lane if open_units has a simulation axis """
+    if open_units.ndim > 1:
+        return model.run(days, weights = phased_outflow_weights(migrations, open_units))
+    return model.run(days, phase_migrations(migrations, open_units))
+
+def latest(model: NetworkedSIR, curve: str, idx: int = -1) -> np.ndarray:
+    """ (units,) or (units, sims) array of every unit's entry of a curve """
+    if isinstance(model, VectorizedNetworkedSIR):
+        return np.asarray(getattr(model, curve)[idx], dtype = float)
+    return np.array([getattr(unit, curve)[idx] for unit in model], dtype = float)
+
+def update_contact_rates(model: NetworkedSIR, enforced: np.ndarray, changed: np.ndarray, beta_v: np.ndarray, beta_m: np.ndarray):
+    """ interpolate contact rates between voluntary and mandatory levels for the units (or lanes) that changed bucket """
+    if isinstance(model, VectorizedNetworkedSIR):
+        enforced, changed, beta_v, beta_m, gamma, Rt0, beta = align(enforced, changed, beta_v, beta_m, model.gamma, model.Rt0, model.beta[-1])
+        new_beta = beta_v - (enforced * (beta_v - beta_m)/3.0)
+        model.beta[-1] = np.where(changed, new_beta, beta)
+        model.Rt0 = np.where(changed, new_beta * gamma, Rt0)
+        return
+    new_beta = beta_v - (enforced * (beta_v - beta_m)/3.0)
+    for i in np.flatnonzero(changed):
+        unit = model[int(i)]
+        unit.beta[-1] = new_beta[i]
+        unit.Rt0 = new_beta[i] * unit.gamma
+
+def adaptive_control_step(model: NetworkedSIR, days_run: int, categories: np.ndarray, last_categories: Optional[np.ndarray], beta_v: np.ndarray, beta_m: np.ndarray, gantt: List) -> np.ndarray:
+    """ enforce gradual release, record the gantt chart entries for this period and update contact rates for units that change bucket """
+    Rt = latest(model, "Rt")
+    enforced, changed = gradual_release(categories, last_categories)
+    Rt_ = np.where(Rt > 0, Rt, 0)
+    # scalar models record one bucket per unit; ensembles record a (sims,) array of buckets and Rts per unit
+    entries = (enforced.tolist(), Rt_.tolist()) if enforced.ndim == 1 else (enforced, Rt_)
+    gantt.extend([unit.name, days_run, beta_cat, R] for (unit, beta_cat, R) in zip(model, *entries))
+    update_contact_rates(model, enforced, changed, beta_v, beta_m)
+    return enforced
+
+def gantt_lane(gantt: List, lane: int) -> List:
+    """ extract a single simulation lane's gantt chart from an ensemble gantt chart """
+    return [[name, day, int(beta_cat[lane]), float(R[lane])] for (name, day, beta_cat, R) in gantt]
+
 def simulate_adaptive_control(
     model: NetworkedSIR, 
     initial_run: int, 
@@ -32,129 +103,49 @@ def simulate_adaptive_control(
     beta_m: Dict[str, float], 
     evaluation_period: int = 2*weeks, 
     adjacency: Optional[np.matrix] = None) -> NetworkedSIR:
-    """ simulate the Malani et al. adaptive lockdown policy where districts are assigned to lockdown stringency buckets based on Rt """
-    n = len(model)
+    """ simulate the Malani et al. adaptive lockdown policy where districts are assigned to lockdown stringency buckets based on Rt; on a VectorizedNetworkedSIR with simulation lanes, buckets, contact rates and migration are decided per lane and the gantt chart holds (sims,) arrays """
     model.set_parameters(Rt0 = R_m)\
          .run(initial_run, lockdown)
     days_run = initial_run
-    gantt = []
-    last_category = dict()
+    gantt: List = []
+    names  = [unit.name for unit in model]
+    beta_v_, beta_m_ = (np.array([beta[name] for name in names], dtype = float) for beta in (beta_v, beta_m))
+    last_categories = None
     while days_run < total_time:
-        Gs: Set[int] = set()
-        Ys: Set[int] = set()
-        Os: Set[int] = set()
-        Rs: Set[int] = set()
-        categories = dict(enumerate([Gs, Ys, Os, Rs]))
-        category_transitions = {}
-        for (i, unit) in enumerate(model):
-            latest_Rt = unit.Rt[-1]
-            if latest_Rt < 1: 
-                Gs.add(i)
-                beta_cat = 0
-            else: 
-                if days_run < initial_run + evaluation_period: # force first period to be lockdown
-                    Rs.add(i)
-                    beta_cat = 3
-                else: # categorize districts based on Rt 
-                    if latest_Rt < 1.5: 
-                        Ys.add(i)
-                        beta_cat = 1
-                    elif latest_Rt < 2: 
-                        Os.add(i)
-                        beta_cat = 2
-                    else:
-                        Rs.add(i)
-                        beta_cat = 3
-            if unit.name not in last_category:
-                last_category[unit.name] = beta_cat
-            else: 
-                old_beta_cat = last_category[unit.name]
-                if old_beta_cat != beta_cat:
-                    if beta_cat < old_beta_cat and beta_cat != (old_beta_cat - 1): # force gradual release
-                        beta_cat = old_beta_cat - 1
-                        if i in categories[old_beta_cat]: categories[old_beta_cat].remove(i)
-                        categories[beta_cat].add(i)
-                    category_transitions[unit.name] = beta_cat
-                    last_category[unit.name] = beta_cat 
-            gantt.append([unit.name, days_run, beta_cat, max(0, latest_Rt)])
-
-        for (unit_name, beta_cat) in category_transitions.items(): 
-            unit =  model[unit_name]
-            new_beta = beta_v[unit.name] - (beta_cat * (beta_v[unit.name] - beta_m[unit.name])/3.0)                
-            unit.beta[-1] = new_beta
-            unit.Rt0 = new_beta * unit.gamma
-
-        phased_migration = migrations.copy()
-        for (i, j) in product(range(n), range(n)):
-            if i not in Gs or j not in Gs:
-                phased_migration[i, j] = 0
-        model.run(evaluation_period, phased_migration)
+        Rt = latest(model, "Rt")
+        if days_run < initial_run + evaluation_period: # force first period to be lockdown
+            categories = np.where(Rt < 1, 0, 3)
+        else: # categorize districts based on Rt 
+            categories = categorize_Rt(Rt)
+        last_categories = adaptive_control_step(model, days_run, categories, last_categories, beta_v_, beta_m_, gantt)
+
+        # only units initially assessed as green stay open to migration
+        run_phased(model, evaluation_period, migrations, categories == 0)
         days_run += evaluation_period
 
     model.gantt = gantt # type: ignore
     return model 
 
 def simulate_adaptive_control_MHA(model: NetworkedSIR, initial_run: int, total_time: int, lockdown: np.matrix, migrations: np.matrix, R_m: Dict[str, float], beta_v: Dict[str, float], beta_m: Dict[str, float], evaluation_period = 2*weeks):
-    """ simulates the version of adaptive control suggested by the Indian Ministry of Home Affairs, where the trigger is based on infection count doubling time """
-    n = len(model)
+    """ simulates the version of adaptive control suggested by the Indian Ministry of Home Affairs, where the trigger is based on infection count doubling time; on a VectorizedNetworkedSIR with simulation lanes, buckets, contact rates and migration are decided per lane and the gantt chart holds (sims,) arrays """
     model.set_parameters(Rt0 = R_m)\
          .run(initial_run, lockdown)
     days_run = initial_run
-    gantt = []
-    last_category = dict()
+    gantt: List = []
+    names  = [unit.name for unit in model]
+    beta_v_, beta_m_ = (np.array([beta[name] for name in names], dtype = float) for beta in (beta_v, beta_m))
+    last_categories = None
     while days_run < total_time:
-        Gs: Set[int] = set()
-        Ys: Set[int] = set()
-        Os: Set[int] = set()
-        Rs: Set[int] = set()
-        categories = dict(enumerate([Gs, Ys, Os, Rs]))
-        category_transitions = {}
-        for (i, unit) in enumerate(model):
-            latest_Rt = unit.Rt[-1]
-            if days_run < initial_run + evaluation_period: # force first period to MHA
-                if unit.I[-4] != 0 and unit.I[-1]/unit.I[-4] > 2: # doubling time trigger 
-                    Rs.add(i)
-                    beta_cat = 3
-                else:
-                    Gs.add(i)
-                    beta_cat = 0
-            else: 
-                if latest_Rt < 1: 
-                    Gs.add(i)
-                    beta_cat = 0
-                elif latest_Rt < 1.5: 
-                    Ys.add(i)
-                    beta_cat = 1
-                elif latest_Rt < 2: 
-                    Os.add(i)
-                    beta_cat = 2
-                else:
-                    Rs.add(i)
-                    beta_cat = 3
-            if unit.name not in last_category:
-                last_category[unit.name] = beta_cat
-            else: 
-                old_beta_cat = last_category[unit.name]
-                if old_beta_cat != beta_cat:
-                    if beta_cat < old_beta_cat and beta_cat != (old_beta_cat - 1): # force gradual release
-                        beta_cat = old_beta_cat - 1
-                    if i in categories[old_beta_cat]: categories[old_beta_cat].remove(i)
-                    categories[beta_cat].add(i)
-                    category_transitions[unit.name] = beta_cat
-                    last_category[unit.name] = beta_cat 
-            gantt.append([unit.name, days_run, beta_cat, max(0, latest_Rt)])
-
-        for (unit_name, beta_cat) in category_transitions.items(): 
-            unit =  model[unit_name]
-            new_beta = beta_v[unit.name] - (beta_cat * (beta_v[unit.name] - beta_m[unit.name])/3.0)                
-            unit.beta[-1] = new_beta
-            unit.Rt0 = new_beta * unit.gamma
-
-        phased_migration = migrations.copy()
-        for (i, j) in product(range(n), range(n)):
-            if i not in Gs or j not in Gs:
-                phased_migration[i, j] = 0
-        model.run(evaluation_period, phased_migration)
+        if days_run < initial_run + evaluation_period: # force first period to MHA
+            I_latest, I_lagged = latest(model, "I", -1), latest(model, "I", -4)
+            with np.errstate(divide = "ignore", invalid = "ignore"):
+                doubled = (I_lagged != 0) & (I_latest/I_lagged > 2) # doubling time trigger 
+            categories = np.where(doubled, 3, 0)
+        else: 
+            categories = categorize_Rt(latest(model, "Rt"))
+        last_categories = adaptive_control_step(model, days_run, categories, last_categories, beta_v_, beta_m_, gantt)
+
+        run_phased(model, evaluation_period, migrations, categories == 0)
         days_run += evaluation_period
 
     model.gantt = gantt # type: ignore
@@ -230,7 +221,7 @@ class RandomVaccineAssignment(VaccinationPolicy):
         dV = (model.S[-1]/model.N[-1]) * self.daily_doses * self.effectiveness
         model.S[-1] -= dV
         model.parallel_forward_epi_step(0, num_sims = num_sims)
-        distributed_doses = Multinomial.rvs(self.daily_doses, self.age_ratios)
+        distributed_doses = model.rng.multinomial(self.daily_doses, self.age_ratios)
         effective_doses   = self.effectiveness * distributed_doses
         immunizing_doses  = (model.S[-1].mean()/model.N[-1].mean()) * effective_doses
         self.bin_populations -= immunizing_doses.astype(int)
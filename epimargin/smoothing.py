@@ -1,7 +1,10 @@
+from functools import wraps
 from typing import Optional, Sequence
 
 import numpy as np
-from scipy.signal import convolve, filtfilt, iirnotch
+import pandas as pd
+from scipy.signal import (convolve, fftconvolve, filtfilt, group_delay, iirnotch,
+                          lfilter, lfilter_zi)
 from statsmodels.nonparametric.smoothers_lowess import lowess as sm_lowess
 
 # supported kernels for convolution smoothing
@@ -13,51 +16,192 @@ kernels = {
     "uniform"  : np.ones
 }
 
-def notched_smoothing(window: int = 7):
-    """ Removes weekly and twice-weekly periodicity before convolving a time-reversed padded signal with a uniform moving average window"""
+# kernels longer than this (four weeks of daily data) are applied with FFTs rather than directly
+FFT_WINDOW = 28
+
+def batched(smooth):
+    """ 
+    lets a smoother written along axis 0 take a single series, a (time x series) array, or a wide DataFrame, which
+    comes back with its labels; a single series is smoothed as a one-column batch, so that smoothing many series at
+    once gives exactly the results of smoothing each on its own
+    """
+    @wraps(smooth)
+    def wrapper(data):
+        if isinstance(data, pd.DataFrame):
+            return pd.DataFrame(smooth(data.to_numpy(dtype = float)), index = data.index, columns = data.columns)
+        data = np.asarray(data, dtype = float)
+        if data.ndim == 1:
+            return smooth(data[:, None])[:, 0]
+        return smooth(data)
+    return wrapper
+
+def weighted_rows(weights: np.ndarray, block: np.ndarray) -> np.ndarray:
+    """ weights @ block for a (time x series) block, accumulated one row at a time so every column sees the same operations """
+    out = np.multiply.outer(weights[..., 0], block[0])
+    for j in range(1, block.shape[0]):
+        out += np.multiply.outer(weights[..., j], block[j])
+    return out
+
+def convolve_time(data: np.ndarray, kernel: np.ndarray, mode: str) -> np.ndarray:
+    """ 
+    convolve each column of a (time x series) array with a kernel, as scipy's convolve would with mode "same" or 
+    "valid"; short kernels are applied directly as a sum of shifted copies of the data, which is exact for runs of 
+    zeros and identical for every column however many there are; long ones use FFTs, with the round-off around 
+    zero cleared
+    """
+    (T, K) = (len(data), len(kernel))
+    if K > FFT_WINDOW:
+        out = fftconvolve(data, kernel[:, None], mode = mode, axes = 0)
+        out[np.abs(out) <= 1e-12 * np.abs(kernel).sum() * np.abs(data).max(axis = 0)] = 0
+        return out
+    # full convolution, or just its valid part: out[n] = sum_k kernel[k] * data[n - k]
+    padded = np.concatenate([np.zeros((K - 1,) + data.shape[1:]), data, np.zeros((K - 1,) + data.shape[1:])]) if mode == "same" else data
+    length = len(padded) - K + 1
+    out = kernel[-1] * padded[:length]
+    for k in range(K - 2, -1, -1):
+        out += kernel[k] * padded[K - 1 - k: K - 1 - k + length]
+    if mode == "same":
+        start = (K - 1) // 2
+        return out[start: start + T]
+    return out
+
+def weekly_notch():
+    """ IIR filter coefficients with notches at 1/week and 2/week, assuming a daily sampling rate """
     fs, f0, Q = 1, 1/7, 1
     b1, a1 = iirnotch(f0, Q, fs)
     b2, a2 = iirnotch(2*f0, 2*Q, fs)
     # Frequency response
     b = convolve(b1, b2)
     a = convolve(a1, a2)
+    return b, a
+
+def notched_smoothing(window: int = 7):
+    """ Removes weekly and twice-weekly periodicity before convolving a time-reversed padded signal with a uniform moving average window"""
+    b, a = weekly_notch()
     kernel = np.ones(window)/window
+    @batched
     def smooth(data: Sequence[float]):
-        notched = filtfilt(b, a, data)
-        return convolve(np.concatenate([notched, notched[:-window-1:-1]]), kernel, mode="same")[:-window]
+        notched = filtfilt(b, a, data, axis = 0)
+        return convolve_time(np.concatenate([notched, notched[:-window-1:-1]]), kernel, mode="same")[:-window]
     return smooth
 
 def notch_filter():
     """ implements a notch filter with notches at 1/week and 2/week; assuming input signal sampling rate is 1/week"""
-    fs, f0, Q = 1, 1/7, 1
-    b1, a1 = iirnotch(f0, Q, fs)
-    b2, a2 = iirnotch(2*f0, 2*Q, fs)
-    # Frequency response
-    b = convolve(b1, b2)
-    a = convolve(a1, a2)
+    b, a = weekly_notch()
+    @batched
     def filter_(data: Sequence[float]):
-        return filtfilt(b, a, data)
+        return filtfilt(b, a, data, axis = 0)
     return filter_
 
+class StreamingNotchedSmoother:
+    """
+    causal version of notched_smoothing for daily incremental pipelines: the notch filter and trailing moving average
+    are folded into one IIR filter whose state is carried between calls, so push() costs O(1) per new day and never 
+    revises values it has already returned
+
+    Being causal, the output trails notched_smoothing(window) by the filter's group delay at low frequencies, which is 
+    about (window - 1)/2 days for the moving average plus 1.7 days for the notches (4.7 days for a 7-day window); 
+    the exact figure is kept in the lag attribute. The filter starts as if the series had been constant at its first 
+    value, so a constant series is reproduced from the first day; otherwise the start-up transient takes the moving 
+    average's window plus the notches' decay to die out, and the warmup attribute holds the number of days after which
+    it is below 0.1% of its initial size (20 days for a 7-day window). From then on the output matches notched_smoothing 
+    shifted by lag, up to the curvature of the series over the lag.
+    """
+    def __init__(self, window: int = 7):
+        self.window = window
+        notch_b, self.a = weekly_notch()
+        self.b   = convolve(notch_b, np.ones(window)/window)
+        self.lag = float(group_delay((self.b, self.a), w = [0], fs = 1)[1][0])
+        self.warmup = window - 1 + int(np.ceil(np.log(1e-3)/np.log(np.abs(np.roots(self.a)).max())))
+        self.zi: Optional[np.ndarray] = None
+
+    def push(self, new_values) -> np.ndarray:
+        """ 
+        filter the next days of data (time along axis 0, optionally one column per series) and return their smoothed
+        values; once several series are being tracked, a 1-D input is read as a single day across all of them
+        """
+        new_values = np.asarray(new_values, dtype = float)
+        shape, values = new_values.shape, np.atleast_1d(new_values)
+        if self.zi is not None and values.ndim < self.zi.ndim:
+            values = values[None]
+        if self.zi is None:
+            zi = lfilter_zi(self.b, self.a)
+            self.zi = zi.reshape((-1,) + (1,) * (values.ndim - 1)) * values[0]
+        smoothed, self.zi = lfilter(self.b, self.a, values, axis = 0, zi = self.zi)
+        return smoothed.reshape(shape)
+
+    def state_dict(self) -> dict:
+        """ JSON-serializable snapshot of the smoother's window and filter state """
+        return {
+            "window": self.window,
+            "zi":     None if self.zi is None else self.zi.tolist()
+        }
+
+    @classmethod
+    def from_state(cls, state: dict):
+        """ restore a smoother from the output of state_dict() """
+        smoother = cls(state["window"])
+        smoother.zi = None if state["zi"] is None else np.array(state["zi"], dtype = float)
+        return smoother
+
 def convolution(key: str = "hamming", window: int = 7):
     """ entry point for all convolution operations """
     kernel = kernels[key](window)
+    @batched
     def smooth(data: Sequence[float]):
         # pad the data with time reversal windows of signal at ends since all kernels here are apodizing 
-        padded = np.r_[data[window-1:0:-1], data, data[-2:-window-1:-1]]
-        return np.convolve(kernel/kernel.sum(), padded, mode="valid")[:-window+1]
+        padded = np.concatenate([data[window-1:0:-1], data, data[-2:-window-1:-1]])
+        return convolve_time(padded, kernel/kernel.sum(), mode="valid")[:-window+1]
     return smooth
 
 def box_filter_local(window: int = 5, local_smoothing: Optional[int] = 3):
     """ implement a box filter smoother with additional LOWESS-like smoothing for data points at the end of the timeseries"""
+    @batched
     def smooth(data: Sequence[float]):
-        smoothed = np.convolve(data, np.ones(window)/window, mode='same')
+        smoothed = convolve_time(data, np.ones(window)/window, mode='same')
         if local_smoothing and len(data) > (local_smoothing + 1):
             for i in range(local_smoothing-1, 0, -1):
-                smoothed[-i] = np.mean(data[-i-local_smoothing+1: -i+1 if i > 1 else None])
+                smoothed[-i] = np.mean(data[-i-local_smoothing+1: -i+1 if i > 1 else None], axis = 0)
         return smoothed
     return smooth 
 
 def lowess(**kwargs):
     """ wrapper over statsmodels lowess implementation to return a callable """
     return lambda data: sm_lowess(data, list(range(len(data))), **kwargs)
+
+def local_linear_weights(window: int, position: int) -> np.ndarray:
+    """ 
+    projection vector of a tricube-weighted local linear fit at offset `position` within a window of equally spaced
+    points, following statsmodels' lowess (no robustness iterations); falls back to the point itself if fewer than two 
+    neighbours carry weight
+    """
+    offsets = np.arange(window, dtype = float)
+    radius  = max(position, window - 1 - position)
+    weights = (1 - (np.abs(offsets - position)/max(radius, 1)) ** 3) ** 3
+    if (weights > 1e-12).sum() < 2:
+        return (offsets == position).astype(float)
+    weights /= weights.sum()
+    center  = (weights * offsets).sum()
+    spread  = max((weights * (offsets - center) ** 2).sum(), 1e-12)
+    return weights * (1 + (position - center) * (offsets - center)/spread)
+
+def local_linear(window: int = 15):
+    """ 
+    fixed-window LOWESS for equally spaced daily data: fits at interior points share one kernel applied as a 
+    convolution, and the edges, where the window stops sliding, use precomputed one-sided kernels; matches 
+    sm_lowess(data, range(len(data)), frac = window/len(data), it = 0) to within 1e-12 of the data's scale, but 
+    returns only the fitted values
+    """
+    def kernels_for(k: int):
+        center = k // 2
+        rows = np.array([local_linear_weights(k, position) for position in range(k)])
+        return rows[:center], rows[center], rows[center+1:]
+    precomputed = kernels_for(max(window, 2))
+
+    @batched
+    def smooth(data: Sequence[float]):
+        n = len(data)
+        k = min(max(window, 2), n)
+        head, kernel, tail = precomputed if k == max(window, 2) else kernels_for(k)
+        return np.concatenate([weighted_rows(head, data[:k]), convolve_time(data, kernel[::-1], mode = "valid"), weighted_rows(tail, data[n-k:])])
+    return smooth
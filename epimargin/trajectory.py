@@ -0,0 +1,401 @@
+from itertools import groupby
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+""" array-backed storage for model state histories """
+
+# initial number of rows allocated when a trajectory is stepped open-ended
+MIN_CAPACITY = 16
+
+# multiplicative factor by which the row buffer grows when full
+GROWTH_FACTOR = 2
+
+# storage types for each kind of value under the "compact" dtype policy. Integer counts are exact up to the int32
+# range, and float32 states carry ~7 significant digits. The rounding perturbs Poisson rates, so individual lanes 
+# are not reproduced draw-for-draw: the documented tolerance is on per-day means across lanes, which differ from 
+# the float64 path only by sampling noise, within three standard errors of the difference (up to ~6% relative in 
+# the tail of an epidemic, for 2,000-10,000 lanes over 200 days)
+COMPACT_DTYPES = {"i": np.int32, "u": np.uint32, "f": np.float32, "c": np.complex64}
+
+def storage_dtype(dtype, policy: str = "default") -> np.dtype:
+    """ dtype in which values of the given dtype are stored under a dtype policy ("default" or "compact") """
+    dtype = np.dtype(dtype)
+    if policy == "default":
+        return dtype
+    if policy == "compact":
+        return np.dtype(COMPACT_DTYPES.get(dtype.kind, dtype))
+    raise ValueError(f"unknown dtype policy: {policy}")
+
+def broadcast_trailing(*shapes: tuple) -> tuple:
+    """ broadcast shapes aligned on their leading axes, i.e. treating missing trailing axes as singletons """
+    ndim = max(map(len, shapes))
+    return np.broadcast_shapes(*(shape + (1,) * (ndim - len(shape)) for shape in shapes))
+
+def pad_trailing(array: np.ndarray, ndim: int) -> np.ndarray:
+    """ append trailing singleton axes so that array has ndim dimensions """
+    return array.reshape(array.shape + (1,) * (ndim - array.ndim))
+
+class Trajectory(Sequence):
+    """
+    list-like history of model states, stored as one preallocated (days, ...) buffer
+
+    Rows may be scalars or arrays (e.g. one entry per unit or per simulation lane); if a later row has
+    more trailing axes than the rows stored so far, earlier rows are broadcast along them. Integer indexing
+    returns a copy of the row (matching the value semantics of the lists this replaces), while slices,
+    iteration and np.asarray(...) return views into the underlying buffer.
+    """
+    def __init__(self, values: Iterable = (), capacity: int = 0, policy: str = "default"):
+        self._data: Optional[np.ndarray] = None
+        self._len = 0
+        self._capacity = capacity
+        self.policy = policy
+        # resolved storage dtypes under the policy, and whether values of a dtype can be written into a buffer dtype
+        # as is; these are looked up on every append, so are cached rather than recomputed by numpy's casting rules
+        self._storage: dict = {}
+        self._castable: dict = {}
+        for value in values:
+            self.append(value)
+
+    @property
+    def values(self) -> np.ndarray:
+        """ view of all stored rows as a single (days, ...) array """
+        if self._data is None:
+            return np.empty(0)
+        return self._data[:self._len]
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity if self._data is None else len(self._data)
+
+    def reserve(self, rows: int):
+        """ ensure the buffer can hold at least this many rows without reallocating """
+        if self._data is None:
+            self._capacity = max(self._capacity, rows)
+        elif rows > len(self._data):
+            self._resize(rows)
+        return self
+
+    def _resize(self, rows: int, shape: Optional[tuple] = None, dtype: Optional[np.dtype] = None):
+        old   = self._data
+        shape = old.shape[1:] if shape is None else shape
+        dtype = old.dtype     if dtype is None else dtype
+        self._data = np.empty((rows,) + shape, dtype = dtype)
+        # broadcast existing rows along any new trailing dimensions
+        self._data[:self._len] = pad_trailing(old[:self._len], len(shape) + 1)
+
+    def _storage_dtype(self, dtype) -> np.dtype:
+        """ storage_dtype under this trajectory's policy, cached """
+        try:
+            return self._storage[dtype]
+        except KeyError:
+            return self._storage.setdefault(dtype, storage_dtype(dtype, self.policy))
+
+    def _fits(self, dtype) -> bool:
+        """ whether values of a dtype are written into the buffer without widening its dtype, cached """
+        key = (dtype, self._data.dtype)
+        try:
+            return self._castable[key]
+        except KeyError:
+            return self._castable.setdefault(key, bool(np.can_cast(dtype, self._data.dtype, "same_kind")))
+
+    def _fit(self, value: np.ndarray, axes: int = 0):
+        """ widen the buffer's row shape and dtype so that the value can be stored at a row (or sub-row) index of the given depth """
+        row_shape = self._data.shape[1:]
+        shape = row_shape[:axes] + broadcast_trailing(row_shape[axes:], value.shape)
+        dtype = self._data.dtype if self._fits(value.dtype) else self._storage_dtype(np.result_type(self._data.dtype, value.dtype))
+        if shape != row_shape or dtype != self._data.dtype:
+            self._resize(len(self._data), shape, dtype)
+
+    def allocate(self, shape: tuple = (), dtype = float) -> np.ndarray:
+        """ append an uninitialized row that can hold values of the given shape and dtype, and return a writable view of it """
+        dtype = self._storage_dtype(np.dtype(dtype))
+        data  = self._data
+        # fast path: the row shape and dtype already fit and there is room left in the buffer
+        if data is not None and self._len < len(data) and tuple(shape) == data.shape[1:] and self._fits(dtype):
+            self._len += 1
+            return data[self._len - 1, ...]
+        template = np.broadcast_to(np.empty((), dtype = dtype), shape)
+        if self._data is None:
+            self._data = np.empty((max(self._capacity, MIN_CAPACITY),) + template.shape, dtype = template.dtype)
+        else:
+            self._fit(template)
+            if self._len == len(self._data):
+                self._resize(max(GROWTH_FACTOR * len(self._data), MIN_CAPACITY))
+        self._len += 1
+        return self._data[self._len - 1, ...]
+
+    def append(self, value):
+        value = np.asarray(value)
+        data  = self._data
+        # fast path: write straight into the buffer when the value already has the row shape and a storable dtype
+        if data is not None and self._len < len(data) and value.shape == data.shape[1:] and self._fits(value.dtype):
+            data[self._len] = value
+            self._len += 1
+            return
+        row = self.allocate(value.shape, value.dtype)
+        row[...] = pad_trailing(value, row.ndim)
+
+    def extend(self, values: Iterable):
+        for value in values:
+            self.append(value)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, idx):
+        row = self.values[idx]
+        if isinstance(idx, (int, np.integer)) and isinstance(row, np.ndarray):
+            return row.copy()
+        return row
+
+    def __setitem__(self, idx, value):
+        value = np.asarray(value)
+        key = idx if isinstance(idx, tuple) else (idx,)
+        if all(isinstance(_, (int, np.integer)) for _ in key):
+            self._fit(value, len(key) - 1)
+            value = pad_trailing(value, self._data.ndim - len(key))
+        elif not self._fits(value.dtype):
+            self._resize(len(self._data), dtype = self._storage_dtype(np.result_type(self._data.dtype, value.dtype)))
+        self.values[idx] = value
+
+    def view(self, idx: int) -> np.ndarray:
+        """ writable view of a single row, without the copy made by integer indexing """
+        return self.values[idx, ...]
+
+    def set_policy(self, policy: str):
+        """ switch dtype policy, converting rows stored so far """
+        self.policy = policy
+        self._storage = {}
+        if self._data is not None:
+            self._resize(len(self._data), dtype = storage_dtype(self._data.dtype, policy))
+        return self
+
+    def __iter__(self) -> Iterator:
+        return iter(self.values)
+
+    def __array__(self, dtype = None, copy = None):
+        return self.values if dtype is None else self.values.astype(dtype)
+
+    def __repr__(self) -> str:
+        return f"Trajectory({self.values!r})"
+
+def reserve(model, days: int):
+    """ preallocate storage for the given number of additional days on every trajectory attached to a model """
+    for attr in vars(model).values():
+        if isinstance(attr, (Trajectory, SummaryTrajectory)):
+            attr.reserve(len(attr) + days)
+    return model
+
+def set_dtype_policy(model, policy: str, population = None):
+    """ store every trajectory attached to a model under a dtype policy, checking that counts up to the population fit """
+    storage_dtype(int, policy) # validate policy name
+    if population is not None and np.max(population) > np.iinfo(storage_dtype(int, policy)).max:
+        raise ValueError(f"population {np.max(population)} overflows {storage_dtype(int, policy)} under the {policy} dtype policy")
+    for attr in vars(model).values():
+        if isinstance(attr, (Trajectory, SummaryTrajectory)):
+            attr.set_policy(policy)
+    return model
+
+class QuantileTrajectory(Trajectory):
+    """
+    trajectory of distribution quantiles (e.g. confidence bounds on new cases) evaluated on demand
+
+    Steps record a distribution, quantile level and distribution parameters via defer(); the inverse CDFs 
+    for all outstanding steps are evaluated in one vectorized pass the first time the history is read.
+    """
+    def __init__(self, values: Iterable = (), capacity: int = 0, policy: str = "default"):
+        self._pending: List[Tuple] = []
+        super().__init__(values, capacity, policy)
+
+    def defer(self, dist, q, *params):
+        """ record the q-th quantile of dist(*params) as the next entry without evaluating it; arguments are held by reference """
+        self._pending.append((dist, q, params))
+
+    def _evaluate(self):
+        pending, self._pending = self._pending, []
+        for (dist, entries) in groupby(pending, key = lambda entry: entry[0]):
+            entries = [(q,) + params for (_, q, params) in entries]
+            shape   = broadcast_trailing(*(np.shape(arg) for entry in entries for arg in entry))
+            args    = [np.stack([np.broadcast_to(pad_trailing(np.asarray(arg), len(shape)), shape) for arg in column]) for column in zip(*entries)]
+            for row in dist.ppf(*args):
+                super().append(row)
+
+    @property
+    def values(self) -> np.ndarray:
+        if self._pending:
+            self._evaluate()
+        return super().values
+
+    def allocate(self, shape: tuple = (), dtype = float) -> np.ndarray:
+        if self._pending:
+            self._evaluate()
+        return super().allocate(shape, dtype)
+
+    def append(self, value):
+        if self._pending:
+            self._evaluate()
+        super().append(value)
+
+    def __len__(self) -> int:
+        return self._len + len(self._pending)
+
+# percentiles across simulation lanes recorded for each day in summary mode
+SUMMARY_PERCENTILES = (0, 2.5, 5, 25, 50, 75, 95, 97.5, 100)
+
+class SummaryTrajectory(Sequence):
+    """
+    history of model states that keeps per-day statistics across simulation lanes instead of the lanes themselves
+
+    Each day's row is reduced along the lane axis to its mean, standard deviation and a fixed set of (exact) 
+    percentiles once the next day is recorded, so memory grows with the number of days but not the number 
+    of lanes. The first row and the most recent rows are kept in full, since model steps read and update 
+    them; indexing any other day raises an IndexError.
+    """
+    def __init__(self, values: Iterable = (), capacity: int = 0, policy: str = "default", percentiles: Sequence[float] = SUMMARY_PERCENTILES, axis: int = 0, keep: int = 2):
+        self.policy = policy
+        self.percentiles = tuple(percentiles)
+        self.axis  = axis 
+        self.keep  = keep 
+        self.first: Optional[np.ndarray] = None
+        self.recent: List[np.ndarray] = [] # full rows for the last `keep` days
+        self._len  = 0
+        self._mean      = Trajectory(capacity = capacity, policy = policy)
+        self._std       = Trajectory(capacity = capacity, policy = policy)
+        self._quantiles = Trajectory(capacity = capacity, policy = policy)
+        for value in values:
+            self.append(value)
+
+    def reserve(self, rows: int):
+        for stat in (self._mean, self._std, self._quantiles):
+            stat.reserve(rows)
+        return self
+
+    def set_policy(self, policy: str):
+        """ switch dtype policy, converting the statistics and full rows stored so far """
+        self.policy = policy
+        for stat in (self._mean, self._std, self._quantiles):
+            stat.set_policy(policy)
+        rows = {id(row): row.astype(storage_dtype(row.dtype, policy)) for row in self.recent + [self.first] if row is not None}
+        self.recent = [rows[id(row)] for row in self.recent]
+        self.first  = None if self.first is None else rows[id(self.first)]
+        return self
+
+    def summarize(self, row: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ mean, standard deviation and percentiles of a row across lanes """
+        if row.ndim <= self.axis: # no lane axis (yet)
+            return (row, np.zeros(row.shape), np.broadcast_to(row, (len(self.percentiles),) + row.shape))
+        return (row.mean(axis = self.axis), row.std(axis = self.axis), np.percentile(row, self.percentiles, axis = self.axis))
+
+    def allocate(self, shape: tuple = (), dtype = float) -> np.ndarray:
+        """ start a new day with an uninitialized row of the given shape and dtype, and return a writable view of it """
+        if self.recent:
+            for (stat, value) in zip((self._mean, self._std, self._quantiles), self.summarize(self.recent[-1])):
+                stat.append(value)
+        # reuse the storage of the row leaving the window where possible
+        row = None
+        dtype = storage_dtype(dtype, self.policy)
+        if len(self.recent) == self.keep:
+            oldest = self.recent.pop(0)
+            if oldest is not self.first and oldest.shape == tuple(shape) and oldest.dtype == dtype:
+                row = oldest
+        if row is None:
+            row = np.empty(shape, dtype = dtype)
+        self.recent.append(row)
+        if self._len == 0:
+            self.first = row
+        self._len += 1
+        return row
+
+    def append(self, value):
+        value = np.asarray(value)
+        self.allocate(value.shape, value.dtype)[...] = value
+
+    def extend(self, values: Iterable):
+        for value in values:
+            self.append(value)
+
+    def defer(self, dist, q, *params):
+        """ summaries need each day's values when the next day is recorded, so quantiles are evaluated immediately """
+        self.append(dist.ppf(q, *params))
+
+    def _stat(self, k: int) -> np.ndarray:
+        """ stored per-day statistics followed by the statistic for the current (still mutable) day """
+        if not self.recent:
+            return np.empty(0)
+        stored, live = (self._mean, self._std, self._quantiles)[k], self.summarize(self.recent[-1])[k]
+        if not len(stored):
+            return np.array(live)[None]
+        shape = broadcast_trailing(stored.values.shape[1:], live.shape)
+        return np.concatenate([
+            np.broadcast_to(pad_trailing(stored.values, len(shape) + 1), (len(stored),) + shape),
+            np.broadcast_to(pad_trailing(live, len(shape)), shape)[None]
+        ])
+
+    @property
+    def mean(self) -> np.ndarray:
+        """ (days, ...) mean across lanes """
+        return self._stat(0)
+
+    @property
+    def std(self) -> np.ndarray:
+        """ (days, ...) standard deviation across lanes """
+        return self._stat(1)
+
+    def percentile(self, *q: float) -> np.ndarray:
+        """ (len(q), days, ...) recorded percentiles across lanes """
+        missing = [_ for _ in q if _ not in self.percentiles]
+        if missing:
+            raise ValueError(f"percentiles {missing} not recorded; available: {self.percentiles}")
+        quantiles = self._stat(2)
+        return np.stack([quantiles[:, self.percentiles.index(_)] for _ in q])
+
+    def _index(self, idx) -> Tuple[int, Optional[int]]:
+        if not isinstance(idx, (int, np.integer)):
+            raise TypeError("summary trajectories only support indexing single days")
+        day = idx + self._len if idx < 0 else idx
+        if not 0 <= day < self._len:
+            raise IndexError(idx)
+        offset = day - (self._len - len(self.recent))
+        if offset < 0 and day != 0:
+            raise IndexError(f"lanes for day {day} were summarized; use .mean, .std or .percentile()")
+        return (day, offset if offset >= 0 else None)
+
+    def view(self, idx: int) -> np.ndarray:
+        _, offset = self._index(idx)
+        return self.first if offset is None else self.recent[offset]
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, idx):
+        row = self.view(idx)
+        # scalar rows are returned as scalars, as Trajectory does, so that arithmetic on them broadcasts
+        return row[()] if row.ndim == 0 else row.copy()
+
+    def __setitem__(self, idx, value):
+        _, offset = self._index(idx)
+        row = self.view(idx)
+        value = np.asarray(value)
+        if np.can_cast(value.dtype, row.dtype, "same_kind") and np.broadcast_shapes(row.shape, value.shape) == row.shape:
+            row[...] = value
+            return
+        updated = np.array(np.broadcast_to(value, np.broadcast_shapes(row.shape, value.shape)), dtype = storage_dtype(np.result_type(row, value), self.policy))
+        if row is self.first:
+            self.first = updated
+        if offset is not None:
+            self.recent[offset] = updated
+
+    def __iter__(self) -> Iterator:
+        raise TypeError("lanes are not kept in summary mode; iterate over .mean, .std or .percentile() instead")
+
+    def __repr__(self) -> str:
+        return f"SummaryTrajectory(days = {self._len}, percentiles = {self.percentiles})"
+
+def recorder(mode: str = "full") -> Tuple[type, type]:
+    """ trajectory types for state curves and for deferred CI curves under a recording mode ("full" or "summary") """
+    if mode == "full":
+        return (Trajectory, QuantileTrajectory)
+    if mode == "summary":
+        return (SummaryTrajectory, SummaryTrajectory)
+    raise ValueError(f"unknown recording mode: {mode}")
@@ -1,11 +1,13 @@
 import argparse
+import hashlib
 import logging
 import sys
 from pathlib import Path
-from typing import Tuple
+from typing import Sequence, Tuple
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
 
 # code readability
 days     = 1
@@ -46,5 +48,30 @@ def setup(**kwargs) -> Tuple[Path, ...]:
 def fillna(array):
     return np.nan_to_num(array, nan = 0, posinf = 0, neginf = 0)
 
+def fillna_(array):
+    """ in-place version of fillna """
+    return np.nan_to_num(array, copy = False, nan = 0, posinf = 0, neginf = 0)
+
 def normalize(array, axis = 0):
     return fillna(array/array.sum(axis = axis)[:, None])
+
+def normalize_columns(matrix: sparse.spmatrix) -> sparse.csc_matrix:
+    """ divide each column of a sparse matrix by its sum without densifying; all-zero columns stay zero """
+    matrix = sparse.csc_matrix(matrix, dtype = float, copy = True)
+    matrix.sum_duplicates()
+    totals = np.asarray(matrix.sum(axis = 0)).reshape(-1)
+    matrix.data /= np.repeat(totals, np.diff(matrix.indptr))
+    matrix.data[~np.isfinite(matrix.data)] = 0
+    matrix.eliminate_zeros()
+    return matrix
+
+def file_digest(paths: Sequence[Path], *params) -> str:
+    """ sha256 hex digest of the contents of the given files (and any extra parameters), for keying on-disk caches """
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    digest.update(repr(params).encode())
+    return digest.hexdigest()
+
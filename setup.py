@@ -16,6 +16,7 @@ setup(
     install_requires = [
         "numpy",
         "pandas",
+        "pyarrow",
         "matplotlib",
         "arviz",
         "pymc3==3.11.2",
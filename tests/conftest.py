@@ -0,0 +1,83 @@
+import collections
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+class Site:
+    """ local stand-in for a static file host, with per-file validators and injectable failures """
+    def __init__(self):
+        self.files    = {}                        # name -> (body, etag, last modified)
+        self.failures = {}                        # name -> "status" (every request gets a 503), "drop" (every connection is closed 
+                                                  # without a response) or "truncate" (the first body is cut short)
+        self.hits     = collections.Counter()     # requests seen per name
+        self.headers  = collections.defaultdict(list)
+        self.clients  = set()                     # client (address, port) pairs, i.e. connections opened
+
+    def publish(self, name, body, etag = None, last_modified = None):
+        self.files[name] = (body, etag, last_modified)
+
+def handler(site):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def empty(self, status):
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_GET(self):
+            name = self.path.rsplit("/", 1)[-1]
+            site.hits[name] += 1
+            site.clients.add(self.client_address)
+            site.headers[name].append(dict(self.headers))
+            failure = site.failures.get(name)
+            if failure == "status":
+                return self.empty(503)
+            if failure == "drop":
+                self.close_connection = True
+                return
+            if name not in site.files:
+                return self.empty(404)
+            (body, etag, last_modified) = site.files[name]
+            if (etag and self.headers.get("If-None-Match") == etag) or (last_modified and self.headers.get("If-Modified-Since") == last_modified):
+                return self.empty(304)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            if etag:
+                self.send_header("ETag", etag)
+            if last_modified:
+                self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            if failure == "truncate" and site.hits[name] == 1:
+                self.wfile.write(body[:len(body)//2])
+                self.wfile.flush()
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            self.wfile.write(body)
+    return Handler
+
+@pytest.fixture
+def site():
+    stand_in = Site()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler(stand_in))
+    thread = threading.Thread(target = server.serve_forever, kwargs = {"poll_interval": 0.05}, daemon = True)
+    thread.start()
+    stand_in.base_url = f"http://127.0.0.1:{server.server_port}/"
+    yield stand_in
+    server.shutdown()
+    server.server_close()
+
+class ExpectedDraws:
+    """ stand-in generator whose Poisson draws are their (rounded down) means, so that engines drawing in different orders agree """
+    def poisson(self, lam, size = None):
+        return np.floor(np.broadcast_to(np.asarray(lam, dtype = float), np.shape(lam) if size is None else size)).astype(int)
+
+@pytest.fixture
+def expected_draws():
+    return ExpectedDraws()
@@ -0,0 +1,131 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+import requests
+
+from epimargin.etl import commons
+from epimargin.etl.commons import download_data, http_session, metadata_path, parquet_cached
+
+def write_csv(path, values):
+    path.parent.mkdir(parents = True, exist_ok = True)
+    pd.DataFrame({"value": values}).to_csv(path, index = False)
+    return path
+
+def counting(calls):
+    def read_values(path):
+        calls.append(path)
+        return pd.read_csv(path)
+    return read_values
+
+def test_parquet_cache_reuses_and_refreshes(tmp_path):
+    calls, path = [], write_csv(tmp_path/"data"/"values.csv", [1, 2])
+    parse = counting(calls)
+    assert parquet_cached(path, parse, tmp_path/"cache")["value"].tolist() == [1, 2]
+    assert parquet_cached(path, parse, tmp_path/"cache")["value"].tolist() == [1, 2]
+    assert len(calls) == 1
+    write_csv(path, [3])
+    assert parquet_cached(path, parse, tmp_path/"cache")["value"].tolist() == [3]
+    assert len(calls) == 2
+    assert len(list((tmp_path/"cache").glob("*.parquet"))) == 1
+
+def test_parquet_cache_keeps_same_named_sources_apart(tmp_path):
+    calls = []
+    parse = counting(calls)
+    a = write_csv(tmp_path/"a"/"values.csv", [1])
+    b = write_csv(tmp_path/"b"/"values.csv", [2])
+    for _ in range(2):
+        assert parquet_cached(a, parse, tmp_path/"cache")["value"].tolist() == [1]
+        assert parquet_cached(b, parse, tmp_path/"cache")["value"].tolist() == [2]
+    assert len(calls) == 2
+
+def test_parquet_cache_keeps_parsers_apart(tmp_path):
+    calls = []
+    path  = write_csv(tmp_path/"values.csv", [1, 2])
+    first = counting(calls)
+    def second(path):
+        calls.append(path)
+        return pd.read_csv(path) * 10
+    for _ in range(2):
+        assert parquet_cached(path, first,  tmp_path/"cache")["value"].tolist() == [1, 2]
+        assert parquet_cached(path, second, tmp_path/"cache")["value"].tolist() == [10, 20]
+    assert len(calls) == 2
+
+def temporary_files(directory):
+    return [path.name for path in directory.iterdir() if path.name.endswith(".part")]
+
+def test_download_skips_unchanged_file(site, tmp_path):
+    site.publish("report.csv", b"a,b\n1,2\n", etag = '"v1"')
+    assert download_data(tmp_path, "report.csv", site.base_url)
+    assert json.loads(metadata_path(tmp_path, "report.csv").read_text())["etag"] == '"v1"'
+    assert not download_data(tmp_path, "report.csv", site.base_url)
+    assert site.headers["report.csv"][-1]["If-None-Match"] == '"v1"'
+    assert (tmp_path/"report.csv").read_bytes() == b"a,b\n1,2\n"
+
+def test_download_refreshes_changed_file(site, tmp_path):
+    site.publish("report.csv", b"old", etag = '"v1"')
+    download_data(tmp_path, "report.csv", site.base_url)
+    site.publish("report.csv", b"new", etag = '"v2"')
+    assert download_data(tmp_path, "report.csv", site.base_url)
+    assert (tmp_path/"report.csv").read_bytes() == b"new"
+    assert json.loads(metadata_path(tmp_path, "report.csv").read_text())["etag"] == '"v2"'
+
+def test_download_uses_last_modified(site, tmp_path):
+    site.publish("report.csv", b"data", last_modified = "Wed, 01 Jan 2020 00:00:00 GMT")
+    assert download_data(tmp_path, "report.csv", site.base_url)
+    assert not download_data(tmp_path, "report.csv", site.base_url)
+    assert download_data(tmp_path, "report.csv", site.base_url, conditional = False)
+
+def test_download_resumes_after_interrupted_body(site, tmp_path):
+    body = bytes(range(256)) * 4096
+    site.publish("report.csv", body, etag = '"v1"')
+    site.failures["report.csv"] = "truncate"
+    assert download_data(tmp_path, "report.csv", site.base_url, backoff = 0.01)
+    assert (tmp_path/"report.csv").read_bytes() == body
+    assert site.hits["report.csv"] == 2
+    assert temporary_files(tmp_path) == []
+
+@pytest.mark.parametrize("failure", ["status", "drop"])
+def test_download_failure_leaves_file_intact(site, tmp_path, failure):
+    (tmp_path/"report.csv").write_bytes(b"previous")
+    site.publish("report.csv", b"current")
+    site.failures["report.csv"] = failure
+    with pytest.raises(requests.RequestException):
+        download_data(tmp_path, "report.csv", site.base_url, retries = 2, backoff = 0.01)
+    # one retry layer: the first attempt plus two retries
+    assert site.hits["report.csv"] == 3
+    assert (tmp_path/"report.csv").read_bytes() == b"previous"
+    assert not metadata_path(tmp_path, "report.csv").exists()
+    assert temporary_files(tmp_path) == []
+
+def test_concurrent_downloads_of_one_file(site, tmp_path):
+    body = bytes(range(256)) * 16384
+    site.publish("report.csv", body)
+    with ThreadPoolExecutor(max_workers = 4) as pool:
+        assert all(pool.map(lambda _: download_data(tmp_path, "report.csv", site.base_url), range(8)))
+    assert (tmp_path/"report.csv").read_bytes() == body
+    assert temporary_files(tmp_path) == []
+
+def test_download_data_closes_its_own_session(site, tmp_path, monkeypatch):
+    (opened, closed) = ([], [])
+    def tracked(*args, **kwargs):
+        session = http_session(*args, **kwargs)
+        session.close = lambda close = session.close: closed.append(close())
+        opened.append(session)
+        return session
+    monkeypatch.setattr(commons, "http_session", tracked)
+    site.publish("report.csv", b"a,b\n1,2\n")
+    assert download_data(tmp_path, "report.csv", site.base_url)
+    assert len(opened) == len(closed) == 1
+
+def test_download_data_reuses_a_shared_session(site, tmp_path):
+    for i in range(5):
+        site.publish(f"report{i}.csv", b"a,b\n1,2\n")
+    with http_session() as session:
+        for i in range(5):
+            assert download_data(tmp_path, f"report{i}.csv", site.base_url, session)
+    assert len(site.clients) == 1
+    for i in range(5):
+        download_data(tmp_path, f"report{i}.csv", site.base_url, conditional = False)
+    assert len(site.clients) == 6
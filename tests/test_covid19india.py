@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from epimargin.etl.covid19india import add_time_col, assume_missing_0, get_time_series
+
+def line_list(rows = 5000, seed = 0):
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(1, 20, size = rows).astype(float)
+    counts[rng.random(rows) < 0.05] *= -1
+    return pd.DataFrame({
+        "detected_state":     np.array(["Bihar", "Kerala", "Punjab"])[rng.integers(3, size = rows)],
+        "detected_district":  np.array(["North", "South", "East", "West"])[rng.integers(4, size = rows)],
+        "status_change_date": pd.Timestamp("2020-04-01") + pd.to_timedelta(rng.integers(60, size = rows), unit = "D"),
+        "current_status":     np.array(["Hospitalized", "Recovered", "Deceased"])[rng.integers(3, size = rows)],
+        "num_cases":          counts
+    })
+
+def reference_time_series(df, group_col = None, drop_negatives = True):
+    """ per-group lambda and apply implementation that get_time_series replaced """
+    group_cols = ((group_col if isinstance(group_col, list) else [group_col]) if group_col else []) + ["status_change_date", "current_status"]
+    if drop_negatives:
+        df = df[df["num_cases"] >= 0]
+    totals = df.groupby(group_cols, observed = True)["num_cases"].agg(lambda counts: np.sum(np.abs(counts)))
+    totals = totals.unstack().fillna(0)[['Deceased','Hospitalized','Recovered']]
+    totals["date"] = totals.index.get_level_values("status_change_date")
+    totals = totals.groupby(level = 0, group_keys = False).apply(add_time_col) if group_col else add_time_col(totals)
+    totals["delta"] = assume_missing_0(totals, "Hospitalized") - assume_missing_0(totals, "Recovered") - assume_missing_0(totals, "Deceased")
+    totals["logdelta"] = np.ma.log(totals["delta"].values).filled(0)
+    return totals
+
+@pytest.mark.parametrize("group_col", [None, "detected_state", ["detected_state", "detected_district"]])
+@pytest.mark.parametrize("drop_negatives", [True, False])
+@pytest.mark.parametrize("categorical", [False, True])
+def test_time_series_matches_reference(group_col, drop_negatives, categorical):
+    df = line_list()
+    if categorical:
+        df = df.astype({"detected_state": "category", "detected_district": "category"})
+    pd.testing.assert_frame_equal(get_time_series(df, group_col, drop_negatives), reference_time_series(df, group_col, drop_negatives))
@@ -0,0 +1,114 @@
+import pandas as pd
+
+from epimargin.etl import csse
+from epimargin.etl.commons import http_session
+
+def report_name(date):
+    return pd.Timestamp(date).strftime(csse.DATE_FMT) + ".csv"
+
+def report(confirmed):
+    return f"Province_State,Country_Region,Confirmed,Deaths,Recovered,Active\nKerala,India,{confirmed},1,2,3\n".encode()
+
+def publish_range(site, start, end):
+    for (i, date) in enumerate(pd.date_range(start, end)):
+        site.publish(report_name(date), report(i), etag = f'"{i}"')
+
+def test_fetch_range_downloads_and_reports(site, tmp_path):
+    publish_range(site, "2021-01-01", "2021-01-10")
+    summary = csse.fetch_range(tmp_path, "2021-01-01", "2021-01-10", workers = 4, base_url = site.base_url)
+    assert (summary["requested"], summary["downloaded"], summary["skipped"], summary["failed"]) == (10, 10, 0, [])
+    assert summary["bytes"] == sum(len(report(i)) for i in range(10))
+    assert summary["files_per_second"] > 0
+    assert all((tmp_path/report_name(date)).exists() for date in pd.date_range("2021-01-01", "2021-01-10"))
+
+def test_fetch_range_skips_present_files(site, tmp_path):
+    publish_range(site, "2021-01-01", "2021-01-05")
+    csse.fetch_range(tmp_path, "2021-01-01", "2021-01-03", base_url = site.base_url)
+    summary = csse.fetch_range(tmp_path, "2021-01-01", "2021-01-05", base_url = site.base_url)
+    assert (summary["downloaded"], summary["skipped"]) == (2, 3)
+    assert site.hits[report_name("2021-01-01")] == 1
+
+def test_fetch_range_overwrite_skips_unchanged_files(site, tmp_path):
+    publish_range(site, "2021-01-01", "2021-01-03")
+    csse.fetch_range(tmp_path, "2021-01-01", "2021-01-03", base_url = site.base_url)
+    site.publish(report_name("2021-01-02"), report(100), etag = '"revised"')
+    summary = csse.fetch_range(tmp_path, "2021-01-01", "2021-01-03", overwrite = True, base_url = site.base_url)
+    assert (summary["downloaded"], summary["skipped"]) == (1, 2)
+    assert (tmp_path/report_name("2021-01-02")).read_bytes() == report(100)
+
+def test_fetch_range_reports_failures(site, tmp_path):
+    publish_range(site, "2021-01-01", "2021-01-04")
+    site.failures[report_name("2021-01-02")] = "status"
+    del site.files[report_name("2021-01-04")]
+    summary = csse.fetch_range(tmp_path, "2021-01-01", "2021-01-04", session = http_session(retries = 1, backoff = 0.01), base_url = site.base_url)
+    assert (summary["downloaded"], summary["skipped"]) == (2, 0)
+    assert summary["failed"] == [pd.Timestamp("2021-01-02"), pd.Timestamp("2021-01-04")]
+    assert site.hits[report_name("2021-01-02")] == 2
+    assert not (tmp_path/report_name("2021-01-02")).exists()
+
+def write_reports(directory, start, end, offset = 0):
+    for (i, date) in enumerate(pd.date_range(start, end)):
+        (directory/report_name(date)).write_bytes(report(i + offset))
+
+def test_update_panel_appends_new_dates(tmp_path):
+    write_reports(tmp_path, "2021-01-01", "2021-01-03")
+    store = csse.update_panel(tmp_path, "2021-01-01", "2021-01-03", workers = 2)
+    write_reports(tmp_path, "2021-01-04", "2021-01-05", offset = 3)
+    csse.update_panel(tmp_path, "2021-01-01", "2021-01-05", workers = 2)
+    panel = csse.load_panel(store)
+    assert panel["Confirmed"].tolist() == [0, 1, 2, 3, 4]
+    assert csse.PANEL_VERSION not in panel.columns
+    assert len(list(store.glob("*.parquet"))) == 2
+
+def test_update_panel_reingests_revised_reports(tmp_path):
+    write_reports(tmp_path, "2021-01-01", "2021-01-03")
+    store = csse.update_panel(tmp_path, "2021-01-01", "2021-01-03")
+    (tmp_path/report_name("2021-01-02")).write_bytes(report(100))
+    csse.update_panel(tmp_path, "2021-01-01", "2021-01-03")
+    panel = csse.load_panel(store)
+    assert panel["Confirmed"].tolist() == [0, 100, 2]
+    assert list(csse.stored_dates(store).sort_values()) == list(pd.date_range("2021-01-01", "2021-01-03"))
+
+def test_update_panel_is_a_noop_without_changes(tmp_path):
+    write_reports(tmp_path, "2021-01-01", "2021-01-03")
+    store = csse.update_panel(tmp_path, "2021-01-01", "2021-01-03")
+    parts = sorted(store.glob("*.parquet"))
+    csse.update_panel(tmp_path, "2021-01-01", "2021-01-03")
+    assert sorted(store.glob("*.parquet")) == parts
+
+def test_update_panel_replaces_unversioned_parts(tmp_path):
+    write_reports(tmp_path, "2021-01-01", "2021-01-02")
+    store = tmp_path/"panel"
+    store.mkdir()
+    legacy = pd.concat([csse.parse_report(tmp_path/report_name(date), date) for date in pd.date_range("2021-01-01", "2021-01-02")])
+    legacy.to_parquet(store/"part-legacy.parquet", index = False)
+    csse.update_panel(tmp_path, "2021-01-01", "2021-01-02")
+    assert not (store/"part-legacy.parquet").exists()
+    assert csse.load_panel(store)["Confirmed"].tolist() == [0, 1]
+
+def provinces_report(count):
+    return ("Province_State,Country_Region,Confirmed,Deaths,Recovered,Active\n" + "".join(f"Province {i},India,{i},1,2,3\n" for i in range(count))).encode()
+
+def test_load_panel_reads_parts_with_different_label_counts(tmp_path):
+    (tmp_path/report_name("2021-01-01")).write_bytes(provinces_report(5))
+    store = csse.update_panel(tmp_path, "2021-01-01", "2021-01-01")
+    (tmp_path/report_name("2021-01-02")).write_bytes(provinces_report(400))
+    csse.update_panel(tmp_path, "2021-01-01", "2021-01-02")
+    panel = csse.load_panel(store, country = "India")
+    assert len(panel) == 405
+    assert panel.index.get_level_values("Province_State").dtype == "category"
+    assert len(csse.load_panel(store, province = "Province 223")) == 1
+
+def test_fetch_range_closes_its_own_session(site, tmp_path, monkeypatch):
+    (opened, closed) = ([], [])
+    def tracked(*args, **kwargs):
+        session = http_session(*args, **kwargs)
+        session.close = lambda close = session.close: closed.append(close())
+        opened.append(session)
+        return session
+    monkeypatch.setattr(csse, "http_session", tracked)
+    publish_range(site, "2021-01-01", "2021-01-04")
+    summary = csse.fetch_range(tmp_path, "2021-01-01", "2021-01-04", workers = 2, base_url = site.base_url)
+    assert summary["downloaded"] == 4
+    assert len(opened) == len(closed) == 1
+    assert len(site.clients) <= 2
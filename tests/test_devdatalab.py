@@ -0,0 +1,26 @@
+import numpy as np
+
+from epimargin.etl.devdatalab import load_migration_matrix, load_sparse_matrix
+
+def write_matrix(path, size = 50, density = 0.1, seed = 0):
+    rng = np.random.default_rng(seed)
+    matrix = rng.random((size, size)) * (rng.random((size, size)) < density)
+    matrix[:, 3] = 0 # a unit with no inflow
+    np.savetxt(path, matrix, delimiter = ",")
+    return matrix
+
+def test_sparse_matrix_matches_file(tmp_path):
+    matrix = write_matrix(tmp_path/"matrix.csv")
+    for chunksize in (1, 7, 64):
+        assert np.array_equal(load_sparse_matrix(tmp_path/"matrix.csv", chunksize).toarray(), matrix)
+
+def test_sparse_migration_matrix_matches_dense(tmp_path):
+    write_matrix(tmp_path/"matrix.csv")
+    populations = np.random.default_rng(1).uniform(1000, 100000, 50)
+    dense  = load_migration_matrix(tmp_path/"matrix.csv", populations)
+    sparse = load_migration_matrix(tmp_path/"matrix.csv", populations, as_sparse = True)
+    assert sparse.format == "csc"
+    # the unit with no inflow has a NaN column in the dense matrix and an empty (zero) column in the sparse one
+    assert np.isnan(dense[:, 3]).all() and not np.isnan(np.delete(dense, 3, axis = 1)).any()
+    assert sparse[:, 3].nnz == 0
+    assert np.allclose(np.delete(sparse.toarray(), 3, axis = 1), np.delete(dense, 3, axis = 1), rtol = 1e-12, atol = 0)
@@ -0,0 +1,218 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+from shapely.geometry import Point
+
+from epimargin import models
+from epimargin.models import SEIR, SIR, Age_SIRVD, NetworkedSIR, VectorizedNetworkedSIR, gravity_matrix, load_gravity_matrix, save_gravity_matrix
+from epimargin.trajectory import QuantileTrajectory
+
+def make_units(seeds):
+    return [SIR(f"unit{i}", 100000, I0 = 100, dT0 = 10, mobility = 0.01, random_seed = seed) for (i, seed) in enumerate(seeds)]
+
+def curves(model):
+    return [np.asarray(unit.dT) for unit in model.units]
+
+def test_sir_reproducible():
+    a, b = (SIR("unit", 100000, I0 = 100, dT0 = 10, random_seed = 7).run(50) for _ in range(2))
+    assert np.array_equal(np.asarray(a.dT), np.asarray(b.dT))
+    assert np.array_equal(np.asarray(a.I), np.asarray(b.I))
+
+def test_sir_seeds_differ():
+    a, b = (SIR("unit", 100000, I0 = 100, dT0 = 10, random_seed = seed).run(50) for seed in (1, 2))
+    assert not np.array_equal(np.asarray(a.dT), np.asarray(b.dT))
+
+def test_parallel_step_reproducible():
+    def run():
+        sims = 1000
+        model = SIR("unit", 1e6, I0 = np.full(sims, 1000), dT0 = np.full(sims, 100), Rt0 = np.full(sims, 1.5), S0 = np.full(sims, 1e6 - 1000), random_seed = 3)
+        for _ in range(10):
+            model.parallel_forward_epi_step(num_sims = sims)
+        return model
+    assert np.array_equal(np.asarray(run().dT), np.asarray(run().dT))
+
+def test_network_reproducible():
+    migrations = np.full((3, 3), 0.5) - 0.5 * np.eye(3)
+    a, b = (NetworkedSIR(make_units([0, 0, 0]), migrations, random_seed = 11).run(30) for _ in range(2))
+    for (x, y) in zip(curves(a), curves(b)):
+        assert np.array_equal(x, y)
+
+def test_network_seed_zero_is_explicit():
+    # a zero seed still respawns unit streams, so identically seeded units diverge
+    model = NetworkedSIR(make_units([0, 0]), random_seed = 0).run(30)
+    (x, y) = curves(model)
+    assert not np.array_equal(x, y)
+
+def test_unseeded_units_diverge():
+    units = [SIR(f"unit{i}", 100000, I0 = 100, dT0 = 10, mobility = 0.01) for i in range(3)]
+    (x, y, z) = curves(NetworkedSIR(units).run(30))
+    assert not (np.array_equal(x, y) or np.array_equal(y, z) or np.array_equal(x, z))
+
+def test_unit_seeds_kept_without_network_seed():
+    units = make_units([5, 6])
+    expected = [np.random.default_rng(seed).integers(2**32) for seed in (5, 6)]
+    NetworkedSIR(units)
+    assert [unit.rng.integers(2**32) for unit in units] == expected
+
+def test_age_sirvd_inplace_matches_copying_step():
+    sims, bins = 50, 7
+    N = np.random.default_rng(0).integers(10000, 100000, bins).astype(float)
+    def run(inplace):
+        model = Age_SIRVD("unit", N.sum(), dT0 = np.full(sims, 100.0), Rt0 = 1.3, S0 = np.tile(N * 0.9, (sims, 1)), I0 = np.tile(N * 0.05, (sims, 1)),
+            R0 = np.tile(N * 0.05, (sims, 1)), D0 = np.zeros((sims, bins)), num_age_bins = bins, random_seed = 1, inplace = inplace)
+        doses = np.random.default_rng(2)
+        for t in range(30):
+            dV = np.tile(doses.random(bins) * 100, (sims, 1)) if t % 3 else 0
+            model.parallel_forward_epi_step(dV, num_sims = sims)
+        return model
+    (copying, inplace) = (run(False), run(True))
+    for curve in ["S", "S_vm", "S_vn", "I", "I_vn", "R", "R_vm", "R_vn", "D", "D_vn", "N_v", "N_nv", "pi", "q1", "q0", "dT", "dT_total", "dD_total", "Rt", "b", "upper_CI", "lower_CI", "total_cases"]:
+        assert len(getattr(copying, curve)) == len(getattr(inplace, curve)) == 31, curve
+        for (a, b) in zip(getattr(copying, curve), getattr(inplace, curve)):
+            assert np.array_equal(np.asarray(a), np.asarray(b), equal_nan = True), curve
+
+def lanes(recording, sims = 200, days = 10):
+    # default scalar R0 and D0, broadcast against the lanes on the first step
+    model = SIR("unit", 1e6, I0 = np.full(sims, 1000), dT0 = np.full(sims, 100), Rt0 = np.full(sims, 1.5), S0 = np.full(sims, 1e6 - 1000), recording = recording, random_seed = 1)
+    for _ in range(days):
+        model.parallel_forward_epi_step(num_sims = sims)
+    return model
+
+def test_summary_parallel_step_matches_full():
+    (full, summary) = (lanes("full"), lanes("summary"))
+    for curve in ["S", "I", "R", "D", "dT", "Rt", "upper_CI", "lower_CI"]:
+        values = np.asarray(getattr(full, curve), dtype = float)
+        assert np.allclose(getattr(summary, curve).mean, values.mean(axis = 1)), curve
+        assert np.allclose(getattr(summary, curve).percentile(50)[0], np.percentile(values, 50, axis = 1)), curve
+        assert np.array_equal(getattr(summary, curve)[-1], getattr(full, curve)[-1]), curve
+
+def test_summary_run_matches_full():
+    (full, summary) = (SIR("unit", 1e6, I0 = 1000, dT0 = 100, recording = recording, random_seed = 1).run(20) for recording in ("full", "summary"))
+    for curve in ["S", "I", "R", "D", "dT"]:
+        assert np.array_equal(getattr(summary, curve).mean, np.asarray(getattr(full, curve))), curve
+    assert np.ndim(summary.I[-1]) == 0
+
+def test_summary_network_matches_full():
+    migrations = np.full((3, 3), 0.5) - 0.5 * np.eye(3)
+    def run(recording):
+        units = [SIR(f"unit{i}", 1e6, I0 = 1000, dT0 = 100, mobility = 0.01, recording = recording) for i in range(3)]
+        return NetworkedSIR(units, migrations, random_seed = 4).run(20)
+    (full, summary) = (run("full"), run("summary"))
+    for (a, b) in zip(full.units, summary.units):
+        assert np.array_equal(b.dT.mean, np.asarray(a.dT))
+        assert np.array_equal(b.I.mean, np.asarray(a.I))
+
+def write_gravity_inputs(directory, populations = (1000, 2000, 3000, 4000)):
+    districts = ["alpha", "beta", "gamma", "delta"]
+    gpd.GeoDataFrame({"district": districts}, geometry = [Point(0, 0), Point(1, 0), Point(0, 2), Point(3, 3)], crs = "EPSG:3857").to_file(directory/"districts.geojson")
+    pd.DataFrame({"Name": [d.upper() for d in districts], "Population(2011 census)": populations}).to_csv(directory/"populations.csv", index = False)
+    return (directory/"districts.geojson", directory/"populations.csv")
+
+def dense(P):
+    return P.toarray() if sparse.issparse(P) else np.asarray(P)
+
+def test_gravity_matrix_cache(tmp_path, monkeypatch):
+    (gdf_path, population_path) = write_gravity_inputs(tmp_path)
+    cache = tmp_path/"cache"
+    for k in (None, 1):
+        (districts, populations, P) = gravity_matrix(gdf_path, population_path, k = k, cache = cache)
+        with monkeypatch.context() as patched:
+            patched.setattr(models.gpd, "read_file", lambda *args, **kwargs: pytest.fail("cache missed"))
+            (hit_districts, hit_populations, hit_P) = gravity_matrix(gdf_path, population_path, k = k, cache = cache)
+        assert (hit_districts, hit_populations) == (districts, populations)
+        assert sparse.issparse(hit_P) == sparse.issparse(P)
+        assert np.array_equal(dense(hit_P), dense(P))
+    assert len(list(cache.glob("gravity_*.npz"))) == 2
+
+    # new input contents change the digest, so the cached matrix is not reused
+    write_gravity_inputs(tmp_path, populations = (1000, 2000, 3000, 5000))
+    (_, populations, _) = gravity_matrix(gdf_path, population_path, cache = cache)
+    assert populations[-1] == 5000
+    assert len(list(cache.glob("gravity_*.npz"))) == 3
+    assert not list(cache.glob(".*"))
+
+def test_concurrent_gravity_matrix_saves(tmp_path):
+    path = tmp_path/"gravity.npz"
+    # large enough that the writes overlap, which corrupted or lost the temporary file when its name was fixed
+    matrices = [np.random.default_rng(i).random((300, 300)) for i in range(8)]
+    with ThreadPoolExecutor(max_workers = 8) as pool:
+        list(pool.map(lambda P: save_gravity_matrix(path, list(range(300)), list(range(300)), P), matrices * 4))
+    (_, _, P) = load_gravity_matrix(path)
+    assert any(np.array_equal(P, M) for M in matrices)
+    assert [p.name for p in tmp_path.iterdir()] == ["gravity.npz"]
+
+def network_units(count = 5):
+    return [SIR(f"unit{i}", 100000 * (i + 1), I0 = 100 * (i + 1), dT0 = 10 * (i + 1), Rt0 = 1.2 + 0.2 * i, mobility = 0.01) for i in range(count)]
+
+def gravity(count = 5):
+    migrations = np.random.default_rng(0).random((count, count))
+    np.fill_diagonal(migrations, 0)
+    return migrations/migrations.sum(axis = 1, keepdims = True) * 0.5
+
+def test_vectorized_network_matches_networked_sir(expected_draws):
+    (looped, vectorized) = (NetworkedSIR(network_units(), gravity()), VectorizedNetworkedSIR(network_units(), gravity()))
+    for unit in looped:
+        unit.rng = expected_draws
+    vectorized.rng = expected_draws
+    looped.run(40)
+    vectorized.run(40)
+    for curve in ["S", "I", "R", "D", "dT", "Rt", "b", "N", "total_cases", "upper_CI", "lower_CI"]:
+        for (unit, view) in zip(looped, vectorized):
+            assert np.allclose(np.asarray(getattr(unit, curve), dtype = float), np.asarray(getattr(view, curve), dtype = float), rtol = 1e-12), curve
+
+def test_seeded_vectorized_network():
+    def vectorized(seed):
+        return VectorizedNetworkedSIR(network_units(), gravity(), random_seed = seed, num_sims = 2000).run(20)
+    assert np.array_equal(np.asarray(vectorized(3).I), np.asarray(vectorized(3).I))
+    # lanes of the vectorized engine follow the same distribution as independent seeded NetworkedSIR runs
+    runs = np.array([[np.asarray(unit.I, dtype = float) for unit in NetworkedSIR(network_units(), gravity(), random_seed = seed).run(20)] for seed in range(150)])
+    lanes = np.asarray(vectorized(3).I, dtype = float)
+    (looped_mean, looped_se) = (runs.mean(axis = 0).T, runs.std(axis = 0).T/np.sqrt(len(runs)))
+    (lane_mean, lane_se) = (lanes.mean(axis = 2), lanes.std(axis = 2)/np.sqrt(lanes.shape[2]))
+    assert np.all(np.abs(looped_mean - lane_mean) <= 4 * np.sqrt(looped_se ** 2 + lane_se ** 2) + 1e-9)
+
+def ci_models():
+    sims, bins = 200, 4
+    N = np.array([20000.0, 30000.0, 40000.0, 10000.0])
+    def parallel(step):
+        model = SIR("unit", 10**6, I0 = np.full(sims, 1000), dT0 = np.full(sims, 100), Rt0 = np.full(sims, 1.5), S0 = np.full(sims, 10**6 - 1000), random_seed = 5)
+        for _ in range(15):
+            getattr(model, step)(num_sims = sims)
+        return model
+    def age(inplace):
+        model = Age_SIRVD("unit", N.sum(), dT0 = np.full(sims, 100.0), Rt0 = 1.3, S0 = np.tile(N * 0.9, (sims, 1)), I0 = np.tile(N * 0.05, (sims, 1)),
+            R0 = np.tile(N * 0.05, (sims, 1)), D0 = np.zeros((sims, bins)), num_age_bins = bins, random_seed = 5, inplace = inplace)
+        for _ in range(15):
+            model.parallel_forward_epi_step(np.full((sims, bins), 10.0), num_sims = sims)
+        return model
+    def seir():
+        model = SEIR("unit", 1e6, dT0 = 100, E0 = 500, I0 = 1000, random_seed = 5)
+        for _ in range(15):
+            model.forward_epi_step()
+        return model
+    return {
+        "SIR"       : lambda: SIR("unit", 1e6, I0 = 1000, dT0 = 100, random_seed = 5).run(15),
+        "parallel"  : lambda: parallel("parallel_forward_epi_step"),
+        "binomial"  : lambda: parallel("parallel_forward_binom_step"),
+        "SEIR"      : seir,
+        "Age_SIRVD" : lambda: age(False),
+        "in-place"  : lambda: age(True),
+        "network"   : lambda: VectorizedNetworkedSIR(network_units(), gravity(), random_seed = 5, num_sims = 50).run(15),
+    }
+
+@pytest.mark.parametrize("name", list(ci_models()))
+def test_deferred_cis_match_eager_evaluation(name, monkeypatch):
+    deferred = ci_models()[name]()
+    assert deferred.upper_CI._pending
+    (upper, lower) = (np.asarray(deferred.upper_CI), np.asarray(deferred.lower_CI))
+    assert not deferred.upper_CI._pending
+    # evaluating each step's quantiles as it is recorded, as before they were deferred, gives the same bounds
+    monkeypatch.setattr(QuantileTrajectory, "defer", lambda self, dist, q, *params: self.append(dist.ppf(q, *params)))
+    eager = ci_models()[name]()
+    assert np.array_equal(upper, np.asarray(eager.upper_CI), equal_nan = True)
+    assert np.array_equal(lower, np.asarray(eager.lower_CI), equal_nan = True)
+    assert np.nanmax(upper) > 0
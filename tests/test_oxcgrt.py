@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+from epimargin.etl.oxcgrt import load_stringency, stringency
+
+def write_tracker(path):
+    dates = pd.date_range("2021-01-01", periods = 5)
+    units = [("United States", "USA", None, None, "NAT_TOTAL"), ("United States", "USA", "California", "US_CA", "STATE_TOTAL"), ("India", "IND", None, None, "NAT_TOTAL")]
+    rows  = []
+    for (k, (country, code, region, region_code, jurisdiction)) in enumerate(units):
+        for (t, date) in enumerate(dates):
+            rows.append({
+                "CountryName": country, "CountryCode": code, "RegionName": region, "RegionCode": region_code, "Jurisdiction": jurisdiction,
+                "Date": date.strftime("%Y%m%d"), "C1_School closing": t % 4, "C1_Flag": 1 if t else None,
+                "V2B_Vaccine age eligibility/availability age floor (general population summary)": "16-19 yrs" if t > 2 else None,
+                "M1_Wildcard": None, "StringencyIndex": 10.0 * k + t
+            })
+    pd.DataFrame(rows).to_csv(path, index = False)
+
+def test_load_stringency_dtypes(tmp_path):
+    write_tracker(tmp_path/"OxCGRT_latest.csv")
+    df = load_stringency(tmp_path/"OxCGRT_latest.csv")
+    assert df.index.names == ["region", "Date"]
+    assert df.index.is_monotonic_increasing
+    assert df["StringencyIndex"].dtype == np.float64
+    assert df["C1_School closing"].dtype == np.float64
+    assert df["C1_Flag"].dtype == np.float64
+    assert df["CountryCode"].dtype == "category"
+    assert df["M1_Wildcard"].dtype != "category"
+    age_floor = df["V2B_Vaccine age eligibility/availability age floor (general population summary)"]
+    assert age_floor.dtype == "category"
+    assert age_floor.dropna().unique().tolist() == ["16-19 yrs"]
+
+def test_load_stringency_cache(tmp_path):
+    write_tracker(tmp_path/"OxCGRT_latest.csv")
+    parsed = load_stringency(tmp_path/"OxCGRT_latest.csv")
+    load_stringency(tmp_path/"OxCGRT_latest.csv", cache = tmp_path/"cache")
+    cached = load_stringency(tmp_path/"OxCGRT_latest.csv", cache = tmp_path/"cache")
+    pd.testing.assert_frame_equal(parsed, cached)
+
+def test_stringency_lookup(tmp_path):
+    write_tracker(tmp_path/"OxCGRT_latest.csv")
+    df = load_stringency(tmp_path/"OxCGRT_latest.csv")
+    values = stringency(df, ["US_CA", "IND", "GBR"], "2021-01-02", "2021-01-04")
+    assert list(values.columns) == ["US_CA", "IND", "GBR"]
+    assert list(values.index) == list(pd.date_range("2021-01-02", "2021-01-04"))
+    assert values["US_CA"].tolist() == [11.0, 12.0, 13.0]
+    assert values["IND"].tolist()   == [21.0, 22.0, 23.0]
+    assert values["GBR"].isna().all()
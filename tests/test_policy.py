@@ -0,0 +1,133 @@
+from itertools import product
+
+import numpy as np
+import pytest
+from scipy.spatial import distance_matrix
+
+from epimargin.models import SIR, NetworkedSIR, VectorizedNetworkedSIR
+from epimargin.policy import categorize_Rt, gantt_lane, gradual_release, simulate_adaptive_control, simulate_adaptive_control_MHA
+
+# reference implementations of the adaptive control policies as they were before bucket assignment was vectorized,
+# with per-unit threshold chains, sets of units per bucket and an elementwise migration mask
+
+def categorize_reference(Rt):
+    if Rt < 1:
+        return 0
+    if Rt < 1.5:
+        return 1
+    if Rt < 2:
+        return 2
+    return 3
+
+def adaptive_control_reference(model, initial_run, total_time, lockdown, migrations, R_m, beta_v, beta_m, evaluation_period = 14, mha = False):
+    n = len(model)
+    model.set_parameters(Rt0 = R_m).run(initial_run, lockdown)
+    days_run = initial_run
+    gantt = []
+    last_category = dict()
+    while days_run < total_time:
+        categories = dict(enumerate([set(), set(), set(), set()]))
+        category_transitions = {}
+        for (i, unit) in enumerate(model):
+            latest_Rt = unit.Rt[-1]
+            if days_run < initial_run + evaluation_period:
+                if mha:
+                    beta_cat = 3 if unit.I[-4] != 0 and unit.I[-1]/unit.I[-4] > 2 else 0
+                else:
+                    beta_cat = 0 if latest_Rt < 1 else 3
+            else:
+                beta_cat = categorize_reference(latest_Rt)
+            categories[beta_cat].add(i)
+            if unit.name not in last_category:
+                last_category[unit.name] = beta_cat
+            else:
+                old_beta_cat = last_category[unit.name]
+                if old_beta_cat != beta_cat:
+                    if beta_cat < old_beta_cat and beta_cat != (old_beta_cat - 1):
+                        beta_cat = old_beta_cat - 1
+                        categories[beta_cat].add(i)
+                    category_transitions[unit.name] = beta_cat
+                    last_category[unit.name] = beta_cat
+            gantt.append([unit.name, days_run, beta_cat, max(0, latest_Rt)])
+
+        for (unit_name, beta_cat) in category_transitions.items():
+            unit = model[unit_name]
+            new_beta = beta_v[unit.name] - (beta_cat * (beta_v[unit.name] - beta_m[unit.name])/3.0)
+            unit.beta[-1] = new_beta
+            unit.Rt0 = new_beta * unit.gamma
+
+        phased_migration = migrations.copy()
+        for (i, j) in product(range(n), range(n)):
+            if i not in categories[0] or j not in categories[0]:
+                phased_migration[i, j] = 0
+        model.run(evaluation_period, phased_migration)
+        days_run += evaluation_period
+    model.gantt = gantt
+    return model
+
+def network_fixture(units = 12):
+    rng = np.random.default_rng(1)
+    names = [f"unit{i}" for i in range(units)]
+    populations = rng.integers(1000, 100000, units)
+    centroids = rng.random((units, 2))
+    P = distance_matrix(centroids, centroids)
+    P[P != 0] = P[P != 0] ** -1
+    P *= populations[:, None]
+    P /= P.sum(axis = 0)
+    Rt0 = 1.5 + rng.random(units)
+    R_m, beta_v, beta_m = ({name: value for (name, value) in zip(names, values)} for values in (0.8 + rng.random(units), 0.4 + 0.1 * rng.random(units), 0.1 * rng.random(units)))
+    def model(I0 = 20, engine = NetworkedSIR):
+        units = [SIR(name, population, Rt0 = R, I0 = I0, dT0 = np.asarray(I0)//4, mobility = 0.01) for (name, population, R) in zip(names, populations, Rt0)]
+        return engine(units, P, random_seed = 1)
+    return (model, np.zeros((units, units)), P, R_m, beta_v, beta_m)
+
+@pytest.mark.parametrize("mha", [False, True])
+def test_adaptive_control_matches_reference(mha):
+    (model, lockdown, migrations, R_m, beta_v, beta_m) = network_fixture()
+    policy = simulate_adaptive_control_MHA if mha else simulate_adaptive_control
+    vectorized = policy(model(), 10, 120, lockdown, migrations, R_m, beta_v, beta_m)
+    reference  = adaptive_control_reference(model(), 10, 120, lockdown, migrations, R_m, beta_v, beta_m, mha = mha)
+    assert len(vectorized.gantt) == len(reference.gantt) == 12 * 8
+    for (entry, expected) in zip(vectorized.gantt, reference.gantt):
+        assert entry[:3] == expected[:3]
+        assert entry[3] == pytest.approx(expected[3], nan_ok = True)
+    assert len({entry[2] for entry in reference.gantt}) > 1
+    for (unit, expected) in zip(vectorized, reference):
+        assert np.array_equal(np.asarray(unit.I), np.asarray(expected.I))
+        assert np.array_equal(np.asarray(unit.beta), np.asarray(expected.beta), equal_nan = True)
+
+def test_categorize_Rt_matches_threshold_chain():
+    Rt = np.array([-1, 0, 0.5, 0.999, 1, 1.2, 1.4999, 1.5, 1.75, 1.9999, 2, 3, np.inf, np.nan])
+    assert categorize_Rt(Rt).tolist() == [categorize_reference(R) for R in Rt]
+    lanes = np.random.default_rng(0).uniform(0, 3, size = (12, 50))
+    assert categorize_Rt(lanes).tolist() == [[categorize_reference(R) for R in row] for row in lanes]
+
+def test_gradual_release_matches_reference():
+    rng = np.random.default_rng(0)
+    (last, categories) = (rng.integers(0, 4, size = (12, 50)), rng.integers(0, 4, size = (12, 50)))
+    (enforced, changed) = gradual_release(categories, last)
+    for (i, j) in np.ndindex(last.shape):
+        (old, new) = (last[i, j], categories[i, j])
+        assert changed[i, j] == (old != new)
+        assert enforced[i, j] == (old - 1 if new < old - 1 else new)
+
+@pytest.mark.parametrize("policy", [simulate_adaptive_control, simulate_adaptive_control_MHA])
+def test_ensemble_lanes_match_scalar_runs(policy, expected_draws):
+    # with draws fixed at their means, each lane of an ensemble follows the policy exactly as a scalar run from its initial state would
+    (model, lockdown, migrations, R_m, beta_v, beta_m) = network_fixture()
+    I0 = np.array([20, 400, 2000])
+    ensemble = model(I0, VectorizedNetworkedSIR)
+    ensemble.rng = expected_draws
+    ensemble = policy(ensemble, 10, 120, lockdown, migrations, R_m, beta_v, beta_m)
+    lanes = []
+    for (lane, infected) in enumerate(I0):
+        scalar = model(infected)
+        for unit in scalar:
+            unit.rng = expected_draws
+        scalar = policy(scalar, 10, 120, lockdown, migrations, R_m, beta_v, beta_m)
+        lane_gantt = gantt_lane(ensemble.gantt, lane)
+        assert [entry[:3] for entry in lane_gantt] == [entry[:3] for entry in scalar.gantt]
+        assert np.allclose([entry[3] for entry in lane_gantt], [entry[3] for entry in scalar.gantt], rtol = 1e-12)
+        assert np.allclose(np.asarray(ensemble.I, dtype = float)[:, :, lane].T, [np.asarray(unit.I, dtype = float) for unit in scalar], rtol = 1e-12)
+        lanes.append([entry[2] for entry in lane_gantt])
+    assert len({tuple(lane) for lane in lanes}) > 1
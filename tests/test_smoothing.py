@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+from statsmodels.nonparametric.smoothers_lowess import lowess as sm_lowess
+
+from epimargin import smoothing
+from epimargin.smoothing import StreamingNotchedSmoother, box_filter_local, convolution, local_linear, notch_filter, notched_smoothing
+
+def panel(days = 200, series = 20, seed = 0):
+    """ weekly-seasonal counts where every series starts with a run of zeros of a different length """
+    rng = np.random.default_rng(seed)
+    seasonal = 1 + 0.5 * np.sin(2 * np.pi * np.arange(days)/7)
+    counts = rng.poisson(40 * seasonal[:, None], size = (days, series)).astype(float)
+    for (j, zeros) in enumerate(rng.integers(5, 60, size = series)):
+        counts[:zeros, j] = 0
+    counts[100:110, 0] = 0
+    return counts
+
+direct = [
+    notched_smoothing(5), notched_smoothing(7), notch_filter(), convolution("hamming", 7), convolution("uniform", 14), 
+    box_filter_local(5, 3), box_filter_local(9, None), local_linear(15), local_linear(21)
+]
+
+@pytest.mark.parametrize("smoother", direct)
+def test_batched_matches_per_series(smoother):
+    data = panel()
+    batch = smoother(data)
+    loop  = np.column_stack([smoother(data[:, j]) for j in range(data.shape[1])])
+    assert np.array_equal(batch, loop)
+
+@pytest.mark.parametrize("smoother", [convolution("uniform", 61), box_filter_local(45, 5), local_linear(45)])
+def test_long_windows_keep_zero_runs(smoother):
+    data = panel()
+    batch = smoother(data)
+    loop  = np.column_stack([smoother(data[:, j]) for j in range(data.shape[1])])
+    assert np.allclose(batch, loop, rtol = 1e-12, atol = 0)
+    assert np.array_equal(batch == 0, loop == 0)
+
+def test_convolve_time_matches_scipy():
+    from scipy.signal import convolve
+    data = panel(series = 3)
+    for window in (1, 2, 7, 8, 30):
+        kernel = np.hamming(window) if window > 2 else np.ones(window)
+        for mode in ("same", "valid"):
+            expected = np.column_stack([convolve(data[:, j], kernel, mode = mode) for j in range(3)])
+            assert np.allclose(smoothing.convolve_time(data, kernel, mode), expected, rtol = 1e-12, atol = 1e-12)
+
+def test_dataframes_keep_labels():
+    data = pd.DataFrame(panel(series = 3), index = pd.date_range("2020-03-01", periods = 200), columns = ["a", "b", "c"])
+    smoothed = notched_smoothing(7)(data)
+    assert smoothed.index.equals(data.index) and smoothed.columns.equals(data.columns)
+    assert np.array_equal(smoothed["b"].values, notched_smoothing(7)(data["b"]))
+
+def test_batched_smoothing_feeds_estimators():
+    estimators = pytest.importorskip("epimargin.estimators")
+    data = panel(series = 5)
+    smoother = notched_smoothing(5)
+    batch = smoother(data)
+    for j in range(data.shape[1]):
+        single  = estimators.analytical_MPVS(pd.Series(data[:, j]), smoother, totals = False)
+        batched = estimators.analytical_MPVS(pd.Series(data[:, j]), lambda _: batch[:, j], totals = False)
+        for (a, b) in zip(single[1:7], batched[1:7]):
+            assert np.array_equal(np.asarray(a), np.asarray(b))
+
+def trend(days = 300):
+    t = np.arange(days, dtype = float)
+    return 100 + 2 * t + 10 * np.sin(2 * np.pi * t/7) + 5 * np.cos(4 * np.pi * t/7 + 1)
+
+@pytest.mark.parametrize("window", [5, 7, 9])
+def test_streaming_matches_batch_after_lag(window):
+    series = trend()
+    streamed = StreamingNotchedSmoother(window)
+    output = np.array([streamed.push(day) for day in series])
+    t = np.arange(len(series), dtype = float)
+    # the batch smoother is zero-phase, so the causal output trails it by the group delay
+    expected = np.interp(t - streamed.lag, t, notched_smoothing(window)(series))
+    settled = slice(streamed.warmup, len(series) - window)
+    assert np.allclose(output[settled], expected[settled], rtol = 2e-4)
+    assert not np.allclose(output[:streamed.warmup], expected[:streamed.warmup], rtol = 2e-4)
+
+@pytest.mark.parametrize("window", [3, 7, 14, 21])
+def test_streaming_warmup(window):
+    # on a straight line the settled output is the line delayed by lag, so what remains is the start-up transient
+    t = np.arange(120, dtype = float)
+    streamed = StreamingNotchedSmoother(window)
+    transient = np.abs(streamed.push(100 + 2 * t) - (100 + 2 * (t - streamed.lag)))
+    assert np.all(transient[streamed.warmup:] < 1e-3 * transient[0])
+    assert transient[window] > 1e-3 * transient[0]
+
+def test_streaming_reproduces_constant_series_from_first_day():
+    series = np.full(60, 25.0)
+    streamed = StreamingNotchedSmoother(7).push(series)
+    assert np.allclose(streamed, 25.0, rtol = 1e-12)
+    # the batch smoother agrees once its own zero-padded start is behind it
+    assert np.allclose(streamed[3:], notched_smoothing(7)(series)[3:], rtol = 1e-12)
+
+def test_streaming_pushes_match_single_push():
+    series = trend(120)[:, None] * np.array([1.0, 0.5, 2.0])
+    whole = StreamingNotchedSmoother(7).push(series)
+    daily = StreamingNotchedSmoother(7)
+    first = np.concatenate([daily.push(day[None]) for day in series[:50]])
+    resumed = StreamingNotchedSmoother.from_state(daily.state_dict())
+    rest = np.concatenate([resumed.push(series[50:80]), resumed.push(series[80:])])
+    assert np.array_equal(np.concatenate([first, rest]), whole)
+
+@pytest.mark.parametrize("days, window", [(200, 15), (200, 21), (365, 14), (60, 7), (30, 29)])
+def test_local_linear_matches_statsmodels_lowess(days, window):
+    rng = np.random.default_rng(days + window)
+    series = rng.poisson(50 * (1 + 0.5 * np.sin(2 * np.pi * np.arange(days)/7))) + np.linspace(0, 100, days)
+    expected = sm_lowess(series, np.arange(days), frac = window/days, it = 0, return_sorted = False)
+    assert np.allclose(local_linear(window)(series), expected, rtol = 0, atol = 1e-12 * np.abs(series).max())
+    panel = np.column_stack([series, 2 * series[::-1]])
+    assert np.allclose(local_linear(window)(panel)[:, 1], sm_lowess(panel[:, 1], np.arange(days), frac = window/days, it = 0, return_sorted = False), rtol = 0, atol = 2e-12 * np.abs(series).max())
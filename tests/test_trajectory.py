@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+from scipy.stats import poisson
+
+from epimargin.models import SIR
+from epimargin.trajectory import GROWTH_FACTOR, MIN_CAPACITY, QuantileTrajectory, Trajectory, reserve, set_dtype_policy, storage_dtype
+
+def test_storage_dtype():
+    assert storage_dtype(np.int64, "default") == np.int64
+    assert storage_dtype(np.int64, "compact") == np.int32
+    assert storage_dtype(np.float64, "compact") == np.float32
+    assert storage_dtype(np.complex128, "compact") == np.complex64
+    assert storage_dtype(bool, "compact") == bool
+    with pytest.raises(ValueError):
+        storage_dtype(float, "tiny")
+
+def test_compact_policy_narrows_and_widens():
+    trajectory = Trajectory(policy = "compact")
+    trajectory.append(1)
+    trajectory.append(np.arange(3))
+    assert trajectory.values.dtype == np.int32
+    trajectory.append(2.5)
+    assert trajectory.values.dtype == np.float32
+    assert trajectory.values.tolist() == [[1, 1, 1], [0, 1, 2], [2.5, 2.5, 2.5]]
+
+def test_set_policy_converts_stored_rows():
+    trajectory = Trajectory([1.5, 2.5])
+    assert trajectory.values.dtype == np.float64
+    trajectory.set_policy("compact")
+    assert trajectory.values.dtype == np.float32
+    trajectory.append(3.5)
+    assert trajectory.values.dtype == np.float32
+    assert trajectory.values.tolist() == [1.5, 2.5, 3.5]
+
+def test_compact_model_storage():
+    model = SIR("unit", 1e6, I0 = 1000, dT0 = 100, random_seed = 1, dtype = "compact").run(20)
+    assert np.asarray(model.I).dtype == np.int32
+    assert np.asarray(model.Rt).dtype == np.float32
+    with pytest.raises(ValueError):
+        set_dtype_policy(SIR("unit", 3e9, I0 = 1000, dT0 = 100), "compact", 3e9)
+
+def test_compact_policy_tolerance():
+    # per-day means across lanes differ from the float64 path only by sampling noise (see COMPACT_DTYPES)
+    sims = 2000
+    def run(dtype):
+        model = SIR("unit", 1e6, dT0 = np.full(sims, 20), Rt0 = 1.3, I0 = np.full(sims, 100), R0 = np.zeros(sims, int), D0 = np.zeros(sims, int),
+            S0 = np.full(sims, 10**6 - 100), random_seed = 3, dtype = dtype)
+        for _ in range(200):
+            model.parallel_forward_epi_step(num_sims = sims)
+        return model
+    (default, compact) = (run("default"), run("compact"))
+    for curve in ["I", "dT", "D", "total_cases"]:
+        (x, y) = (np.asarray(getattr(default, curve), dtype = float), np.asarray(getattr(compact, curve), dtype = float))
+        se = np.sqrt((x.var(axis = 1) + y.var(axis = 1))/sims)
+        assert np.all(np.abs(x.mean(axis = 1) - y.mean(axis = 1)) <= 3 * se), curve
+
+def test_append_fast_path_matches_widening():
+    trajectory = Trajectory()
+    for value in [1, 2, 2.5, np.array([1, 2]), np.array([3, 4]), np.array([[1], [2]]), 3j]:
+        trajectory.append(value)
+    assert trajectory.values.dtype == np.complex128
+    assert trajectory.values.shape == (7, 2, 1)
+    assert trajectory[1].tolist() == [[2], [2]]
+    assert trajectory[2].tolist() == [[2.5], [2.5]]
+
+def test_quantile_trajectory_evaluates_pending_before_append():
+    trajectory = QuantileTrajectory()
+    trajectory.append(0.0)
+    trajectory.defer(poisson, 0.5, 10)
+    trajectory.append(-1.0)
+    assert trajectory.values.tolist() == [0.0, 10.0, -1.0]
+
+def test_trajectory_grows_geometrically():
+    trajectory = Trajectory()
+    trajectory.append(0.0)
+    assert trajectory.capacity == MIN_CAPACITY
+    capacities = [trajectory.capacity]
+    for day in range(1, 100):
+        trajectory.append(float(day))
+        capacities.append(trajectory.capacity)
+    assert len(trajectory) == 100
+    assert sorted(set(capacities)) == [MIN_CAPACITY * GROWTH_FACTOR ** k for k in range(4)]
+    assert trajectory.values.tolist() == list(map(float, range(100)))
+
+def test_trajectory_reserve_avoids_reallocation():
+    trajectory = Trajectory([np.zeros(5)]).reserve(365)
+    data = trajectory._data
+    for _ in range(364):
+        trajectory.append(np.ones(5))
+    assert trajectory._data is data
+    assert np.asarray(trajectory).shape == (365, 5)
+
+def test_trajectory_indexing():
+    trajectory = Trajectory([np.array([1.0, 2.0]), np.array([3.0, 4.0]), np.array([5.0, 6.0])])
+    # integer indexing copies a row, like the lists trajectories replace
+    row = trajectory[-1]
+    row[0] = 100
+    assert trajectory[-1].tolist() == [5.0, 6.0]
+    # slices and views share the buffer
+    trajectory[1:][0][0] = 30
+    trajectory.view(0)[1] = 20
+    assert trajectory.values.tolist() == [[1.0, 20.0], [30.0, 4.0], [5.0, 6.0]]
+    trajectory[-1] = 7
+    trajectory[0, 0] = 8
+    assert trajectory.values.tolist() == [[8.0, 20.0], [30.0, 4.0], [7.0, 7.0]]
+    assert [r.tolist() for r in trajectory] == trajectory.values.tolist()
+    assert np.asarray(trajectory, dtype = int).dtype == int
+    with pytest.raises(IndexError):
+        trajectory[3]
+
+def test_trajectory_scalar_rows():
+    trajectory = Trajectory([1, 2])
+    assert trajectory[-1] == 2 and np.ndim(trajectory[-1]) == 0
+    trajectory.append(np.array([3, 4, 5]))
+    # earlier scalar rows are broadcast along the new lane axis
+    assert trajectory.values.tolist() == [[1, 1, 1], [2, 2, 2], [3, 4, 5]]
+
+def test_model_trajectories():
+    model = SIR("unit", 1e6, I0 = 1000, dT0 = 100, random_seed = 2)
+    reserve(model, 30)
+    capacity = model.S.capacity
+    model.run(30)
+    assert model.S.capacity == capacity
+    (S, I, R, D) = (np.asarray(curve) for curve in (model.S, model.I, model.R, model.D))
+    assert S.shape == (31,)
+    assert np.all(S + I + R + D == S[0] + I[0] + R[0] + D[0])
+    assert model.I[-1] == I[-1]